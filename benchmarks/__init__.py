@@ -0,0 +1,30 @@
+"""
+Benchmarks for the gather engine. They run against an in-memory SQLite database and need no outside services.
+Run a benchmark as a module from the repository root, for example::
+
+    python -m benchmarks.identity_tracking
+"""
+import django
+from django.conf import settings
+
+
+def setup_django(installed_apps=()):
+    """
+    Configures a minimal in-memory SQLite project for the benchmarks.
+    """
+    if not settings.configured:
+        settings.configure(
+            SECRET_KEY='*',
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': ':memory:',
+                },
+            },
+            INSTALLED_APPS=(
+                'django.contrib.auth',
+                'django.contrib.contenttypes',
+                'deletion_side_effects',
+            ) + tuple(installed_apps),
+        )
+        django.setup()
@@ -0,0 +1,147 @@
+"""
+Measures gather_deletion_side_effects on synthetic cascade graphs. Every run reports the best wall time of the
+repeats, the peak memory traced by tracemalloc during a separate gather and the number of queries::
+
+    python -m benchmarks.gather --graphs fan_out diamond --objects 1000 100000 --handlers list queryset
+
+Results can be saved as a JSON baseline and compared with the runs of another version::
+
+    python -m benchmarks.gather --save baseline.json
+    python -m benchmarks.gather --compare baseline.json
+
+See benchmarks.graphs for the shapes of the graphs. The width is the number of children per node of fan_out graphs
+and the number of nodes per level of the other graphs.
+"""
+import argparse
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+import django
+
+from benchmarks import setup_django
+from benchmarks.graphs import GRAPHS
+
+
+def run(graph, num_objects, width, kind, num_handlers, repeat):
+    """
+    Creates the graph and returns the measurements of gathering the side effects of deleting its roots. Database
+    errors are reported as the error of the run.
+    """
+    from benchmarks.graphs import create_graph, make_handlers
+    from benchmarks.models import Node
+    from django.db import DatabaseError
+    from deletion_side_effects.deletion_side_effects import (
+        _DELETION_SIDE_EFFECTS, gather_deletion_side_effects, register_deletion_side_effects
+    )
+    from deletion_side_effects.profiling import count_queries
+
+    result = {
+        'graph': graph,
+        'objects': num_objects,
+        'width': width,
+        'handlers': kind,
+        'num_handlers': num_handlers,
+    }
+
+    root_ids = create_graph(graph, num_objects, width)
+    _DELETION_SIDE_EFFECTS.clear()
+    register_deletion_side_effects(*make_handlers(kind, num_handlers))
+
+    def gather():
+        return gather_deletion_side_effects(Node, list(Node.objects.filter(id__in=root_ids)))
+
+    try:
+        timings = []
+        for _ in range(repeat):
+            gc.collect()
+            with count_queries() as counter:
+                start = time.perf_counter()
+                side_effects = gather()
+                timings.append(time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            gather()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except DatabaseError as exc:
+        result['error'] = str(exc)
+        return result
+    finally:
+        _DELETION_SIDE_EFFECTS.clear()
+
+    result.update({
+        'seconds': min(timings),
+        'peak_bytes': peak,
+        'queries': counter.count,
+        'side_effect_objs': sum(len(side_effect['side_effect_objs']) for side_effect in side_effects),
+    })
+    return result
+
+
+def get_key(result):
+    return tuple(result[field] for field in ('graph', 'objects', 'width', 'handlers', 'num_handlers'))
+
+
+def format_ratio(value, baseline_value):
+    return '{0:.2f}x'.format(value / baseline_value) if baseline_value else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--graphs', nargs='+', choices=sorted(GRAPHS), default=sorted(GRAPHS))
+    parser.add_argument('--objects', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--handlers', nargs='+', choices=['list', 'queryset'], default=['list'])
+    parser.add_argument('--num-handlers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='Saves the results as a JSON baseline to this path')
+    parser.add_argument('--compare', help='Compares the results with the JSON baseline at this path')
+    args = parser.parse_args()
+
+    setup_django(installed_apps=('benchmarks',))
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = {get_key(result): result for result in json.load(baseline_file)['results']}
+
+    print('{0:<10}{1:>10}{2:>10}{3:>10}{4:>12}{5:>12}{6:>10}{7:>12}{8:>10}'.format(
+        'graph', 'objects', 'handlers', 'seconds', 'peak MiB', 'queries', 'reported', 'vs seconds', 'vs peak'))
+
+    results = []
+    for graph in args.graphs:
+        for num_objects in args.objects:
+            for kind in args.handlers:
+                result = run(graph, num_objects, args.width, kind, args.num_handlers, args.repeat)
+                results.append(result)
+                if 'error' in result:
+                    print('{0:<10}{1:>10}{2:>10}  error: {3}'.format(graph, num_objects, kind, result['error']))
+                    continue
+
+                baseline_result = baseline.get(get_key(result), {})
+                print('{0:<10}{1:>10}{2:>10}{3:>10.3f}{4:>12.1f}{5:>12}{6:>10}{7:>12}{8:>10}'.format(
+                    graph, num_objects, kind, result['seconds'], result['peak_bytes'] / 2 ** 20, result['queries'],
+                    result['side_effect_objs'], format_ratio(result['seconds'], baseline_result.get('seconds')),
+                    format_ratio(result['peak_bytes'], baseline_result.get('peak_bytes'))))
+
+    if args.save:
+        from deletion_side_effects.version import __version__
+        with open(args.save, 'w') as baseline_file:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'results': results,
+            }, baseline_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Generators of synthetic cascade graphs and of the handlers that walk them. A graph is made of Node rows connected
+by Edge rows, and deleting a node cascades to the targets of its outgoing edges. Node ids start at 1.
+
+Every generator takes the number of objects and a width and returns a tuple of the ids of the root nodes and an
+iterator of (source id, target id) edges:
+
+* fan_out - A tree where every node has width children.
+* depth - Levels of width nodes where every node cascades to one node of the next level.
+* diamond - Levels of width nodes where every node cascades to two nodes of the next level, so that every node is
+  reached through two paths.
+* cycles - The depth graph where every node also cascades back to a node of the previous level and the last level
+  cascades back to the roots.
+"""
+from itertools import islice
+
+from deletion_side_effects.deletion_side_effects import BaseDeletionSideEffects
+
+
+# The maximum number of ids passed to a single query, which stays below the SQLite variable limit
+QUERY_CHUNK_SIZE = 10000
+
+
+def fan_out(num_objects, width):
+    return [1], ((((child - 1) // width) + 1, child + 1) for child in range(1, num_objects))
+
+
+def depth(num_objects, width):
+    return list(range(1, width + 1)), ((node, node + width) for node in range(1, num_objects - width + 1))
+
+
+def diamond(num_objects, width):
+    def iter_edges():
+        for node in range(1, num_objects - width + 1):
+            level_start = (node - 1) // width * width + 1
+            yield node, node + width
+            if width > 1:
+                yield node, level_start + width + (node - level_start + 1) % width
+
+    return list(range(1, width + 1)), iter_edges()
+
+
+def cycles(num_objects, width):
+    num_objects = num_objects // width * width
+
+    def iter_edges():
+        roots, edges = depth(num_objects, width)
+        yield from edges
+        for node in range(width + 1, num_objects + 1):
+            yield node, node - width
+        for node in range(num_objects - width + 1, num_objects + 1):
+            yield node, node - num_objects + width
+
+    return list(range(1, width + 1)), iter_edges()
+
+
+GRAPHS = {
+    'fan_out': fan_out,
+    'depth': depth,
+    'diamond': diamond,
+    'cycles': cycles,
+}
+
+
+def create_graph(graph, num_objects, width, batch_size=QUERY_CHUNK_SIZE):
+    """
+    Creates the rows of a graph and returns the ids of its roots. Existing rows are deleted first.
+    """
+    from benchmarks.models import Edge, Node
+
+    Edge.objects.all().delete()
+    Node.objects.all().delete()
+
+    for start in range(1, num_objects + 1, batch_size):
+        Node.objects.bulk_create([Node(id=node) for node in range(start, min(start + batch_size, num_objects + 1))])
+
+    roots, edges = GRAPHS[graph](num_objects, width)
+    while True:
+        batch = [Edge(source_id=source, target_id=target) for source, target in islice(edges, batch_size)]
+        if not batch:
+            break
+        Edge.objects.bulk_create(batch)
+
+    return roots
+
+
+def get_targets(deleted_objs):
+    """
+    Returns the targets of the edges of the deleted nodes, querying in chunks of ids
+    """
+    from benchmarks.models import Node
+
+    ids = [obj.id for obj in deleted_objs]
+    return [
+        node
+        for start in range(0, len(ids), QUERY_CHUNK_SIZE)
+        for node in Node.objects.filter(incoming_edges__source_id__in=ids[start:start + QUERY_CHUNK_SIZE])
+    ]
+
+
+def make_handlers(kind='list', num_handlers=1):
+    """
+    Returns num_handlers handler classes for nodes. The first handler reports and cascades to the targets of the
+    deleted nodes. The other handlers only report them, which measures the cost of every additional handler. List
+    handlers evaluate the targets while queryset handlers chain them lazily.
+    """
+    from benchmarks.models import Node
+
+    class ListNodeDeletionSideEffects(BaseDeletionSideEffects):
+        deleted_obj_class = Node
+
+        def get_side_effects(self, deleted_objs):
+            targets = get_targets(deleted_objs)
+            return targets, targets if self.cascades else []
+
+        def get_side_effect_message(self, side_effect_objs):
+            return '{0} nodes deleted'.format(len(side_effect_objs))
+
+    class QuerySetNodeDeletionSideEffects(ListNodeDeletionSideEffects):
+        uses_querysets = True
+
+        def get_side_effects(self, deleted_objs):
+            targets = Node.objects.filter(incoming_edges__source__in=deleted_objs)
+            return targets, targets if self.cascades else []
+
+    base_class = {'list': ListNodeDeletionSideEffects, 'queryset': QuerySetNodeDeletionSideEffects}[kind]
+    return [
+        type('{0}{1}'.format(base_class.__name__, index), (base_class,), {'cascades': index == 0})
+        for index in range(num_handlers)
+    ]
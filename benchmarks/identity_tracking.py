@@ -0,0 +1,100 @@
+"""
+Measures the memory used to track the identity of deleted objects during a gather. The cascade is made of unsaved
+ContentType instances, so no database rows are needed. Each level of the cascade creates fresh instances, which
+is what happens when handlers query the next level.
+
+Compares the retained size of a set of model instances, which is how deleted objects used to be tracked, with the
+per class pk sets the gather engine uses now, and reports the peak memory of a full gather::
+
+    python -m benchmarks.identity_tracking --objects 1000000 --levels 100
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+
+
+def measure(func):
+    """
+    Returns the result of the function, the memory retained by the result, the peak memory and the wall time.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def run(num_objects, num_levels):
+    from django.contrib.contenttypes.models import ContentType
+
+    from deletion_side_effects.deletion_side_effects import (
+        BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, _DeletionSideEffectsGatherer, _get_identity,
+        register_deletion_side_effects
+    )
+
+    per_level = max(num_objects // num_levels, 1)
+
+    def make_level(level):
+        start = level * per_level
+        return [ContentType(id=pk) for pk in range(start + 1, start + per_level + 1)]
+
+    def track_instances():
+        tracked = set()
+        for level in range(num_levels):
+            tracked.update(make_level(level))
+        return tracked
+
+    def track_keys():
+        tracked = {}
+        for level in range(num_levels):
+            for obj in make_level(level):
+                tracked_class, key = _get_identity(obj)
+                tracked.setdefault(tracked_class, set()).add(key)
+        return tracked
+
+    class ChainDeletionSideEffects(BaseDeletionSideEffects):
+        deleted_obj_class = ContentType
+
+        def get_side_effects(self, deleted_objs):
+            next_level = deleted_objs[0].id // per_level + 1
+            return [], make_level(next_level) if next_level < num_levels else []
+
+    _DELETION_SIDE_EFFECTS.clear()
+    register_deletion_side_effects(ChainDeletionSideEffects)
+
+    rows = []
+    for name, func in (
+        ('set of instances', track_instances),
+        ('per class pk sets', track_keys),
+        ('full gather', lambda: _DeletionSideEffectsGatherer().gather(ContentType, make_level(0))),
+    ):
+        result, retained, peak, elapsed = measure(func)
+        rows.append((name, retained, peak, elapsed))
+        del result
+
+    _DELETION_SIDE_EFFECTS.clear()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--objects', type=int, default=1000000)
+    parser.add_argument('--levels', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+
+    print('{0} objects over {1} levels'.format(args.objects, args.levels))
+    print('{0:<20}{1:>16}{2:>16}{3:>12}'.format('tracking', 'retained MiB', 'peak MiB', 'seconds'))
+    for name, retained, peak, elapsed in run(args.objects, args.levels):
+        print('{0:<20}{1:>16.1f}{2:>16.1f}{3:>12.2f}'.format(name, retained / 2 ** 20, peak / 2 ** 20, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+from django.db import models
+
+
+class Node(models.Model):
+    """
+    A node of a synthetic cascade graph
+    """
+    pass
+
+
+class Edge(models.Model):
+    """
+    A directed edge of a synthetic cascade graph. Deleting the source cascades to the target
+    """
+    source = models.ForeignKey(Node, related_name='outgoing_edges', on_delete=models.CASCADE)
+    target = models.ForeignKey(Node, related_name='incoming_edges', on_delete=models.CASCADE)
@@ -1,3 +1,10 @@
 # flake8: noqa
-from .deletion_side_effects import register_deletion_side_effects, gather_deletion_side_effects, BaseDeletionSideEffects
+from .deletion_side_effects import (
+    register_deletion_side_effects, register_lazy_deletion_side_effects, autodiscover_deletion_side_effects,
+    gather_deletion_side_effects, summarize_deletion_side_effects,
+    iter_deletion_side_effects, agather_deletion_side_effects, BaseDeletionSideEffects,
+    BaseAsyncDeletionSideEffects, DeletionSideEffectsContext, DeletionSideEffectsRecord, DeletionSideEffectsResult,
+    DeletionSideEffectsBudget, DeletionSideEffect, gather_deletion_side_effects_bulk
+)
+from .deletion import delete_with_side_effects, DeletionSideEffectsChanged
 from .version import __version__
@@ -0,0 +1,148 @@
+"""
+Admin delete confirmation pages that are built from the registered handlers. Django's confirmation pages collect
+every related object into a nested list, which times out for large cascades and ignores the handlers. The
+DeletionSideEffectsAdminMixin summarizes the side effects instead and links to paginated pages of their objects,
+which are only gathered when they are opened.
+"""
+from django.contrib.admin.utils import quote
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import PROTECT, RESTRICT, Model
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.utils.http import urlencode
+from django.utils.text import capfirst
+
+from deletion_side_effects.auto_cascade import get_delete_relations
+from deletion_side_effects.deletion_side_effects import (
+    _CountedSideEffectObjs, _get_handler_path, _summarize_deletion_side_effects
+)
+
+
+class DeletionSideEffectsAdminMixin(object):
+    """
+    A ModelAdmin mixin that renders the confirmation pages of the delete view and of the delete selected action
+    from summarize_deletion_side_effects. The pages list the deleted objects along with the message and the count
+    of every side effect, which links to a paginated page of the side effect objects.
+
+    Deleted objects that are directly referenced by PROTECT or RESTRICT relations are listed as protected. The delete
+    permissions of the models the handlers cascade to are checked on the admins they are registered with. The page of
+    a side effect only calls its handler and the handlers that can cascade to it.
+    """
+    # The keyword arguments of the gathers of the confirmation pages, such as using or max_memory_keys
+    deletion_side_effects_gather_kwargs = {}
+
+    # Whether the confirmation pages walk the cascades that reach no handler as well, so that the delete permissions
+    # of every cascaded model are checked. This runs the queries of the whole cascade on every confirmation page
+    deletion_side_effects_complete = False
+
+    # The number of side effect objects, or of protected objects, shown on a page
+    deletion_side_effects_per_page = 100
+
+    deletion_side_effects_template = 'admin/deletion_side_effects/side_effect_objects.html'
+
+    def get_urls(self):
+        return [
+            path(
+                'deletion-side-effects/', self.admin_site.admin_view(self.deletion_side_effects_view),
+                name='{0}_{1}_deletion_side_effects'.format(self.opts.app_label, self.opts.model_name),
+            ),
+        ] + super().get_urls()
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Returns the deleted objects, the summary, the missing permissions and the protected objects of the
+        confirmation pages. The deleted objects are followed by a link to the objects of every side effect.
+        """
+        objs = list(objs)
+        url = reverse(
+            'admin:{0}_{1}_deletion_side_effects'.format(self.opts.app_label, self.opts.model_name),
+            current_app=self.admin_site.name)
+        ids = [('id', obj.pk) for obj in objs]
+
+        deleted_objects = [self._format_obj(obj) for obj in objs]
+        summary, gatherer = _summarize_deletion_side_effects(
+            self.model, objs, complete=self.deletion_side_effects_complete, **self.deletion_side_effects_gather_kwargs)
+        for side_effects_class, msg, count, _ in summary:
+            query = urlencode(ids + [('handler', _get_handler_path(side_effects_class))])
+            deleted_objects.append(format_html('{} (<a href="{}?{}">{} objects</a>)', msg, url, query, count))
+
+        perms_needed = self._get_perms_needed(request, gatherer.get_deleted_models())
+        return deleted_objects, {self.opts.verbose_name_plural: len(objs)}, perms_needed, self._get_protected(objs)
+
+    def deletion_side_effects_view(self, request):
+        """
+        Renders a page of the objects of a side effect. The deleted objects are given as id parameters and the
+        handler as the path of its class. Only that handler and the handlers that can cascade to it are called, and
+        only its side effects are counted and rendered.
+        """
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+
+        try:
+            objs = list(self.get_queryset(request).filter(pk__in=request.GET.getlist('id')))
+        except (ValueError, ValidationError):
+            raise Http404('Invalid object ids')
+
+        handler_path = request.GET.get('handler')
+        summary, _ = _summarize_deletion_side_effects(
+            self.model, objs, handler_path=handler_path, **self.deletion_side_effects_gather_kwargs)
+        if not summary:
+            raise Http404('No side effects of {0}'.format(handler_path))
+        _, msg, count, side_effect_objs = summary[0]
+
+        # Counted side effects are paginated in the database
+        if isinstance(side_effect_objs, _CountedSideEffectObjs):
+            side_effect_objs = side_effect_objs.queryset.order_by('pk')
+        page = Paginator(side_effect_objs, self.deletion_side_effects_per_page).get_page(request.GET.get('page'))
+
+        query = request.GET.copy()
+        query.pop('page', None)
+        return TemplateResponse(request, self.deletion_side_effects_template, dict(
+            self.admin_site.each_context(request),
+            opts=self.opts,
+            title=msg,
+            page=page,
+            side_effect_objs=[self._format_obj(obj) for obj in page],
+            query=query.urlencode(),
+        ))
+
+    def _get_perms_needed(self, request, model_classes):
+        """
+        Returns the verbose names of the deleted models that are registered on the site without delete permission
+        """
+        perms_needed = set()
+        for model_class in model_classes:
+            model_admin = self.admin_site._registry.get(model_class)
+            if model_admin is not None and not model_admin.has_delete_permission(request):
+                perms_needed.add(model_class._meta.verbose_name)
+
+        return perms_needed
+
+    def _get_protected(self, objs):
+        protected = []
+        for related in get_delete_relations(self.model):
+            if related.on_delete in (PROTECT, RESTRICT):
+                protected.extend(
+                    self._format_obj(obj)
+                    for obj in related.related_model._base_manager.filter(
+                        **{'{0}__in'.format(related.field.name): objs})[:self.deletion_side_effects_per_page]
+                )
+
+        return protected
+
+    def _format_obj(self, obj):
+        """
+        Returns the display of an object, which links to its change page if its model is registered on the site
+        """
+        if not isinstance(obj, Model):
+            return str(obj)
+        elif not self.admin_site.is_registered(obj.__class__):
+            return '{0}: {1}'.format(capfirst(obj._meta.verbose_name), obj)
+
+        url = reverse(
+            'admin:{0}_{1}_change'.format(obj._meta.app_label, obj._meta.model_name), args=(quote(obj.pk),),
+            current_app=self.admin_site.name)
+        return format_html('{}: <a href="{}">{}</a>', capfirst(obj._meta.verbose_name), url, obj)
@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DeletionSideEffectsConfig(AppConfig):
     name = 'deletion_side_effects'
     verbose_name = 'Django Deletion Side Effects'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from deletion_side_effects.deletion_side_effects import (
+            _DELETION_SIDE_EFFECTS, autodiscover_deletion_side_effects
+        )
+
+        if getattr(settings, 'DELETION_SIDE_EFFECTS_AUTODISCOVER', False):
+            autodiscover_deletion_side_effects()
+
+        if getattr(settings, 'DELETION_SIDE_EFFECTS_AUTO_CASCADE', False):
+            from deletion_side_effects.auto_cascade import register_auto_cascade_deletion_side_effects
+            register_auto_cascade_deletion_side_effects()
+
+        # Resolve the handlers of every model up front. Handlers registered later rebuild the table
+        _DELETION_SIDE_EFFECTS.freeze()
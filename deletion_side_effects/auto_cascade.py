@@ -0,0 +1,196 @@
+"""
+Handlers that are derived from the on_delete relations of the models. Django deletes the rows that reference a
+deleted object with on_delete=CASCADE and clears the references of on_delete=SET_NULL. Instead of writing a handler
+for every such relation, register_auto_cascade_deletion_side_effects builds the relation graph of the models and
+registers a cascade handler for every model with CASCADE children and a side effects handler for every SET_NULL
+relation. It is called when the app is ready if the DELETION_SIDE_EFFECTS_AUTO_CASCADE setting is True.
+"""
+from functools import reduce
+import operator
+
+from django.apps import apps
+from django.db.models import CASCADE, SET_NULL, Q
+
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _can_have_side_effects, register_deletion_side_effects
+)
+
+
+# The handlers built for a model, keyed on model class, so that building them again registers the same classes
+_AUTO_CASCADE_HANDLERS = {}
+
+
+def get_relation_graph(models=None):
+    """
+    Returns the on_delete relation graph of the models, or of every installed model. The graph is keyed on model
+    class. Its values are dictionaries keyed on CASCADE and SET_NULL whose values map the models that reference the
+    model to the names of their referencing fields. The relations are the ones Django's deletion collector follows.
+    Other on_delete behaviors are ignored.
+    """
+    models = models if models is not None else apps.get_models(include_auto_created=True)
+    graph = {}
+    for model_class in models:
+        relations = {CASCADE: {}, SET_NULL: {}}
+        for related in get_delete_relations(model_class):
+            on_delete = related.field.remote_field.on_delete
+            if on_delete in relations:
+                relations[on_delete].setdefault(related.related_model, []).append(related.field.name)
+
+        graph[model_class] = relations
+
+    return graph
+
+
+def get_delete_relations(model_class):
+    """
+    Returns the reverse relations of the model that Django's deletion collector follows when one of its instances
+    is deleted
+    """
+    return [
+        related
+        for related in model_class._meta.get_fields(include_hidden=True)
+        if related.auto_created and not related.concrete and (related.one_to_one or related.one_to_many)
+    ]
+
+
+def _get_relation_condition(field_names, deleted_objs):
+    """
+    Returns the condition that matches rows referencing the deleted objects through any of the fields
+    """
+    return reduce(operator.or_, (Q(**{'{0}__in'.format(field_name): deleted_objs}) for field_name in field_names))
+
+
+def _get_referencing_objs(related_model, field_names, deleted_objs, using):
+    """
+    Returns the rows of the related model that reference the deleted objects through any of the fields, keyed on
+    deleted object. The rows are loaded with a single query from the database the deletion is gathered on.
+    """
+    fields = [related_model._meta.get_field(field_name) for field_name in field_names]
+    deleted_objs_by_value = [
+        (field, {getattr(deleted_obj, field.target_field.attname): deleted_obj for deleted_obj in deleted_objs})
+        for field in fields
+    ]
+
+    referencing_objs = {deleted_obj: [] for deleted_obj in deleted_objs}
+    manager = related_model._base_manager.db_manager(using)
+    for obj in manager.filter(_get_relation_condition(field_names, deleted_objs)):
+        referenced_objs = {
+            by_value[getattr(obj, field.attname)]
+            for field, by_value in deleted_objs_by_value
+            if getattr(obj, field.attname) in by_value
+        }
+        for deleted_obj in referenced_objs:
+            referencing_objs[deleted_obj].append(obj)
+
+    return referencing_objs
+
+
+class AutoCascadeDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    Cascades to the rows that reference the deleted objects with on_delete=CASCADE. The deleted objects are passed as
+    a queryset and one pk only query is run per referencing model, which combines all of its referencing fields.
+    Referencing models that cannot lead to side effects are not queried since nothing would be walked, unless the
+    gather collects every deleted object. Bulk gathers load the referencing rows so that they can be attributed to
+    deleted objects.
+    """
+    uses_querysets = True
+    has_side_effects = False
+
+    # The names of the referencing fields, keyed on referencing model
+    relations = {}
+
+    def get_side_effects(self, deleted_objs):
+        cascade_deleted_objs = []
+        for related_model, field_names in self.relations.items():
+            if not _can_have_side_effects(related_model, self.context.handler_path) and not self.context.complete:
+                continue
+
+            manager = related_model._base_manager.db_manager(self.context.using)
+            pks = list(manager.filter(_get_relation_condition(field_names, deleted_objs)).values_list('pk', flat=True))
+            if pks:
+                cascade_deleted_objs.append(manager.filter(pk__in=pks))
+
+        return None, cascade_deleted_objs
+
+    def get_side_effects_by_obj(self, deleted_objs):
+        side_effects = {deleted_obj: (None, []) for deleted_obj in deleted_objs}
+        for related_model, field_names in self.relations.items():
+            if not _can_have_side_effects(related_model, self.context.handler_path) and not self.context.complete:
+                continue
+
+            referencing_objs = _get_referencing_objs(related_model, field_names, deleted_objs, self.context.using)
+            for deleted_obj, objs in referencing_objs.items():
+                side_effects[deleted_obj][1].extend(objs)
+
+        return side_effects
+
+
+class AutoSetNullDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    Reports the rows that reference the deleted objects with on_delete=SET_NULL as side effects. The rows are
+    returned as a queryset, so they are only loaded when the side effects are accessed.
+    """
+    uses_querysets = True
+    cascades_to = []
+
+    # The referencing model and the names of its referencing fields
+    related_model = None
+    field_names = []
+
+    def get_side_effects(self, deleted_objs):
+        manager = self.related_model._base_manager.db_manager(self.context.using)
+        return manager.filter(_get_relation_condition(self.field_names, deleted_objs)), []
+
+    def get_side_effects_by_obj(self, deleted_objs):
+        return {
+            deleted_obj: (objs, [])
+            for deleted_obj, objs in _get_referencing_objs(
+                self.related_model, self.field_names, deleted_objs, self.context.using).items()
+        }
+
+    def get_side_effect_message(self, side_effect_objs):
+        opts = self.related_model._meta
+        return '{0} {1} will have {2} cleared'.format(
+            len(side_effect_objs), opts.verbose_name if len(side_effect_objs) == 1 else opts.verbose_name_plural,
+            ' and '.join(str(opts.get_field(field_name).verbose_name) for field_name in self.field_names))
+
+
+def _build_handlers(model_class, relations):
+    handlers = []
+    if relations[CASCADE]:
+        handlers.append(type('{0}AutoCascadeDeletionSideEffects'.format(model_class.__name__), (
+            AutoCascadeDeletionSideEffects,
+        ), {
+            '__module__': __name__,
+            'deleted_obj_class': model_class,
+            'relations': relations[CASCADE],
+            'cascades_to': list(relations[CASCADE]),
+        }))
+
+    for related_model, field_names in relations[SET_NULL].items():
+        handlers.append(type('{0}{1}AutoSetNullDeletionSideEffects'.format(
+            model_class.__name__, related_model.__name__
+        ), (AutoSetNullDeletionSideEffects,), {
+            '__module__': __name__,
+            'deleted_obj_class': model_class,
+            'related_model': related_model,
+            'field_names': field_names,
+        }))
+
+    return handlers
+
+
+def register_auto_cascade_deletion_side_effects(models=None):
+    """
+    Builds and registers the handlers of the on_delete relations of the models, or of every installed model.
+    Returns the registered handler classes. Handlers are built once per model, so registering them again has no
+    effect.
+    """
+    handlers = []
+    for model_class, relations in get_relation_graph(models).items():
+        if model_class not in _AUTO_CASCADE_HANDLERS:
+            _AUTO_CASCADE_HANDLERS[model_class] = _build_handlers(model_class, relations)
+        handlers.extend(_AUTO_CASCADE_HANDLERS[model_class])
+
+    register_deletion_side_effects(*handlers)
+    return handlers
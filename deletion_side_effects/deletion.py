@@ -0,0 +1,187 @@
+"""
+Deletes objects along with every object they cascade to, using the deleted objects found by a gather instead of
+walking the relations a second time with Django's deletion collector.
+"""
+from django.db import router, transaction
+from django.db.models import DO_NOTHING, SET_NULL
+from django.db.models.sql import DeleteQuery
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
+
+from deletion_side_effects.auto_cascade import get_delete_relations
+from deletion_side_effects.deletion_side_effects import (
+    DeletionSideEffectsResult, _DeletionSideEffectsGatherer, _get_root_pks, _invalidate_cached_side_effects,
+    _iter_chunks, _render_side_effects
+)
+
+
+class DeletionSideEffectsChanged(Exception):
+    """
+    Raised by delete_with_side_effects when the database no longer matches the gathered objects
+    """
+    pass
+
+
+def _add_parents(deleted_pks):
+    """
+    Adds the rows of the parents of multi-table inheritance models, which share the pk of their child
+    """
+    for model_class in list(deleted_pks):
+        for parent_class in model_class._meta.parents:
+            deleted_pks.setdefault(parent_class._meta.concrete_model, set()).update(deleted_pks[model_class])
+
+
+def _get_delete_order(model_classes):
+    """
+    Returns the models in the order their rows are deleted, so that rows are deleted before the rows they reference.
+    Models that reference each other are deleted in the order of their labels.
+    """
+    references = {
+        model_class: {
+            field.remote_field.model._meta.concrete_model
+            for field in model_class._meta.concrete_fields
+            if field.remote_field is not None
+        }
+        for model_class in model_classes
+    }
+
+    ordered = []
+    remaining = sorted(model_classes, key=lambda model_class: model_class._meta.label)
+    while remaining:
+        unreferenced = [
+            model_class
+            for model_class in remaining
+            if not any(model_class in references[other] for other in remaining if other is not model_class)
+        ]
+        ordered.extend(unreferenced or remaining)
+        remaining = [model_class for model_class in remaining if model_class not in ordered]
+
+    return ordered
+
+
+def _verify(deleted_pks, using):
+    """
+    Raises DeletionSideEffectsChanged if gathered rows no longer exist or if rows that are not gathered reference
+    them with an on_delete behavior other than SET_NULL or DO_NOTHING, for example because they were created since
+    the gather or because no handler cascades to them.
+    """
+    for model_class, pks in deleted_pks.items():
+        num_rows = sum(
+            model_class._base_manager.using(using).filter(pk__in=chunk).count()
+            for chunk in _iter_chunks(pks, GET_ITERATOR_CHUNK_SIZE)
+        )
+        if num_rows != len(pks):
+            raise DeletionSideEffectsChanged('{0} of {1} gathered {2} rows no longer exist'.format(
+                len(pks) - num_rows, len(pks), model_class._meta.label))
+
+        for related in get_delete_relations(model_class):
+            if related.field.remote_field.on_delete in (SET_NULL, DO_NOTHING):
+                continue
+
+            related_model = related.related_model._meta.concrete_model
+            for chunk in _iter_chunks(pks, GET_ITERATOR_CHUNK_SIZE):
+                referencing = related_model._base_manager.using(using).filter(
+                    **{'{0}__in'.format(related.field.name): chunk})
+                if related_model in deleted_pks:
+                    referencing = referencing.exclude(pk__in=deleted_pks[related_model])
+                if referencing.exists():
+                    raise DeletionSideEffectsChanged('{0} rows that were not gathered reference {1} rows'.format(
+                        related_model._meta.label, model_class._meta.label))
+
+
+def _set_null(deleted_pks, using):
+    """
+    Clears the references of rows that point to deleted rows with on_delete=SET_NULL
+    """
+    for model_class, pks in deleted_pks.items():
+        for related in get_delete_relations(model_class):
+            if related.field.remote_field.on_delete is not SET_NULL:
+                continue
+
+            related_model = related.related_model
+            for chunk in _iter_chunks(pks, GET_ITERATOR_CHUNK_SIZE):
+                related_model._base_manager.using(using).filter(
+                    **{'{0}__in'.format(related.field.name): chunk}).update(**{related.field.name: None})
+            _invalidate_cached_side_effects(related_model)
+
+
+def _get_previous_deleted_pks(obj_class, objs, side_effects):
+    """
+    Returns the deleted pks of a previous gather of the objects, which is extended with the objects it did not
+    gather. The side effects are loaded, since they can no longer be loaded after the deletion.
+    """
+    gatherer = side_effects._gatherer
+    if gatherer is None or not gatherer.complete:
+        raise ValueError(
+            'Only results of gather_deletion_side_effects with complete=True and extendable=True can be deleted')
+    if side_effects.truncated:
+        raise ValueError('Truncated results can not be deleted')
+    if side_effects._obj_class is not obj_class:
+        raise ValueError('The side effects were gathered for {0}, not {1}'.format(
+            side_effects._obj_class._meta.label, obj_class._meta.label))
+
+    # The previous gather deletes the cascades of all of its roots, so they must all be deleted now
+    objs, root_pks = _get_root_pks(objs)
+    if not side_effects._root_pks <= root_pks:
+        raise ValueError('The side effects were gathered for {0} roots that are not deleted'.format(
+            len(side_effects._root_pks - root_pks)))
+
+    deleted_pks = gatherer.get_deleted_pks()
+    gathered_pks = deleted_pks.get(obj_class._meta.concrete_model, set())
+    if not root_pks <= gathered_pks:
+        side_effects.extend_roots(objs)
+        deleted_pks = gatherer.get_deleted_pks()
+
+    for side_effect in side_effects:
+        side_effect.render()
+
+    return deleted_pks
+
+
+def delete_with_side_effects(obj_class, objs, verify=False, side_effects=None, **kwargs):
+    """
+    Gathers the side effects of deleting the objects and deletes them along with every object the handlers cascaded
+    to. The rows of each model are deleted with bulk DELETE ... WHERE pk IN queries, in dependency order and in a
+    single transaction. References of on_delete=SET_NULL relations are cleared and the parent rows of multi-table
+    inheritance models are deleted. The executor, context, use_cache and max_memory_keys keyword arguments are passed
+    to the gather, which walks cascades even if they reach no handler. The gather runs on the database the deletion
+    writes to.
+
+    Since the deleted objects are the ones found by the handlers, the handlers must cascade to every object Django
+    would delete, for example with DELETION_SIDE_EFFECTS_AUTO_CASCADE. When verify is True, the gathered rows are
+    checked at the start of the transaction and DeletionSideEffectsChanged is raised if rows no longer exist or if
+    rows that were not gathered still reference them.
+
+    Like QuerySet.update, the deletion does not call delete methods or send the pre_delete and post_delete
+    signals. Cached side effects of the deleted and updated models are invalidated.
+
+    The side effects of a previous gather, such as a preview, can be passed as side_effects to delete the objects
+    it found without gathering again. They must be gathered by gather_deletion_side_effects with complete=True and
+    extendable=True and must not be truncated. Objects that the previous gather did not reach are gathered on top of
+    it. Since the database may have changed since the previous gather, verify should be True unless the gather ran
+    in a transaction that is still open.
+
+    Returns the gathered side effects, whose side effects are loaded before the deletion. The number of deleted
+    rows, keyed on model label, is available as their num_deleted attribute.
+    """
+    using = router.db_for_write(obj_class)
+    if side_effects is not None:
+        deleted_pks = _get_previous_deleted_pks(obj_class, objs, side_effects)
+    else:
+        gatherer = _DeletionSideEffectsGatherer(complete=True, using=using, **kwargs)
+        side_effects = DeletionSideEffectsResult(_render_side_effects(gatherer.gather(obj_class, objs)))
+        deleted_pks = gatherer.get_deleted_pks()
+
+    _add_parents(deleted_pks)
+
+    side_effects.num_deleted = {}
+    with transaction.atomic(using=using):
+        if verify:
+            _verify(deleted_pks, using)
+
+        _set_null(deleted_pks, using)
+        for model_class in _get_delete_order(deleted_pks):
+            side_effects.num_deleted[model_class._meta.label] = DeleteQuery(model_class).delete_batch(
+                list(deleted_pks[model_class]), using)
+            _invalidate_cached_side_effects(model_class)
+
+    return side_effects
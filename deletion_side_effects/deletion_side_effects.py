@@ -1,71 +1,2012 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain, islice, takewhile
+from types import MappingProxyType
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+import uuid
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_delete, post_save
+from django.db.models import Model, Q, QuerySet, prefetch_related_objects
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
+from django.utils.module_loading import autodiscover_modules, import_string
+
+from deletion_side_effects.profiling import GatherProfile, HandlerCallProfile, count_queries
+from deletion_side_effects.routing import resolve_gather_database, use_gather_database
+from deletion_side_effects.spill import SpillStore
+from deletion_side_effects.signals import handler_called
+
+
+class _DispatchTable(object):
+    """
+    The immutable handler lookup table of a registry. The handlers of a class are the ones registered for any class
+    of its MRO, so the handlers of a proxy model include the ones of its concrete model. Handlers registered for a
+    proxy are only called for deleted objects of the proxy and of its subclasses. The handlers of the registered
+    classes and of every installed model are resolved when the table is built. Other classes are resolved on lookup.
+
+    The table also resolves which classes can have side effects from the cascades_to and has_side_effects attributes
+    of the handlers. A handler can have side effects if it declares them, if it does not declare the classes it
+    cascades to, or if it cascades to a class that can have side effects. Models with lazily registered handlers that
+    were not imported yet are assumed to have side effects. The handlers that can lead to calls of a given handler are
+    resolved the same way on first lookup.
+    """
+    def __init__(self, registry, lazy_models=()):
+        self._registry = {obj_class: frozenset(handlers) for obj_class, handlers in registry.items()}
+        self._lazy_models = tuple(lazy_models)
+
+        classes = set(self._registry)
+        if apps.ready:
+            classes.update(apps.get_models(include_auto_created=True))
+        self._handlers = MappingProxyType({obj_class: self._resolve(obj_class) for obj_class in classes})
+
+        self._productive_handlers = self._get_productive_handlers(
+            lambda handler: handler.has_side_effects or handler.cascades_to is None)
+        self._productive_classes = frozenset(
+            obj_class for obj_class in classes if self._is_productive(obj_class, self._productive_handlers))
+
+        # The handlers that can lead to calls of a handler, keyed on the path of the handler
+        self._reaching_handlers = {}
+        self._reaching_lock = threading.Lock()
+
+    def _get_productive_handlers(self, is_productive):
+        """
+        Returns the handlers for which is_productive is True, along with the handlers that cascade to a class with
+        one of these handlers. The set is grown until it no longer changes, which terminates on cyclic cascades.
+        """
+        handlers = {handler for class_handlers in self._registry.values() for handler in class_handlers}
+        productive_handlers = {handler for handler in handlers if is_productive(handler)}
+
+        num_productive_handlers = None
+        while num_productive_handlers != len(productive_handlers):
+            num_productive_handlers = len(productive_handlers)
+            productive_handlers.update(
+                handler
+                for handler in handlers - productive_handlers
+                if any(
+                    self._is_productive(cascade_class, productive_handlers)
+                    for cascade_class in get_cascade_classes(handler)
+                )
+            )
+
+        return frozenset(productive_handlers)
+
+    def _is_productive(self, obj_class, productive_handlers):
+        if any(issubclass(obj_class, model_class) for model_class in self._lazy_models):
+            return True
+        return any(handler in productive_handlers for handler in self.get_handlers(obj_class))
+
+    def _resolve(self, obj_class):
+        handlers = []
+        for resolved_class in obj_class.__mro__:
+            handlers.extend(
+                handler for handler in self._registry.get(resolved_class, ()) if handler not in handlers)
+        return tuple(handlers)
+
+    def get_handlers(self, obj_class):
+        """
+        Returns the handlers that are called for deleted objects of the class
+        """
+        handlers = self._handlers.get(obj_class)
+        return handlers if handlers is not None else self._resolve(obj_class)
+
+    def has_handlers(self, obj_class):
+        """
+        Returns whether any handler is called for deleted objects of the class
+        """
+        return bool(self.get_handlers(obj_class))
+
+    def can_have_side_effects(self, obj_class):
+        """
+        Returns whether deleted objects of the class can lead to side effects. Cascaded objects of other classes
+        are dropped by the walk.
+        """
+        if obj_class in self._handlers:
+            return obj_class in self._productive_classes
+        return self._is_productive(obj_class, self._productive_handlers)
+
+    def get_handlers_reaching(self, handler_path):
+        """
+        Returns the handlers whose calls can lead to calls of the handler with the given path. These are the handler
+        itself, the handlers that do not declare the classes they cascade to and the handlers that cascade to a class
+        with one of these handlers.
+        """
+        with self._reaching_lock:
+            if handler_path not in self._reaching_handlers:
+                self._reaching_handlers[handler_path] = self._get_productive_handlers(
+                    lambda handler: handler.cascades_to is None or _get_handler_path(handler) == handler_path)
+            return self._reaching_handlers[handler_path]
+
+    def can_reach(self, obj_class, handler_path):
+        """
+        Returns whether deleted objects of the class can lead to calls of the handler with the given path
+        """
+        return self._is_productive(obj_class, self.get_handlers_reaching(handler_path))
+
+
+class _HandlerRegistry(dict):
+    """
+    The registered handlers, keyed on the deleted_obj_class they were registered for. Lookups go through a
+    _DispatchTable that is built on first use, or when the app is ready, and rebuilt after the registry changes.
+
+    Handlers can also be registered lazily by dotted path for a model label. Their modules are imported and the
+    handlers registered the first time the handlers of a class the model dispatches to are looked up.
+    """
+    def __init__(self):
+        super().__init__()
+        self._dispatch_table = None
+
+        # The dotted paths of the lazily registered handlers, keyed on lower cased model label
+        self.lazy_paths = {}
+        self._lazy_lock = threading.RLock()
+
+    def register(self, side_effects_class):
+        self.setdefault(side_effects_class.deleted_obj_class, set()).add(side_effects_class)
+        self._dispatch_table = None
+
+    def register_lazy(self, model_label, handler_path):
+        with self._lazy_lock:
+            self.lazy_paths.setdefault(model_label.lower(), set()).add(handler_path)
+            self._dispatch_table = None
+
+    def clear(self):
+        super().clear()
+        self.lazy_paths = {}
+        self._dispatch_table = None
+
+    def get_handlers(self, obj_class):
+        """
+        Returns the handlers that are called for deleted objects of the class, importing the lazily registered
+        handlers of the class first
+        """
+        if self.lazy_paths:
+            self._load_lazy_handlers(obj_class)
+        return self.dispatch_table.get_handlers(obj_class)
+
+    def can_have_side_effects(self, obj_class):
+        return self.dispatch_table.can_have_side_effects(obj_class)
+
+    def get_handlers_reaching(self, handler_path):
+        return self.dispatch_table.get_handlers_reaching(handler_path)
+
+    def can_reach(self, obj_class, handler_path):
+        return self.dispatch_table.can_reach(obj_class, handler_path)
+
+    def _load_lazy_handlers(self, obj_class):
+        with self._lazy_lock:
+            for model_label in list(self.lazy_paths):
+                model_class = apps.get_model(model_label)
+                if not issubclass(obj_class, model_class):
+                    continue
+
+                # Paths are only dropped once their handler is registered, so that a failed import is raised again
+                # by the next lookup instead of leaving the class without its handlers
+                handler_paths = self.lazy_paths[model_label]
+                for handler_path in sorted(handler_paths):
+                    side_effects_class = import_string(handler_path)
+                    if side_effects_class.deleted_obj_class is not model_class:
+                        raise ValueError('Deletion side effects handler {0} must have {1} as deleted_obj_class'.format(
+                            handler_path, model_class._meta.label))
+                    register_deletion_side_effects(side_effects_class)
+                    handler_paths.discard(handler_path)
+                del self.lazy_paths[model_label]
+
+    def freeze(self):
+        """
+        Builds the dispatch table of the registered handlers
+        """
+        self._dispatch_table = _DispatchTable(
+            self, lazy_models=[apps.get_model(model_label) for model_label in self.lazy_paths])
+        return self._dispatch_table
+
+    @property
+    def dispatch_table(self):
+        return self._dispatch_table if self._dispatch_table is not None else self.freeze()
 
 
 # The global variable that holds all side effects that have been registered
-_DELETION_SIDE_EFFECTS = defaultdict(set)
+_DELETION_SIDE_EFFECTS = _HandlerRegistry()
+
+
+# The handlers whose cached results are invalidated when a model is saved or deleted, keyed on model class
+_CACHE_DEPENDENCIES = defaultdict(set)
+
+
+# The number of cascade levels whose querysets are chained as subqueries before the pks of the lazy batches and of
+# the queryset side effects are read. Every level nests the subqueries of the previous ones, so the queries of deep
+# lazy cascades would otherwise grow with every level until the database can no longer parse them
+MAX_LAZY_LEVELS = 3
+
+# The number of deleted pks a lazy batch excludes in its query. Batches of classes with more deleted pks have their
+# pks read and the deleted ones left out in Python, so that no query grows with the size of the cascade
+MAX_EXCLUDED_PKS = 500
+
+
+# A side effect that is yielded by iter_deletion_side_effects
+DeletionSideEffectsRecord = namedtuple('DeletionSideEffectsRecord', ['side_effects_class', 'side_effect_objs', 'level'])
+
+
+def register_deletion_side_effects(*deletion_side_effects_handlers):
+    """
+    Registers deletion side effect handler classes. The class must inherit BaseDeletionSideEffects
+    and define a deleted_obj_class variable.
+    """
+    for deletion_side_effects_handler in deletion_side_effects_handlers:
+        if not issubclass(deletion_side_effects_handler, BaseDeletionSideEffects):
+            raise ValueError('Deletion side effects handler must inherit BaseDeletionSideEffects')
+        elif deletion_side_effects_handler.deleted_obj_class is None:
+            raise ValueError('Deletion side effects handler must define a deleted_obj_class variable')
+
+        _DELETION_SIDE_EFFECTS.register(deletion_side_effects_handler)
+        _register_cache_dependencies(deletion_side_effects_handler)
+
+
+def register_lazy_deletion_side_effects(model_label, *handler_paths):
+    """
+    Registers deletion side effect handler classes by dotted path for the model with the given label, such as
+    'auth.Group'. The modules of the handlers are only imported the first time deleted objects of the model are
+    reached by a gather. The handlers must define the model as their deleted_obj_class.
+    """
+    for handler_path in handler_paths:
+        _DELETION_SIDE_EFFECTS.register_lazy(model_label, handler_path)
+
+
+def autodiscover_deletion_side_effects():
+    """
+    Imports the deletion_side_effects module of every installed app. The modules are expected to register their
+    handlers, preferably with register_lazy_deletion_side_effects so that the handler modules are not imported until
+    they are needed. It is called when the app is ready if the DELETION_SIDE_EFFECTS_AUTODISCOVER setting is True.
+    """
+    autodiscover_modules('deletion_side_effects')
+
+
+def _get_identity(obj):
+    """
+    Returns the class an object is tracked under during a gather along with its key in that class. Model instances
+    are tracked under their concrete model, which maps one to one to a content type, and keyed on their pk. This
+    keeps membership tests on plain pk values instead of going through Model.__hash__ and Model.__eq__. Other
+    objects are tracked under None and keyed on themselves.
+    """
+    if isinstance(obj, Model):
+        return obj._meta.concrete_model, obj.pk
+    return None, obj
+
+
+def _chain_querysets(model_class, querysets, pks=(), using=None):
+    """
+    Returns a single queryset of the model class that matches the given pks along with every row of the given
+    querysets. The querysets are chained as pk subqueries so that nothing is evaluated. The queryset runs on the
+    given database alias, or on the routed one if there is none.
+    """
+    condition = Q(pk__in=list(pks)) if pks else Q()
+    for queryset in querysets:
+        condition |= Q(pk__in=queryset.values('pk'))
+
+    return model_class._default_manager.db_manager(using).filter(condition)
+
+
+def _split_objs_and_querysets(objs):
+    """
+    Handlers may return a list of objects, a queryset or a list that contains querysets. Splits the return value
+    into a list of objects and a list of querysets without evaluating any of the querysets.
+    """
+    if objs is None:
+        return [], []
+    elif isinstance(objs, QuerySet):
+        return [], [objs]
+
+    split_objs, querysets = [], []
+    for obj in objs:
+        (querysets if isinstance(obj, QuerySet) else split_objs).append(obj)
+
+    return split_objs, querysets
+
+
+def _get_prefetch_lookups(side_effects_classes):
+    """
+    Returns the union of the prefetch lookups declared by the side effects classes, in order of declaration
+    """
+    prefetch_lookups = []
+    for side_effects_class in side_effects_classes:
+        for lookup in side_effects_class.prefetch:
+            if lookup not in prefetch_lookups:
+                prefetch_lookups.append(lookup)
+
+    return prefetch_lookups
+
+
+def _iter_chunks(objs, chunk_size):
+    """
+    Yields lists of at most chunk_size objects from an iterable
+    """
+    objs = iter(objs)
+    chunk = list(islice(objs, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(objs, chunk_size))
+
+
+class _GatheredSideEffects(object):
+    """
+    The side effect objects of a handler. Querysets returned by the handler are kept unevaluated until the
+    objects are needed, or until the gather reads their pks so that the side effects of deep cascades are not one
+    query of every level. At most max_objs objects are kept when a limit is given. Objects over the limit are
+    dropped and the side effects are flagged as truncated. Querysets are evaluated on the using database alias.
+    """
+    def __init__(self, max_objs=None, using=None):
+        # The side effect objects keyed on their tracked class and then on their key in that class
+        self.objs = defaultdict(dict)
+        self.querysets = defaultdict(list)
+
+        # The pks of the rows of querysets that were read, keyed on model class, in the order they were read
+        self.pks = defaultdict(dict)
+
+        self.max_objs = max_objs
+        self.num_objs = 0
+        self.using = using
+        self.truncated = False
+
+    def add(self, side_effect_objs):
+        objs, querysets = _split_objs_and_querysets(side_effect_objs)
+        for obj in objs:
+            tracked_class, key = _get_identity(obj)
+            tracked_objs = self.objs[tracked_class]
+            if key in tracked_objs:
+                continue
+            elif self._is_full(self.num_objs):
+                break
+
+            tracked_objs[key] = obj
+            self.num_objs += 1
+        for queryset in querysets:
+            self.querysets[queryset.model].append(queryset)
+
+    def read_pks(self):
+        """
+        Replaces the querysets by the pks of their rows, leaving out the rows of the objects
+        """
+        for model_class, querysets in self.querysets.items():
+            tracked_objs = self.objs.get(model_class._meta.concrete_model, {})
+            pks = self.pks[model_class]
+            for pk in _chain_querysets(model_class, querysets, using=self.using).values_list('pk', flat=True):
+                if pk not in tracked_objs:
+                    pks[pk] = None
+
+        self.querysets.clear()
+
+    def _iter_querysets(self):
+        """
+        Yields the model class and a queryset of its side effect objects for the querysets of every model and for
+        every chunk of the pks that were read
+        """
+        for model_class, querysets in self.querysets.items():
+            yield model_class, _chain_querysets(model_class, querysets, using=self.using)
+        for model_class, pks in self.pks.items():
+            for chunk in _iter_chunks(pks, GET_ITERATOR_CHUNK_SIZE):
+                yield model_class, _chain_querysets(model_class, [], chunk, using=self.using)
+
+    def get_objs(self):
+        if not self.querysets and not self.pks:
+            return [obj for tracked_objs in self.objs.values() for obj in tracked_objs.values()]
+
+        objs = {
+            tracked_class: dict(tracked_objs)
+            for tracked_class, tracked_objs in self.objs.items()
+        }
+        num_objs = self.num_objs
+        for model_class, queryset in self._iter_querysets():
+            tracked_objs = objs.setdefault(model_class._meta.concrete_model, {})
+
+            # Limited querysets are read in chunks so that rows over the limit are not fetched
+            for obj in queryset if self.max_objs is None else queryset.iterator():
+                if obj.pk in tracked_objs:
+                    continue
+                elif self._is_full(num_objs):
+                    break
+
+                tracked_objs[obj.pk] = obj
+                num_objs += 1
+
+        return [obj for tracked_objs in objs.values() for obj in tracked_objs.values()]
+
+    def _is_full(self, num_objs):
+        """
+        Returns whether the limit was reached, in which case the side effects are flagged as truncated
+        """
+        is_full = self.max_objs is not None and num_objs >= self.max_objs
+        self.truncated = self.truncated or is_full
+        return is_full
+
+    def exists(self):
+        """
+        Returns whether there are side effect objects. Querysets are checked without loading their rows
+        """
+        if any(self.objs.values()) or any(self.pks.values()):
+            return True
+        return any(
+            _chain_querysets(model_class, querysets, using=self.using).exists()
+            for model_class, querysets in self.querysets.items()
+        )
+
+    def get_queryset(self):
+        """
+        Returns a single unevaluated queryset of the side effect objects, or None if the objects are not all rows
+        of one model.
+        """
+        model_classes = set(self.querysets) | set(self.pks)
+        if len(model_classes) != 1:
+            return None
+
+        model_class, = model_classes
+        if any(tracked_class is not model_class._meta.concrete_model for tracked_class in self.objs):
+            return None
+
+        pks = chain(self.objs.get(model_class._meta.concrete_model, ()), self.pks.get(model_class, ()))
+        return _chain_querysets(model_class, self.querysets.get(model_class, []), pks, using=self.using)
+
+
+class _CountedSideEffectObjs(Sequence):
+    """
+    A read only sequence of side effect objects that is backed by a queryset and a precomputed count. Messages
+    that only need the number of objects can render without evaluating the queryset. Accessing the objects runs
+    a query for them.
+    """
+    def __init__(self, queryset, count):
+        self.queryset = queryset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.queryset[index]
+
+    def __iter__(self):
+        return self.queryset.iterator()
+
+
+class _DeletedKeys(dict):
+    """
+    The keys of the deleted objects of a gather, keyed on tracked class. The keys of each class are kept in a set.
+    When the sets of model classes hold more than max_memory_keys keys, they are moved to a SpillStore, along with
+    the keys of every model class that is deleted later. Keys of objects that are not model instances stay in memory.
+    """
+    def __init__(self, max_memory_keys=None):
+        super().__init__()
+        self.max_memory_keys = max_memory_keys
+        self.store = None
+
+    def __missing__(self, tracked_class):
+        keys = self[tracked_class] = (
+            self.store.create_key_set(tracked_class) if self.is_spilled(tracked_class) else set())
+        return keys
+
+    def add(self, tracked_class, keys):
+        self[tracked_class].update(keys)
+        if self.max_memory_keys is not None and self.store is None:
+            num_keys = sum(len(keys) for tracked_class, keys in self.items() if tracked_class is not None)
+            if num_keys > self.max_memory_keys:
+                self._spill()
+
+    def is_spilled(self, tracked_class):
+        return self.store is not None and tracked_class is not None
+
+    def _spill(self):
+        self.store = SpillStore()
+        for tracked_class, keys in list(self.items()):
+            if tracked_class is not None:
+                self[tracked_class] = self.store.create_key_set(tracked_class)
+                self[tracked_class].update(keys)
+
+
+class _DeletedBatch(object):
+    """
+    The objects of one class that are deleted on a single level of the walk. The batch holds model instances,
+    keyed on their identity, along with unevaluated querysets. The querysets are only evaluated if a handler that
+    works on lists needs them. Querysets are evaluated on the using database alias. Once the pks of the querysets
+    are read, they are replaced by a queryset of the pks, which are kept as lazy_pks. The querysets of batches of
+    spilled classes are replaced by a SpilledKeySet of their pks instead, which is read in chunks.
+    """
+    def __init__(self, deleted_obj_class, using=None):
+        self.deleted_obj_class = deleted_obj_class
+        self.using = using
+        self.tracked_class = deleted_obj_class._meta.concrete_model if issubclass(deleted_obj_class, Model) else None
+        self.objs = {}
+        self.querysets = []
+        self.lazy_pks = None
+        self.spilled_keys = None
+
+    def add(self, objs, querysets):
+        for obj in objs:
+            self.objs.setdefault(_get_identity(obj)[1], obj)
+        self.querysets.extend(querysets)
+
+    def exclude_deleted(self, deleted_pks, deleted_querysets):
+        """
+        Excludes objects that were deleted on a previous level from the querysets of this batch
+        """
+        exclude = Q(pk__in=deleted_pks) if deleted_pks else Q()
+        for queryset in deleted_querysets:
+            exclude |= Q(pk__in=queryset.values('pk'))
+
+        if exclude:
+            self.querysets = [queryset.exclude(exclude) for queryset in self.querysets]
+
+    def read_pks(self, deleted_pks, deleted_querysets=()):
+        """
+        Replaces the querysets of this batch by a queryset of the pks of their objects, which are read here. Objects
+        that were deleted on a previous level are left out using their pks, so the query of the batch no longer nests
+        the subqueries of the previous levels and does not bind the deleted pks.
+        """
+        self.exclude_deleted((), deleted_querysets)
+        queryset = _chain_querysets(self.deleted_obj_class, self.querysets, using=self.using)
+        pks = [pk for pk in queryset.values_list('pk', flat=True) if pk not in self.objs and pk not in deleted_pks]
+        self._set_lazy_pks(pks)
+
+    def _set_lazy_pks(self, pks):
+        self.querysets = [self.deleted_obj_class._default_manager.db_manager(self.using).filter(pk__in=pks)]
+        self.lazy_pks = pks
+        self.spilled_keys = None
+
+    def spill(self, deleted_keys, deleted_querysets, store):
+        """
+        Moves the pks of the querysets of this batch to a key set of the store. Objects that were deleted on a
+        previous level are left out. The pks are read in chunks so that they are never all in memory.
+        """
+        self.exclude_deleted((), deleted_querysets)
+        queryset = _chain_querysets(self.deleted_obj_class, self.querysets, using=self.using)
+        if self.objs:
+            queryset = queryset.exclude(pk__in=list(self.objs))
+
+        self.spilled_keys = store.create_key_set(self.tracked_class)
+        pks = queryset.values_list('pk', flat=True).iterator(chunk_size=GET_ITERATOR_CHUNK_SIZE)
+        for chunk in _iter_chunks(pks, GET_ITERATOR_CHUNK_SIZE):
+            self.spilled_keys.update(deleted_keys.get_new_keys(chunk))
+
+        self.querysets = []
+
+    def limit(self, max_objs):
+        """
+        Limits the batch to at most max_objs objects. The pks of at most max_objs + 1 objects of the querysets are
+        read to find out whether the batch is over the limit. Returns the number of objects in the batch and whether
+        objects were dropped.
+        """
+        truncated = len(self.objs) > max_objs
+        self.objs = dict(islice(self.objs.items(), max_objs))
+        if self.querysets or self.spilled_keys is not None:
+            remaining = max_objs - len(self.objs)
+            pks = self._get_lazy_pks(remaining + 1)
+
+            truncated = truncated or len(pks) > remaining
+            self._set_lazy_pks(pks[:remaining])
+            return len(self.objs) + len(self.lazy_pks), truncated
+
+        return len(self.objs), truncated
+
+    def _get_lazy_pks(self, num_pks):
+        """
+        Returns the pks of at most num_pks objects of the querysets or of the spilled keys of the batch
+        """
+        if self.spilled_keys is not None:
+            return list(islice(self.spilled_keys, num_pks))
+        elif self.lazy_pks is not None:
+            return self.lazy_pks[:num_pks]
+
+        queryset = _chain_querysets(self.deleted_obj_class, self.querysets, using=self.using)
+        if self.objs:
+            queryset = queryset.exclude(pk__in=list(self.objs))
+        return list(queryset.values_list('pk', flat=True)[:num_pks])
+
+    def exists(self):
+        if self.spilled_keys is not None:
+            return bool(self.objs) or bool(len(self.spilled_keys))
+        elif self.lazy_pks is not None:
+            return bool(self.objs) or bool(self.lazy_pks)
+        elif self.objs or not self.querysets:
+            return bool(self.objs)
+        return _chain_querysets(self.deleted_obj_class, self.querysets, using=self.using).exists()
+
+    def get_queryset(self):
+        """
+        Returns a queryset of every object in the batch without evaluating it.
+        """
+        return _chain_querysets(self.deleted_obj_class, self.querysets, self.objs, using=self.using)
+
+    def iter_querysets(self):
+        """
+        Yields the queryset of the batch. Spilled batches yield a queryset for their objects and one for every chunk
+        of their spilled keys instead, so that no queryset matches more than a chunk of spilled keys.
+        """
+        if self.spilled_keys is None:
+            yield self.get_queryset()
+            return
+
+        if self.objs:
+            yield _chain_querysets(self.deleted_obj_class, [], self.objs, using=self.using)
+        for pks in self.spilled_keys.iter_chunks(GET_ITERATOR_CHUNK_SIZE):
+            yield _chain_querysets(self.deleted_obj_class, [], pks, using=self.using)
+
+    def iter_obj_chunks(self, chunk_size=None):
+        """
+        Yields the objects of the batch in lists of at most chunk_size objects, or in a single list if no chunk size
+        is given. Querysets are evaluated as the chunks are consumed. Spilled keys are loaded a chunk at a time,
+        so spilled batches are always yielded in chunks.
+        """
+        objs = iter(self.objs.values())
+        if self.querysets:
+            queryset = _chain_querysets(self.deleted_obj_class, self.querysets, using=self.using)
+            queryset_objs = queryset.iterator(chunk_size=chunk_size) if chunk_size else queryset
+            objs = chain(objs, (obj for obj in queryset_objs if obj.pk not in self.objs))
+        elif self.spilled_keys is not None:
+            chunk_size = chunk_size or GET_ITERATOR_CHUNK_SIZE
+            objs = chain(objs, chain.from_iterable(
+                _chain_querysets(self.deleted_obj_class, [], pks, using=self.using)
+                for pks in self.spilled_keys.iter_chunks(chunk_size)
+            ))
+
+        if chunk_size is None:
+            yield list(objs)
+        else:
+            yield from _iter_chunks(objs, chunk_size)
+
+
+class DeletionSideEffectsBudget(object):
+    """
+    The limits of a single gather, available to handlers as `self.context.budget`. Handlers can read the remaining
+    budget to limit their own queries. The budget has the following limits, each of which is unlimited when None:
+
+    1. deadline - The number of seconds the gather may take. It is checked before every handler call.
+    2. max_objects - The maximum number of deleted objects passed to handlers.
+    3. max_side_effect_objs_per_handler - The maximum number of side effect objects kept for each handler.
+
+    When a limit is hit the walk stops, or the objects over the limit are dropped, and the limit is added to
+    truncated_by.
+    """
+    def __init__(self, deadline=None, max_objects=None, max_side_effect_objs_per_handler=None):
+        self.deadline = deadline
+        self.max_objects = max_objects
+        self.max_side_effect_objs_per_handler = max_side_effect_objs_per_handler
+
+        # The number of deleted objects passed to handlers so far
+        self.num_objects = 0
+
+        # The names of the limits that were hit
+        self.truncated_by = set()
+
+        self._start = time.monotonic()
+
+    def restart(self):
+        """
+        Restarts the deadline, for example when another walk of the gather starts
+        """
+        self._start = time.monotonic()
+
+    @property
+    def truncated(self):
+        return bool(self.truncated_by)
+
+    @property
+    def remaining_time(self):
+        """
+        The number of seconds left before the deadline, or None if there is no deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - (time.monotonic() - self._start), 0)
+
+    @property
+    def remaining_objects(self):
+        """
+        The number of deleted objects that can still be passed to handlers, or None if there is no limit
+        """
+        if self.max_objects is None:
+            return None
+        return max(self.max_objects - self.num_objects, 0)
+
+    def is_past_deadline(self):
+        if self.remaining_time == 0:
+            self.truncated_by.add('deadline')
+            return True
+        return False
+
+
+class DeletionSideEffectsContext(object):
+    """
+    The context of a single gather. It is shared by every handler call of the gather and is available to handlers
+    as `self.context`. The context provides a memo cache so that lookups repeated by different handlers, or by the
+    same handler on different cascade levels, are only run once. The cache keeps at most max_size values and
+    evicts the least recently used ones. The hits and misses of the cache are counted.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # The current cascade level of the gather
+        self.level = 0
+
+        # The limits of the current gather
+        self.budget = DeletionSideEffectsBudget()
+
+        # Whether the gather collects every deleted object, in which case handlers must not skip cascades that
+        # reach no handler
+        self.complete = False
+
+        # The database alias the queries of the gather run on, or None for the routed database
+        self.using = None
+
+        # The path of the only handler whose side effects are gathered, or None if the side effects of every handler
+        # are gathered
+        self.handler_path = None
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value of the key, or the default if the key is not cached
+        """
+        with self._lock:
+            if key not in self._cache:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def set(self, key, value):
+        """
+        Caches the value of the key and evicts the least recently used values over max_size
+        """
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def memoize(self, key, func, *args, **kwargs):
+        """
+        Returns the cached value of the key. If it is not cached, func is called with the given arguments and its
+        return value is cached. The key should identify the lookup and its arguments, for example
+        `('accounts_by_owner', frozenset(user_ids))`.
+        """
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+
+        # The function is called without holding the lock so that concurrent handlers are not serialized
+        value = func(*args, **kwargs)
+        self.set(key, value)
+        return value
+
+
+def _get_side_effects(side_effects, deleted_objs):
+    """
+    Calls a handler from sync code. The get_side_effects coroutine of async handlers is run with async_to_sync.
+    """
+    get_side_effects = side_effects.get_side_effects
+    if inspect.iscoroutinefunction(get_side_effects):
+        return async_to_sync(get_side_effects)(deleted_objs)
+    return get_side_effects(deleted_objs)
+
+
+def _get_cache_settings():
+    """
+    Returns the settings of the side effects cache. They are configured with the DELETION_SIDE_EFFECTS_CACHE
+    setting, a dictionary with the following optional keys:
+
+    1. ALIAS - The alias of the Django cache that is used. Defaults to 'default'.
+    2. TIMEOUT - The number of seconds results are cached. Defaults to 300.
+    3. MAX_OBJECTS - The maximum number of deleted, side effect and cascade deleted objects of a cached handler
+       call. Larger calls are not cached. Defaults to 1000.
+    """
+    cache_settings = {
+        'ALIAS': 'default',
+        'TIMEOUT': 300,
+        'MAX_OBJECTS': 1000,
+    }
+    cache_settings.update(getattr(settings, 'DELETION_SIDE_EFFECTS_CACHE', {}))
+    return cache_settings
+
+
+def _get_handler_path(side_effects_class):
+    return '{0}.{1}'.format(side_effects_class.__module__, side_effects_class.__qualname__)
+
+
+def _get_cache_version_key(side_effects_class):
+    return 'deletion_side_effects:version:{0}'.format(_get_handler_path(side_effects_class))
+
+
+def _get_cache_version(cache, side_effects_class):
+    """
+    Returns the current cache version of a handler. The version is part of the key of every cached result of the
+    handler and is replaced when a model the handler depends on changes. A random version is used so that
+    results cached before the version was evicted can never be read again.
+    """
+    version_key = _get_cache_version_key(side_effects_class)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(version_key)
+
+    return version
+
+
+def _invalidate_cached_side_effects(sender, **kwargs):
+    """
+    Invalidates the cached results of every handler that depends on the saved or deleted model or on a class of its
+    MRO, such as the abstract model, multi-table parent or concrete model of a proxy a handler was registered for
+    """
+    side_effects_classes = {
+        side_effects_class
+        for model_class in sender.__mro__
+        for side_effects_class in _CACHE_DEPENDENCIES.get(model_class, ())
+    }
+    if not side_effects_classes:
+        return
+
+    cache = caches[_get_cache_settings()['ALIAS']]
+    for side_effects_class in side_effects_classes:
+        cache.set(_get_cache_version_key(side_effects_class), uuid.uuid4().hex, timeout=None)
+
+
+def _register_cache_dependencies(side_effects_class):
+    """
+    Connects the cache invalidation of a handler to the post_save and post_delete signals of the models it depends
+    on. The deleted object class is always a dependency. The signals are connected for every sender, since they are
+    sent with the class of the saved instance, which can be any model the handler is dispatched to.
+    """
+    if side_effects_class.depends_on is None:
+        return
+
+    dependencies = [side_effects_class.deleted_obj_class] + list(side_effects_class.depends_on)
+    for model_class in dependencies:
+        if isinstance(model_class, str):
+            model_class = apps.get_model(model_class)
+        _CACHE_DEPENDENCIES[model_class].add(side_effects_class)
+
+    for signal in (post_save, post_delete):
+        signal.connect(_invalidate_cached_side_effects, weak=False, dispatch_uid='deletion_side_effects_cache')
+
+
+def get_cascade_classes(side_effects_class):
+    """
+    Returns the classes a handler declares it cascades to, or an empty list if it does not declare them. Model
+    labels are resolved to models.
+    """
+    return [
+        apps.get_model(cascade_class) if isinstance(cascade_class, str) else cascade_class
+        for cascade_class in side_effects_class.cascades_to or ()
+    ]
+
+
+def _can_have_side_effects(obj_class, handler_path=None):
+    """
+    Returns whether deleted objects of the class can lead to side effects, or only to side effects of the handler with
+    the given path
+    """
+    if handler_path is None:
+        return _DELETION_SIDE_EFFECTS.can_have_side_effects(obj_class)
+    return _DELETION_SIDE_EFFECTS.can_reach(obj_class, handler_path)
+
+
+def _evaluate_objs(objs):
+    """
+    Returns a list of the objects, evaluating any querysets
+    """
+    objs, querysets = _split_objs_and_querysets(objs)
+    return objs + [obj for queryset in querysets for obj in queryset]
+
+
+def _get_cached_side_effects(side_effects, deleted_objs, using=None):
+    """
+    Calls a handler, caching its result across gathers. Only list based handlers that declare the models they
+    depend on are cached. The result is keyed on the handler, its cache version, the database alias of the gather and
+    the models and pks of the deleted objects, since handlers of base classes are called for several models and
+    replicas may lag behind. Querysets are evaluated before they are cached.
+    """
+    side_effects_class = side_effects.__class__
+    cache_settings = _get_cache_settings()
+    if side_effects_class.depends_on is None or side_effects_class.uses_querysets:
+        return _get_side_effects(side_effects, deleted_objs)
+    elif len(deleted_objs) > cache_settings['MAX_OBJECTS'] or not all(isinstance(o, Model) for o in deleted_objs):
+        return _get_side_effects(side_effects, deleted_objs)
+
+    cache = caches[cache_settings['ALIAS']]
+    objs_hash = hashlib.sha1(repr(sorted(
+        (obj._meta.label_lower, str(obj.pk)) for obj in deleted_objs)).encode()).hexdigest()
+    cache_key = 'deletion_side_effects:{0}:{1}:{2}:{3}'.format(
+        _get_handler_path(side_effects_class), _get_cache_version(cache, side_effects_class), using or DEFAULT_DB_ALIAS,
+        objs_hash)
+
+    result = cache.get(cache_key)
+    if result is None:
+        side_effect_objs, cascade_deleted_objs = _get_side_effects(side_effects, deleted_objs)
+        result = (
+            _evaluate_objs(side_effect_objs) if side_effect_objs is not None else None,
+            _evaluate_objs(cascade_deleted_objs),
+        )
+        num_objs = len(deleted_objs) + len(result[0] or ()) + len(result[1])
+        if num_objs <= cache_settings['MAX_OBJECTS']:
+            cache.set(cache_key, result, timeout=cache_settings['TIMEOUT'])
+
+    return result
+
+
+def _get_side_effects_in_thread(caller_thread_ident, get_side_effects, *args):
+    """
+    Calls a handler from an executor. Database connections opened by the handler in a worker thread are closed
+    once it returns since Django does not clean up connections of threads it does not manage.
+    """
+    try:
+        return get_side_effects(*args)
+    finally:
+        if threading.get_ident() != caller_thread_ident:
+            connections.close_all()
+
+
+def _count_objs(objs):
+    """
+    Returns the number of objects, or None if they contain querysets that were not evaluated
+    """
+    objs, querysets = _split_objs_and_querysets(objs)
+    return None if querysets else len(objs)
+
+
+def _render_first(method):
+    """
+    Wraps a dict method of DeletionSideEffect so that the side effect is rendered before its keys are read or changed
+    """
+    def render_first(self, *args, **kwargs):
+        self.render()
+        return method(self, *args, **kwargs)
+
+    render_first.__name__ = method.__name__
+    render_first.__doc__ = method.__doc__
+    return render_first
+
+
+class DeletionSideEffect(dict):
+    """
+    A side effect returned by gather_deletion_side_effects. It is a dictionary with the msg and side_effect_objs
+    keys, which are filled in the first time the dictionary is read or changed: the side effect objects are loaded
+    and the message is rendered. The handler class is available as side_effects_class. Messages are rendered with
+    the database alias of the gather set.
+    """
+    def __init__(self, side_effects_class, gathered):
+        # The keys are set up front since C code such as the json encoder checks the size of dictionaries directly
+        super().__init__(msg=None, side_effect_objs=None)
+        self.side_effects_class = side_effects_class
+        self._gathered = gathered
+        self._using = gathered.using
+        self._side_effect_objs = None
+        self._rendered = False
+
+    @property
+    def side_effect_objs(self):
+        return self['side_effect_objs']
+
+    @property
+    def msg(self):
+        return self['msg']
+
+    def _load_objs(self):
+        """
+        Loads the side effect objects without rendering the message and returns them
+        """
+        if self._gathered is not None:
+            self._side_effect_objs = self._gathered.get_objs()
+            self._gathered = None
+        return self._side_effect_objs
+
+    def render(self):
+        """
+        Loads the side effect objects and renders the message into the dictionary if they were not accessed yet.
+        Returns the side effect
+        """
+        if not self._rendered:
+            side_effect_objs = self._load_objs()
+            with use_gather_database(self._using):
+                msg = self.side_effects_class().get_side_effect_message(side_effect_objs)
+            self._rendered = True
+            dict.update(self, msg=msg, side_effect_objs=side_effect_objs)
+        return self
+
+    def __eq__(self, other):
+        # Other side effects are rendered as well since dictionaries compare their keys without reading them
+        if isinstance(other, DeletionSideEffect):
+            other.render()
+        return dict.__eq__(self.render(), other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __reduce_ex__(self, protocol):
+        # Pickles and copies hold the rendered dictionary and not the state of the gather
+        return _restore_side_effect, (self.side_effects_class, dict.copy(self.render()))
+
+
+# The dict methods that read or change the keys of a DeletionSideEffect, which render it first
+for _method_name in [
+    '__contains__', '__delitem__', '__getitem__', '__ior__', '__iter__', '__len__', '__or__', '__repr__',
+    '__reversed__', '__ror__', '__setitem__', 'clear', 'copy', 'get', 'items', 'keys', 'pop', 'popitem', 'setdefault',
+    'update', 'values',
+]:
+    # Python 3.7 dictionaries are not reversible and do not support the union operators
+    if hasattr(dict, _method_name):  # pragma: no branch
+        setattr(DeletionSideEffect, _method_name, _render_first(getattr(dict, _method_name)))
+
+
+def _restore_side_effect(side_effects_class, side_effect):
+    """
+    Returns a rendered DeletionSideEffect of a handler class with the keys of a dictionary
+    """
+    restored = DeletionSideEffect.__new__(DeletionSideEffect)
+    dict.update(restored, side_effect)
+    restored.side_effects_class = side_effects_class
+    restored._gathered = None
+    restored._using = None
+    restored._side_effect_objs = side_effect.get('side_effect_objs')
+    restored._rendered = True
+    return restored
 
 
-def register_deletion_side_effects(*deletion_side_effects_handlers):
+def _get_root_pks(objs, using=None):
     """
-    Registers deletion side effect handler classes. The class must inherit BaseDeletionSideEffects
-    and define a deleted_obj_class variable.
+    Returns the roots of a gather along with the set of their pks. Querysets of roots are only read for their pks,
+    while other iterables are turned into lists so that they can be walked after their pks are read.
     """
-    for deletion_side_effects_handler in deletion_side_effects_handlers:
-        if not issubclass(deletion_side_effects_handler, BaseDeletionSideEffects):
-            raise ValueError('Deletion side effects handler must inherit BaseDeletionSideEffects')
-        elif deletion_side_effects_handler.deleted_obj_class is None:
-            raise ValueError('Deletion side effects handler must define a deleted_obj_class variable')
+    if isinstance(objs, QuerySet):
+        queryset = objs.using(using) if using is not None else objs
+        return objs, set(queryset.values_list('pk', flat=True))
+
+    objs = list(objs)
+    return objs, {obj.pk for obj in objs}
+
+
+class DeletionSideEffectsResult(list):
+    """
+    The list of side effects returned by gather_deletion_side_effects. The profile of the gather is available as
+    the profile attribute when it was requested. When a limit of the gather was hit, truncated is True, truncated_by
+    contains the names of the limits that were hit and the side effect objects are a lower bound.
+
+    The results of gathers that were made extendable keep the state of their gather, so that more roots can be added
+    with extend_roots. The state is not pickled or copied along with the result, while the pks of the roots are.
+    """
+    def __init__(self, side_effects=(), profile=None, truncated_by=(), gatherer=None, obj_class=None, root_pks=None):
+        super().__init__(side_effects)
+        self.profile = profile
+        self.truncated_by = set(truncated_by)
+        self._gatherer = gatherer
+        self._obj_class = obj_class
+        self._root_pks = root_pks
+
+    @property
+    def truncated(self):
+        return bool(self.truncated_by)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_gatherer'] = None
+        return state
+
+    def extend_roots(self, objs, executor=None):
+        """
+        Gathers the side effects of deleting more objects of the class of the gather and adds them to the result,
+        which then matches a gather of every root. Only the new roots and the cascaded objects that no previous walk
+        deleted are walked, so the cost of an extension is that of the new objects. The side effects are rendered
+        again. The deadline of the gather restarts while the other limits cover every walk. The profile, if any,
+        is replaced by the one of this walk. Returns the result.
+        """
+        if self._gatherer is None:
+            raise ValueError('Only results of gather_deletion_side_effects with extendable=True can be extended')
+
+        gatherer = self._gatherer
+        gatherer.executor = executor
+        gatherer.budget.restart()
+        if gatherer.profile is not None:
+            gatherer.profile = GatherProfile()
+
+        objs, root_pks = _get_root_pks(objs, gatherer.using)
+        self._root_pks |= root_pks
+        with gatherer.measure(), use_gather_database(gatherer.using):
+            gathered_side_effects = gatherer.extend(self._obj_class, objs)
+            self[:] = _render_side_effects(
+                gathered_side_effects, lazy=gatherer.budget.max_side_effect_objs_per_handler is None)
+
+        self.profile = gatherer.profile
+        self.truncated_by = gatherer.get_truncated_by()
+        return self
+
+
+class _DeletionSideEffectsGatherer(object):
+    """
+    Walks the cascade tree breadth first. Every level of the walk groups the cascaded objects by class so that
+    each handler is called once per class per level with the combined batch, no matter how many paths reached
+    the objects. Querysets returned by handlers are chained into the next level without being evaluated.
+    """
+    def __init__(
+        self, keep_side_effects=True, executor=None, context=None, use_cache=False, profile=None, budget=None,
+        complete=False, using=None, max_memory_keys=None, handler_path=None
+    ):
+        # An optional concurrent.futures executor that runs the handlers of a level concurrently
+        self.executor = executor
+
+        # Whether the results of handlers that declare their dependencies are cached across gathers
+        self.use_cache = use_cache
+
+        # The context that is shared by every handler call of the gather
+        self.context = context if context is not None else DeletionSideEffectsContext()
+
+        # The limits of the gather, which handlers can read from the context
+        self.budget = budget if budget is not None else DeletionSideEffectsBudget()
+        self.context.budget = self.budget
+
+        # Whether lazy batches that reach no handler are walked as well, so that the deleted objects are complete
+        self.complete = complete
+        self.context.complete = complete
+
+        # The database alias the queries of the gather run on, or None for the routed database
+        self.using = using
+        self.context.using = using
+
+        # The path of the only handler whose side effects are gathered. Only the handlers that can cascade to it are
+        # called, or every handler if None
+        self.handler_path = handler_path
+        self.context.handler_path = handler_path
+
+        # The gathered side effects, keyed on side effect handler class. Streaming callers that consume the side
+        # effects as they are yielded do not keep them
+        self.keep_side_effects = keep_side_effects
+        self.all_side_effects = defaultdict(
+            lambda: _GatheredSideEffects(max_objs=self.budget.max_side_effect_objs_per_handler, using=self.using))
+
+        # The keys of all deleted objects along with the querysets of deleted objects, keyed on tracked class.
+        # Instances are not kept once their level has been walked. The keys spill to disk over max_memory_keys
+        self.all_deleted_keys = _DeletedKeys(max_memory_keys)
+        self.all_deleted_querysets = defaultdict(list)
+
+        # An optional GatherProfile that records every handler call. Handler calls are also measured when the
+        # handler_called signal has receivers
+        self.profile = profile
+        self.instrumented = profile is not None or handler_called.has_listeners()
+
+    def gather(self, obj_class, objs, chunk_size=None):
+        for _ in self.walk(obj_class, objs, chunk_size=chunk_size):
+            pass
+
+        return self.all_side_effects
+
+    def walk(self, obj_class, objs, chunk_size=None):
+        """
+        Walks the cascade tree of the objects. This is a generator that yields a tuple of the level, the side
+        effects class and the side effect objects after every handler call.
+        """
+        yield from self._walk_frontier([self._get_root_batch(obj_class, objs)], chunk_size)
+
+    def extend(self, obj_class, objs):
+        """
+        Walks the cascade trees of more roots. Roots and cascaded objects that a previous walk of the gatherer
+        deleted are not walked again. Returns the gathered side effects of every walk.
+        """
+        root_batch = self._get_root_batch(obj_class, objs)
+        deleted_keys = self.all_deleted_keys[root_batch.tracked_class]
+        root_batch.objs = {key: obj for key, obj in root_batch.objs.items() if key not in deleted_keys}
+        if root_batch.querysets:
+            self._exclude_deleted(root_batch)
+
+        for _ in self._walk_frontier([root_batch] if root_batch.exists() else [], None):
+            pass
+
+        return self.all_side_effects
+
+    def _walk_frontier(self, frontier, chunk_size):
+        level = 0
+        while frontier and not self.budget.is_past_deadline():
+            frontier = yield from self._walk_level(level, frontier, chunk_size)
+            level += 1
+
+    async def agather(self, obj_class, objs, sync_executor):
+        """
+        Walks the cascade tree of the objects from an event loop. The handlers of a level are awaited concurrently.
+        Sync handlers run on the given executor and database access of the engine itself runs through
+        sync_to_async.
+        """
+        frontier = [self._get_root_batch(obj_class, objs)]
+        level = 0
+        while frontier and not self.budget.is_past_deadline():
+            frontier = await sync_to_async(self._start_level)(level, frontier)
+            handler_calls = await sync_to_async(lambda: list(self._iter_handler_calls(frontier, None)))()
+            results = await asyncio.gather(*[
+                self._acall_handler(self._make_handler(side_effects_class), deleted_objs, sync_executor)
+                for side_effects_class, _, deleted_objs in handler_calls
+            ])
+
+            cascade_batches = {}
+            for (side_effects_class, batch_class, deleted_objs), call_result in zip(handler_calls, results):
+                self._add_handler_result(
+                    level, side_effects_class, batch_class, deleted_objs, call_result, cascade_batches)
+
+            frontier = await sync_to_async(self._get_pending_batches)(cascade_batches, level + 1)
+            level += 1
+
+        return self.all_side_effects
+
+    def get_truncated_by(self):
+        """
+        Returns the names of the limits that were hit. Side effects over the per handler limit are only detected
+        once they are evaluated, so this is called after the side effects are rendered.
+        """
+        truncated_by = set(self.budget.truncated_by)
+        if any(gathered.truncated for gathered in self.all_side_effects.values()):
+            truncated_by.add('max_side_effect_objs_per_handler')
+        return truncated_by
+
+    def get_deleted_models(self):
+        """
+        Returns the concrete models of the deleted model instances. Querysets of deleted objects are not evaluated.
+        """
+        return {
+            tracked_class
+            for tracked_class, deleted in chain(self.all_deleted_keys.items(), self.all_deleted_querysets.items())
+            if tracked_class is not None and deleted
+        }
+
+    def get_deleted_pks(self):
+        """
+        Returns the pks of every deleted model instance, keyed on concrete model. Querysets of deleted objects are
+        evaluated for their pks.
+        """
+        deleted_pks = {}
+        for tracked_class, keys in self.all_deleted_keys.items():
+            if tracked_class is not None:
+                deleted_pks[tracked_class] = set(keys)
+        for tracked_class, querysets in self.all_deleted_querysets.items():
+            if querysets:
+                deleted_pks.setdefault(tracked_class, set()).update(
+                    _chain_querysets(tracked_class, querysets, using=self.using).values_list('pk', flat=True))
+
+        return deleted_pks
+
+    def _get_side_effects(self, side_effects, deleted_objs):
+        if self.use_cache:
+            return _get_cached_side_effects(side_effects, deleted_objs, self.using)
+        return _get_side_effects(side_effects, deleted_objs)
 
-        _DELETION_SIDE_EFFECTS[deletion_side_effects_handler.deleted_obj_class].add(deletion_side_effects_handler)
+    def _call_handler(self, side_effects, deleted_objs):
+        """
+        Calls a handler and returns a tuple of its result and its timing. The timing is a tuple of the duration,
+        the number of queries and the thread of the call when the gather is instrumented, None otherwise. The
+        database alias of the gather is set for the call since it may run on another thread.
+        """
+        with use_gather_database(self.using):
+            if not self.instrumented:
+                return self._get_side_effects(side_effects, deleted_objs), None
+
+            start = time.perf_counter()
+            with count_queries() as counter:
+                result = self._get_side_effects(side_effects, deleted_objs)
+            return result, (time.perf_counter() - start, counter.count, threading.get_ident())
+
+    async def _acall_handler(self, side_effects, deleted_objs, sync_executor):
+        """
+        Calls a handler from an event loop. The get_side_effects coroutine of async handlers is awaited while sync
+        handlers are called on the executor. The queries of async handlers are not counted and their duration
+        includes the time spent by other handlers running on the event loop.
+        """
+        if not inspect.iscoroutinefunction(side_effects.get_side_effects):
+            return await asyncio.get_running_loop().run_in_executor(
+                sync_executor, _get_side_effects_in_thread, threading.get_ident(), self._call_handler, side_effects,
+                deleted_objs)
+
+        start = time.perf_counter()
+        result = await side_effects.get_side_effects(deleted_objs)
+        return result, (time.perf_counter() - start, None, None) if self.instrumented else None
+
+    @contextmanager
+    def measure(self):
+        """
+        Measures the duration and the number of queries of a gather, including the rendering of its result, when it
+        is profiled. Queries of handlers that ran on other threads are added from their calls.
+        """
+        if self.profile is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        with count_queries() as counter:
+            yield
+
+        self.profile.duration = time.perf_counter() - start
+        self.profile.num_queries = counter.count + sum(
+            call.num_queries for call in self.profile.calls if call.thread_ident != threading.get_ident())
+
+    def _make_handler(self, side_effects_class):
+        side_effects = side_effects_class()
+        side_effects.context = self.context
+        return side_effects
+
+    def _get_root_batch(self, obj_class, objs):
+        root_batch = _DeletedBatch(obj_class, using=self.using)
+        root_batch.add(*_split_objs_and_querysets(objs))
+        return root_batch
+
+    def _start_level(self, level, frontier):
+        """
+        The objects on a level are deleted, so add them to the deleted objects before any handler runs. This
+        ensures objects reached through several paths on the same level are only processed once. Returns the batches
+        of the level, limited to the remaining object budget.
+        """
+        self.context.level = level
+        if self.budget.max_objects is not None:
+            frontier = self._limit_frontier(frontier)
+
+        for batch in frontier:
+            self._add_deleted_batch(batch)
+
+        return frontier
+
+    def _limit_frontier(self, frontier):
+        """
+        Limits the batches of a level to the remaining object budget. Batches left without objects are dropped
+        """
+        limited_frontier = []
+        for batch in frontier:
+            num_objs, truncated = batch.limit(self.budget.remaining_objects)
+            self.budget.num_objects += num_objs
+            if truncated:
+                self.budget.truncated_by.add('max_objects')
+            if num_objs:
+                limited_frontier.append(batch)
+
+        return limited_frontier
+
+    def _walk_level(self, level, frontier, chunk_size):
+        """
+        Passes the batches of one level through their handlers and returns the batches of the next level
+        """
+        frontier = self._start_level(level, frontier)
+
+        cascade_batches = {}
+        handler_calls = self._iter_handler_calls(frontier, chunk_size)
+        if self.executor is None:
+            results = (
+                (side_effects_class, batch_class, deleted_objs, self._call_handler(
+                    self._make_handler(side_effects_class), deleted_objs))
+                for side_effects_class, batch_class, deleted_objs in handler_calls
+            )
+        else:
+            # Handlers of the level run concurrently. Their results are added in the order of the calls so that the
+            # result is the same as the one of a serial walk
+            futures = [
+                (side_effects_class, batch_class, deleted_objs, self.executor.submit(
+                    _get_side_effects_in_thread, threading.get_ident(), self._call_handler,
+                    self._make_handler(side_effects_class), deleted_objs))
+                for side_effects_class, batch_class, deleted_objs in handler_calls
+            ]
+            results = (
+                (side_effects_class, batch_class, deleted_objs, future.result())
+                for side_effects_class, batch_class, deleted_objs, future in futures
+            )
+
+        for side_effects_class, batch_class, deleted_objs, call_result in results:
+            record = self._add_handler_result(
+                level, side_effects_class, batch_class, deleted_objs, call_result, cascade_batches)
+            if record is not None:
+                yield record
+
+        return self._get_pending_batches(cascade_batches, level + 1)
+
+    def _iter_handler_calls(self, frontier, chunk_size):
+        """
+        Yields a tuple of the side effects class, the class of the batch and the deleted objects for every handler
+        call of a level until the deadline has passed
+        """
+        return takewhile(
+            lambda handler_call: not self.budget.is_past_deadline(), self._iter_all_handler_calls(frontier, chunk_size))
 
+    def _iter_all_handler_calls(self, frontier, chunk_size):
+        """
+        Yields a tuple of the side effects class, the class of the batch and the deleted objects for every handler
+        call of a level
+        """
+        for batch in frontier:
+            side_effects_classes = self._get_handlers(batch.deleted_obj_class)
+
+            # Queryset based handlers are passed the whole batch since nothing is evaluated
+            queryset_side_effects_classes = [c for c in side_effects_classes if c.uses_querysets]
+            if queryset_side_effects_classes:
+                for queryset in batch.iter_querysets():
+                    for side_effects_class in queryset_side_effects_classes:
+                        yield side_effects_class, batch.deleted_obj_class, queryset
+
+            # List based handlers are passed the objects in chunks
+            list_side_effects_classes = [c for c in side_effects_classes if not c.uses_querysets]
+            if list_side_effects_classes:
+                prefetch_lookups = _get_prefetch_lookups(list_side_effects_classes) if batch.tracked_class else []
+                for deleted_objs in batch.iter_obj_chunks(chunk_size):
+                    # Objects evaluated from querysets are tracked so that handlers returning them again are ignored
+                    if batch.querysets:
+                        self.all_deleted_keys.add(batch.tracked_class, [_get_identity(obj)[1] for obj in deleted_objs])
+
+                    # The relations declared by all of the handlers are prefetched once for the chunk
+                    if prefetch_lookups:
+                        prefetch_related_objects(deleted_objs, *prefetch_lookups)
+
+                    for side_effects_class in list_side_effects_classes:
+                        yield side_effects_class, batch.deleted_obj_class, deleted_objs
+
+    def _get_handlers(self, obj_class):
+        """
+        Returns the handlers that are called for deleted objects of the class. Gathers of a single handler only call
+        the handlers that can cascade to it.
+        """
+        side_effects_classes = _DELETION_SIDE_EFFECTS.get_handlers(obj_class)
+        if self.handler_path is None:
+            return side_effects_classes
+
+        reaching_handlers = _DELETION_SIDE_EFFECTS.get_handlers_reaching(self.handler_path)
+        return [
+            side_effects_class for side_effects_class in side_effects_classes if side_effects_class in reaching_handlers
+        ]
+
+    def _add_handler_result(self, level, side_effects_class, batch_class, deleted_objs, call_result, cascade_batches):
+        """
+        Adds the side effects and cascade deleted objects returned by a handler. Returns a tuple of the level, the
+        side effects class and the side effect objects, or None if the handler returned no side effects.
+        """
+        (side_effect_objs, cascade_deleted_objs), timing = call_result
+        if timing is not None:
+            self._record_handler_call(level, side_effects_class, batch_class, deleted_objs, call_result)
+
+        self._add_cascade_deleted_objs(cascade_batches, cascade_deleted_objs)
+
+        # Add the side effects from this level to the side effects for that side effect class
+        if side_effect_objs is None:
+            return None
+        elif self.handler_path is not None and _get_handler_path(side_effects_class) != self.handler_path:
+            return None
+        elif self.keep_side_effects:
+            self.all_side_effects[side_effects_class].add(side_effect_objs)
+
+        return level, side_effects_class, side_effect_objs
+
+    def _record_handler_call(self, level, side_effects_class, batch_class, deleted_objs, call_result):
+        """
+        Adds a handler call to the profile and sends the handler_called signal. The batch class is the class of the
+        deleted objects, which is a subclass of the deleted_obj_class of handlers registered for a base class.
+        """
+        (side_effect_objs, cascade_deleted_objs), (duration, num_queries, thread_ident) = call_result
+        cascade_objs, cascade_querysets = _split_objs_and_querysets(cascade_deleted_objs)
+        call = HandlerCallProfile(
+            side_effects_class, level, duration, num_queries,
+            num_deleted_objs=_count_objs(deleted_objs),
+            num_side_effect_objs=_count_objs(side_effect_objs),
+            num_cascade_deleted_objs=_count_objs(cascade_deleted_objs),
+            cascade_classes={obj.__class__ for obj in cascade_objs} | {qs.model for qs in cascade_querysets},
+            thread_ident=thread_ident,
+            batch_class=batch_class,
+        )
+
+        if self.profile is not None:
+            self.profile.add_call(call)
+        handler_called.send(sender=side_effects_class, call=call)
+
+    def _get_pending_batches(self, cascade_batches, level):
+        """
+        Returns the batches that are walked on the level. Every MAX_LAZY_LEVELS levels, the pks of the lazy batches,
+        of the querysets of deleted objects and of the queryset side effects are read so that no query nests the
+        subqueries of more levels.
+        """
+        if level % MAX_LAZY_LEVELS == 0 and cascade_batches:
+            for gathered in self.all_side_effects.values():
+                gathered.read_pks()
+
+        read_pks = level % MAX_LAZY_LEVELS == 0 and any(batch.querysets for batch in cascade_batches.values())
+        if read_pks:
+            self._read_deleted_querysets()
+
+        return [batch for batch in cascade_batches.values() if self._is_pending(batch, read_pks)]
+
+    def _read_deleted_querysets(self):
+        """
+        Moves the pks of the querysets of deleted objects to the deleted keys
+        """
+        for tracked_class, querysets in self.all_deleted_querysets.items():
+            if querysets:
+                self.all_deleted_keys.add(tracked_class, _chain_querysets(
+                    tracked_class, querysets, using=self.using).values_list('pk', flat=True))
+
+        self.all_deleted_querysets.clear()
+
+    def _add_deleted_batch(self, batch):
+        self.all_deleted_keys.add(batch.tracked_class, batch.objs)
+        if batch.spilled_keys is not None:
+            self.all_deleted_keys.add(batch.tracked_class, batch.spilled_keys)
+        elif batch.lazy_pks is not None:
+            self.all_deleted_keys.add(batch.tracked_class, batch.lazy_pks)
+        else:
+            self.all_deleted_querysets[batch.tracked_class].extend(batch.querysets)
+
+    def _add_cascade_deleted_objs(self, cascade_batches, cascade_deleted_objs):
+        """
+        Adds cascade deleted objects to the batches of the next level. The batches are keyed on object type.
+        Objects of classes that cannot lead to side effects are neither tracked nor walked unless the gather is
+        complete.
+        """
+        cascade_objs, cascade_querysets = _split_objs_and_querysets(cascade_deleted_objs)
+        for cascade_deleted_obj in cascade_objs:
+            cascade_class = cascade_deleted_obj.__class__
+            if not self.complete and not _can_have_side_effects(cascade_class, self.handler_path):
+                continue
 
-def _recursive_gather_deletion_side_effects(deleted_obj_class, deleted_objs, all_side_effects, all_deleted_objs):
-    # The objects being passed in are deleted, so add them to the set of all deleted objects
-    all_deleted_objs |= set(deleted_objs)
+            tracked_class, key = _get_identity(cascade_deleted_obj)
+            if key not in self.all_deleted_keys[tracked_class]:
+                self._get_cascade_batch(cascade_batches, cascade_class).add([cascade_deleted_obj], [])
 
-    # Pass the deleted objects through the registered side effect classes for the deleted object class
-    all_cascade_deleted_objs = defaultdict(set)
-    for side_effects_class in _DELETION_SIDE_EFFECTS[deleted_obj_class]:
-        side_effect_objs, cascade_deleted_objs = side_effects_class().get_side_effects(deleted_objs)
+        for cascade_queryset in cascade_querysets:
+            cascade_class = cascade_queryset.model
+            self._get_cascade_batch(cascade_batches, cascade_class).add([], [cascade_queryset])
 
-        # Add the side effects from this round of recursion to the set of all side effects for that side effect
-        # class so far
-        if side_effect_objs:
-            all_side_effects[side_effects_class] |= set(side_effect_objs)
+    def _get_cascade_batch(self, cascade_batches, cascade_class):
+        if cascade_class not in cascade_batches:
+            cascade_batches[cascade_class] = _DeletedBatch(cascade_class, using=self.using)
+        return cascade_batches[cascade_class]
 
-        # Add to the set of all cascade deleted objects this round. This is keyed on object type
-        for cascade_deleted_obj in [o for o in cascade_deleted_objs if o not in all_deleted_objs]:
-            all_cascade_deleted_objs[cascade_deleted_obj.__class__].add(cascade_deleted_obj)
+    def _is_pending(self, batch, read_pks=False):
+        """
+        Lazy batches are only walked if they can reach a handler, unless the gather is complete, and contain
+        objects that were not deleted on a previous level. The pks of their objects are read if read_pks is True.
+        """
+        if not batch.querysets:
+            return True
+        elif not _can_have_side_effects(batch.deleted_obj_class, self.handler_path) and not self.complete:
+            return False
 
-    for deleted_class, deleted_objs in all_cascade_deleted_objs.items():
-        # Gather cascading deletion side effects
-        _recursive_gather_deletion_side_effects(
-            deleted_class, deleted_objs, all_side_effects, all_deleted_objs)
+        self._exclude_deleted(batch, read_pks)
+        return batch.exists()
 
-    return all_side_effects
+    def _exclude_deleted(self, batch, read_pks=False):
+        deleted_keys = self.all_deleted_keys[batch.tracked_class]
+        if self.all_deleted_keys.is_spilled(batch.tracked_class):
+            batch.spill(deleted_keys, self.all_deleted_querysets[batch.tracked_class], self.all_deleted_keys.store)
+        elif read_pks or len(deleted_keys) > MAX_EXCLUDED_PKS:
+            batch.read_pks(deleted_keys, self.all_deleted_querysets[batch.tracked_class])
+        else:
+            batch.exclude_deleted(deleted_keys, self.all_deleted_querysets[batch.tracked_class])
 
 
-def gather_deletion_side_effects(obj_class, objs):
+def gather_deletion_side_effects(
+    obj_class, objs, executor=None, context=None, use_cache=False, profile=False, deadline=None, max_objects=None,
+    max_side_effect_objs_per_handler=None, using=None, max_replica_lag=None, max_memory_keys=None, extendable=False,
+    complete=False
+):
     """
-    Given an object, gather the side effects of deleting it. The return value is a list of dictionaries, each
-    of which contain the following keys:
+    Given an object, gather the side effects of deleting it. The return value is a DeletionSideEffectsResult, a list
+    of dictionaries, each of which contain the following keys:
 
     1. msg - This key contains a human-readable message of the side effect.
     2. side_effect_objs: This key contains a list of ever object related to this side effect and the message.
+
+    An optional `concurrent.futures` executor, such as a ThreadPoolExecutor, runs the handlers of each cascade
+    level concurrently. The results match the ones of a serial gather.
+
+    Every handler call of the gather shares a `DeletionSideEffectsContext` that is available to handlers as
+    `self.context`. A context can be passed in to configure its memo cache or to read its counters afterwards.
+
+    When use_cache is True, the results of handlers that declare the models they depend on are cached across
+    gathers in the Django cache configured by the DELETION_SIDE_EFFECTS_CACHE setting.
+
+    When profile is True, the `GatherProfile` of the gather is available as the profile attribute of the result.
+    It records the duration, the number of queries and the sizes of the objects of every handler call as a cascade
+    tree.
+
+    The gather can be limited to a deadline in seconds, to max_objects deleted objects and to
+    max_side_effect_objs_per_handler side effect objects per handler. When a limit is hit, the walk stops or the
+    objects over the limit are dropped and the result is flagged as truncated. Handlers can read the remaining
+    budget from `self.context.budget`.
+
+    The queries of the gather run on the using database alias, such as a read replica, when one is given. Handlers
+    can read it from `self.context.using`, and their queries are routed to it by `DeletionSideEffectsRouter`. When
+    max_replica_lag is given, the gather falls back to the database that writes to obj_class if the replica lags
+    behind by more seconds.
+
+    When max_memory_keys is given and the keys of the deleted model instances outgrow it, the keys are moved to a
+    temporary SQLite database on disk. The lazy batches of those classes are then read into it and passed to
+    handlers in chunks, so that the cascade of any size is walked in bounded memory.
+
+    When extendable is True, the result keeps the state of the gather and more roots can be added to it with its
+    extend_roots method, which only walks the new objects.
+
+    When complete is True, cascades are walked even if they reach no handler, so that the deleted objects are
+    complete. Complete and extendable results can be deleted by delete_with_side_effects without gathering again.
+    """
+    budget = DeletionSideEffectsBudget(
+        deadline=deadline, max_objects=max_objects,
+        max_side_effect_objs_per_handler=max_side_effect_objs_per_handler)
+
+    # Gather all side effects level by level
+    gatherer = _DeletionSideEffectsGatherer(
+        executor=executor, context=context, use_cache=use_cache, profile=GatherProfile() if profile else None,
+        budget=budget, using=resolve_gather_database(obj_class, using, max_replica_lag),
+        max_memory_keys=max_memory_keys, complete=complete)
+    root_pks = None
+    if extendable:
+        objs, root_pks = _get_root_pks(objs, gatherer.using)
+    with gatherer.measure(), use_gather_database(gatherer.using):
+        gathered_side_effects = gatherer.gather(obj_class, objs)
+        side_effects = _render_side_effects(
+            gathered_side_effects, lazy=budget.max_side_effect_objs_per_handler is None)
+
+    return DeletionSideEffectsResult(
+        side_effects, profile=gatherer.profile, truncated_by=gatherer.get_truncated_by(),
+        gatherer=gatherer if extendable else None, obj_class=obj_class, root_pks=root_pks)
+
+
+def _iter_bits(mask):
+    """
+    Yields the indexes of the set bits of a mask
+    """
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+class _BulkDeletionSideEffectsGatherer(_DeletionSideEffectsGatherer):
+    """
+    Walks the cascade trees of several roots together. Every deleted and side effect object carries the set of
+    roots it belongs to as a bitset, stored in an int whose bit i is set for the root at index i. An object that
+    is reached again from other roots is walked again for those roots only, so the side effects of every root are
+    the ones a gather of that root alone would find. Querysets are evaluated as they are returned so that their
+    objects can be attributed.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # The roots each deleted object was walked for, keyed on tracked class and then on key
+        self.deleted_masks = defaultdict(dict)
+
+        # The side effect objects and their roots, keyed on side effects class and then on the identity of the objects
+        self.side_effect_masks = defaultdict(dict)
+
+    def gather_bulk(self, obj_class, roots):
+        """
+        Walks the cascade trees of the roots and returns a dictionary of gathered side effects for every root
+        """
+        frontier = {}
+        for index, root in enumerate(roots):
+            self._add_to_batch(frontier, obj_class, root, 1 << index)
+
+        level = 0
+        while frontier:
+            self.context.level = level
+            batches = [
+                (deleted_obj_class, self._exclude_deleted(deleted_obj_class, batch))
+                for deleted_obj_class, batch in frontier.items()
+            ]
+
+            frontier = {}
+            for deleted_obj_class, batch in batches:
+                for side_effects_class in _DELETION_SIDE_EFFECTS.get_handlers(deleted_obj_class):
+                    self._walk_handler(level, side_effects_class, deleted_obj_class, batch, frontier)
+            level += 1
+
+        return self._get_root_side_effects(len(roots))
+
+    def _add_to_batch(self, batches, obj_class, obj, mask):
+        batch = batches.setdefault(obj_class, {})
+        key = _get_identity(obj)[1]
+        if key in batch:
+            batch[key][1] |= mask
+        else:
+            batch[key] = [obj, mask]
+
+    def _exclude_deleted(self, deleted_obj_class, batch):
+        """
+        Removes the roots an object was already walked for and marks the object as walked for the other roots.
+        Objects left without roots are dropped.
+        """
+        deleted_masks = self.deleted_masks[_DeletedBatch(deleted_obj_class).tracked_class]
+        new_batch = {}
+        for key, (obj, mask) in batch.items():
+            new_mask = mask & ~deleted_masks.get(key, 0)
+            if new_mask:
+                deleted_masks[key] = deleted_masks.get(key, 0) | new_mask
+                new_batch[key] = (obj, new_mask)
+
+        return new_batch
+
+    def _walk_handler(self, level, side_effects_class, batch_class, batch, frontier):
+        """
+        Calls a handler for a batch. Handlers that implement get_side_effects_by_obj are called once and their
+        results are attributed per object. Other handlers are called once per group of objects with the same roots.
+        """
+        side_effects = self._make_handler(side_effects_class)
+        if side_effects_class.get_side_effects_by_obj is not BaseDeletionSideEffects.get_side_effects_by_obj:
+            results = side_effects.get_side_effects_by_obj([obj for obj, _ in batch.values()])
+            for obj, mask in batch.values():
+                self._add_result(side_effects_class, mask, results.get(obj, (None, [])), frontier)
+            return
+
+        groups = defaultdict(list)
+        for obj, mask in batch.values():
+            groups[mask].append(obj)
+
+        for mask, objs in groups.items():
+            deleted_objs = objs
+            if side_effects_class.uses_querysets:
+                deleted_objs = _chain_querysets(
+                    side_effects_class.deleted_obj_class, [], [obj.pk for obj in objs], using=self.using)
+
+            call_result = self._call_handler(side_effects, deleted_objs)
+            if call_result[1] is not None:
+                self._record_handler_call(level, side_effects_class, batch_class, deleted_objs, call_result)
+            self._add_result(side_effects_class, mask, call_result[0], frontier)
+
+    def _add_result(self, side_effects_class, mask, side_effects, frontier):
+        side_effect_objs, cascade_deleted_objs = side_effects
+        if side_effect_objs is not None:
+            tracked_objs = self.side_effect_masks[side_effects_class]
+            for obj in _evaluate_objs(side_effect_objs):
+                identity = _get_identity(obj)
+                if identity in tracked_objs:
+                    tracked_objs[identity][1] |= mask
+                else:
+                    tracked_objs[identity] = [obj, mask]
+
+        for obj in _evaluate_objs(cascade_deleted_objs):
+            if _DELETION_SIDE_EFFECTS.can_have_side_effects(obj.__class__):
+                self._add_to_batch(frontier, obj.__class__, obj, mask)
+
+    def _get_root_side_effects(self, num_roots):
+        """
+        Splits the side effect objects by root. Returns a list of gathered side effects, one for every root.
+        """
+        root_objs = [defaultdict(list) for _ in range(num_roots)]
+        for side_effects_class, tracked_objs in self.side_effect_masks.items():
+            for obj, mask in tracked_objs.values():
+                for index in _iter_bits(mask):
+                    root_objs[index][side_effects_class].append(obj)
+
+        root_side_effects = []
+        for objs in root_objs:
+            gathered_side_effects = {}
+            for side_effects_class, side_effect_objs in objs.items():
+                gathered_side_effects[side_effects_class] = _GatheredSideEffects(using=self.using)
+                gathered_side_effects[side_effects_class].add(side_effect_objs)
+            root_side_effects.append(gathered_side_effects)
+
+        return root_side_effects
+
+
+def gather_deletion_side_effects_bulk(
+    obj_class, roots, context=None, use_cache=False, using=None, max_replica_lag=None
+):
+    """
+    Gathers the side effects of deleting each of the roots separately, walking the cascade trees of all roots
+    together so that handlers are called for shared batches. Returns a list with a DeletionSideEffectsResult for
+    every root, in the order of the roots, that is equivalent to calling gather_deletion_side_effects for the
+    root alone.
+
+    The roots each deleted object was reached from are tracked as a bitset. Handlers are called once per group
+    of deleted objects that were reached from the same roots, or once per batch if they implement
+    `get_side_effects_by_obj`. Querysets returned by handlers are evaluated so that their objects can be
+    attributed to roots.
+
+    The using and max_replica_lag arguments are the ones of gather_deletion_side_effects.
     """
-    # Recursively gather all side effects
-    gathered_side_effects = _recursive_gather_deletion_side_effects(obj_class, objs, defaultdict(set), set())
+    gatherer = _BulkDeletionSideEffectsGatherer(
+        context=context, use_cache=use_cache, using=resolve_gather_database(obj_class, using, max_replica_lag))
+    with use_gather_database(gatherer.using):
+        root_side_effects = gatherer.gather_bulk(obj_class, list(roots))
 
-    # Render the side effect messages and reorganize the output
     return [
-        {
-            'msg': side_effect().get_side_effect_message(list(side_effect_objs)),
-            'side_effect_objs': list(side_effect_objs),
-        }
-        for side_effect, side_effect_objs in gathered_side_effects.items()
+        DeletionSideEffectsResult(_render_side_effects(gathered_side_effects, lazy=True))
+        for gathered_side_effects in root_side_effects
     ]
 
 
+def _render_side_effects(gathered_side_effects, lazy=False):
+    """
+    Returns a DeletionSideEffect for every handler with side effects. Lazy side effects load their objects and
+    render their message on first access, and querysets are only checked for rows. Otherwise everything is loaded
+    and rendered at this point, which is needed to detect truncated side effects and to render from async code.
+    """
+    side_effects = []
+    for side_effects_class, gathered in gathered_side_effects.items():
+        side_effect = DeletionSideEffect(side_effects_class, gathered)
+        if lazy and gathered.exists():
+            side_effects.append(side_effect)
+        elif not lazy and side_effect._load_objs():
+            side_effects.append(side_effect.render())
+
+    return side_effects
+
+
+async def agather_deletion_side_effects(
+    obj_class, objs, max_sync_workers=4, context=None, use_cache=False, profile=False, deadline=None,
+    max_objects=None, max_side_effect_objs_per_handler=None, using=None, max_replica_lag=None, max_memory_keys=None
+):
+    """
+    The async version of gather_deletion_side_effects. The handlers of each cascade level are awaited concurrently
+    with asyncio.gather. Handlers whose `get_side_effects` is a coroutine, such as subclasses of
+    `BaseAsyncDeletionSideEffects`, are awaited on the event loop. Other handlers run on a thread pool of at most
+    max_sync_workers threads.
+
+    The limits, the database alias and the memory cap of gather_deletion_side_effects are supported as well.
+
+    The profile of an async gather records its handler calls and duration. The total number of queries is not
+    recorded since the queries of the engine run on other threads.
+    """
+    budget = DeletionSideEffectsBudget(
+        deadline=deadline, max_objects=max_objects,
+        max_side_effect_objs_per_handler=max_side_effect_objs_per_handler)
+    gatherer = _DeletionSideEffectsGatherer(
+        context=context, use_cache=use_cache, profile=GatherProfile() if profile else None, budget=budget,
+        using=await sync_to_async(resolve_gather_database)(obj_class, using, max_replica_lag),
+        max_memory_keys=max_memory_keys)
+    start = time.perf_counter()
+    with use_gather_database(gatherer.using):
+        with ThreadPoolExecutor(max_workers=max_sync_workers) as sync_executor:
+            gathered_side_effects = await gatherer.agather(obj_class, objs, sync_executor)
+
+        if gatherer.profile is not None:
+            gatherer.profile.duration = time.perf_counter() - start
+
+        side_effects = await sync_to_async(_render_side_effects)(gathered_side_effects)
+    return DeletionSideEffectsResult(side_effects, profile=gatherer.profile, truncated_by=gatherer.get_truncated_by())
+
+
+def _iter_new_side_effect_objs(side_effect_objs, seen_keys, chunk_size, using=None):
+    """
+    Yields chunks of the side effect objects that were not seen before. Querysets are evaluated in chunks on the
+    using database alias, if one is given. The seen keys are keyed on tracked class and updated as the chunks are
+    yielded.
+    """
+    objs, querysets = _split_objs_and_querysets(side_effect_objs)
+    if using is not None:
+        querysets = [queryset.using(using) for queryset in querysets]
+    objs = chain(objs, *(
+        queryset.iterator(chunk_size=chunk_size) if chunk_size else queryset
+        for queryset in querysets
+    ))
+
+    def iter_new_objs():
+        for obj in objs:
+            tracked_class, key = _get_identity(obj)
+            if key not in seen_keys[tracked_class]:
+                seen_keys[tracked_class].add(key)
+                yield obj
+
+    if chunk_size is None:
+        new_objs = list(iter_new_objs())
+        if new_objs:
+            yield new_objs
+    else:
+        yield from _iter_chunks(iter_new_objs(), chunk_size)
+
+
+def iter_deletion_side_effects(
+    obj_class, objs, chunk_size=None, executor=None, context=None, use_cache=False, using=None, max_replica_lag=None,
+    max_memory_keys=None
+):
+    """
+    Given an object, yield the side effects of deleting it while the cascade tree is walked. This is a generator of
+    `DeletionSideEffectsRecord` tuples that contain the following fields:
+
+    1. side_effects_class - The side effects class that found the side effects.
+    2. side_effect_objs - A list of side effect objects that were not yielded for that class before.
+    3. level - The cascade level of the walk, starting at 0 for the given objects.
+
+    When a chunk_size is given, deleted objects are passed to list based handlers in lists of at most chunk_size
+    objects, querysets are evaluated in chunks and side effect objects are yielded in lists of at most chunk_size
+    objects. Side effect objects are not kept once they are yielded, only their keys are.
+
+    An optional `concurrent.futures` executor runs the handlers of each cascade level concurrently. The using,
+    max_replica_lag and max_memory_keys arguments are the ones of gather_deletion_side_effects.
+    """
+    seen_keys = defaultdict(lambda: defaultdict(set))
+    gatherer = _DeletionSideEffectsGatherer(
+        keep_side_effects=False, executor=executor, context=context, use_cache=use_cache,
+        using=resolve_gather_database(obj_class, using, max_replica_lag), max_memory_keys=max_memory_keys)
+    for level, side_effects_class, side_effect_objs in gatherer.walk(obj_class, objs, chunk_size=chunk_size):
+        for new_objs in _iter_new_side_effect_objs(
+            side_effect_objs, seen_keys[side_effects_class], chunk_size, using=gatherer.using
+        ):
+            yield DeletionSideEffectsRecord(side_effects_class, new_objs, level)
+
+
+def _count_side_effects(side_effects_class, gathered):
+    """
+    Returns the count of the gathered side effects and the objects that are passed to the message. Handlers that
+    implement get_side_effect_count are given an unevaluated queryset. Other handlers fall back to evaluating the
+    side effect objects.
+    """
+    side_effects = side_effects_class()
+    implements_count = side_effects_class.get_side_effect_count is not BaseDeletionSideEffects.get_side_effect_count
+    queryset = gathered.get_queryset() if implements_count else None
+    if queryset is not None:
+        count = side_effects.get_side_effect_count(queryset)
+        return side_effects, count, _CountedSideEffectObjs(queryset, count)
+
+    side_effect_objs = gathered.get_objs()
+    return side_effects, len(side_effect_objs), side_effect_objs
+
+
+def summarize_deletion_side_effects(
+    obj_class, objs, executor=None, context=None, use_cache=False, using=None, max_replica_lag=None,
+    max_memory_keys=None
+):
+    """
+    Given an object, gather the number of side effects of deleting it. This is useful when only a summary of the
+    side effects is displayed, for example in a confirmation dialog. The return value is a list of dictionaries,
+    each of which contain the following keys:
+
+    1. msg - This key contains a human-readable message of the side effect.
+    2. count - This key contains the number of objects related to this side effect.
+
+    Handlers that implement `get_side_effect_count` and return querysets for their side effects are counted
+    without loading the side effect objects.
+
+    An optional `concurrent.futures` executor runs the handlers of each cascade level concurrently. The using,
+    max_replica_lag and max_memory_keys arguments are the ones of gather_deletion_side_effects.
+    """
+    summary, _ = _summarize_deletion_side_effects(
+        obj_class, objs, executor=executor, context=context, use_cache=use_cache, using=using,
+        max_replica_lag=max_replica_lag, max_memory_keys=max_memory_keys)
+    return [{'msg': msg, 'count': count} for _, msg, count, _ in summary]
+
+
+def _summarize_deletion_side_effects(
+    obj_class, objs, executor=None, context=None, use_cache=False, using=None, max_replica_lag=None,
+    max_memory_keys=None, complete=False, handler_path=None
+):
+    """
+    Returns a tuple of the summary and the gatherer. The summary has a tuple of the side effects class, the message,
+    the count and the side effect objects of every handler with side effects, or only of the handler whose class has
+    the given path, in which case only the handlers that can cascade to it are called. The side effect objects of
+    handlers that implement get_side_effect_count are a _CountedSideEffectObjs, whose queryset is not evaluated.
+    """
+    gatherer = _DeletionSideEffectsGatherer(
+        executor=executor, context=context, use_cache=use_cache, complete=complete,
+        using=resolve_gather_database(obj_class, using, max_replica_lag), max_memory_keys=max_memory_keys,
+        handler_path=handler_path)
+
+    summary = []
+    with use_gather_database(gatherer.using):
+        gathered_side_effects = gatherer.gather(obj_class, objs)
+        for side_effects_class, gathered in gathered_side_effects.items():
+            side_effects, count, side_effect_objs = _count_side_effects(side_effects_class, gathered)
+            if count:
+                summary.append((
+                    side_effects_class, side_effects.get_side_effect_message(side_effect_objs), count,
+                    side_effect_objs,
+                ))
+
+    return summary, gatherer
+
+
 class BaseDeletionSideEffects(object):
     """
     Provides the interface for a user to make a deletion side effects class. The user must define
@@ -82,9 +2023,58 @@ class BaseDeletionSideEffects(object):
     gathering side effects with the class. The method is responsible for returning a human-readable string of\
     he side effects.
 
+    Handlers may implement a `get_side_effect_count` method. This method is passed an unevaluated queryset of\
+    all side effect objects and returns the number of objects. It is used by `summarize_deletion_side_effects`\
+    when the side effects of the handler were returned as querysets.
+
+    Handlers may declare a `prefetch` list of lookups, such as `['memberships__group']`. The lookups of every\
+    handler registered for the deleted object class are prefetched once on the deleted objects before they are\
+    passed to the list based handlers.
+
+    Before `get_side_effects` is called, the `context` attribute of the handler is set to the\
+    `DeletionSideEffectsContext` of the gather. Its memo cache can be used to share lookups between handlers and\
+    cascade levels, for example `self.context.memoize(key, func)`.
+
+    Handlers may declare a `depends_on` list of the models their results depend on. The results of these handlers\
+    are cached across gathers that pass `use_cache=True` and are invalidated when one of the models, or the\
+    deleted object class, is saved or deleted.
+
+    Handlers may set `uses_querysets` to True. In this mode `get_side_effects` is passed a queryset of the deleted\
+    objects instead of a list and is expected to return querysets, or lists of querysets, for the side effect and\
+    cascade deleted objects. The querysets are chained into the next cascade level as pk subqueries and are only\
+    evaluated when the side effects are rendered or when a list based handler needs the objects.
+
+    Handlers may implement a `get_side_effects_by_obj` method. This method is passed a list of deleted objects and\
+    returns the side effect and cascade deleted objects of each of them. It lets\
+    `gather_deletion_side_effects_bulk` call the handler once for the objects of every root.
+
+    Handlers may declare the classes they cascade to in `cascades_to` and set `has_side_effects` to False if they\
+    only cascade. Cascaded objects whose classes cannot lead to any side effect are then dropped by the walk.
+
     """
     deleted_obj_class = None
 
+    # The DeletionSideEffectsContext of the gather. It is set before get_side_effects is called
+    context = None
+
+    # Whether get_side_effects is passed a queryset of the deleted objects instead of a list
+    uses_querysets = False
+
+    # The models, or model labels, the results of the handler depend on besides the deleted object class. Handlers
+    # that declare their dependencies are cached by gathers with use_cache. Their cached results are invalidated
+    # when one of the models is saved or deleted
+    depends_on = None
+
+    # Lookups that are prefetched on the deleted objects before they are passed to list based handlers. The lookups
+    # of all handlers of a deleted object class are prefetched together with one prefetch_related_objects call
+    prefetch = []
+
+    # The classes, or model labels, of the objects the handler cascades to. None means any class
+    cascades_to = None
+
+    # Whether the handler can return side effect objects. Handlers that only cascade set it to False
+    has_side_effects = True
+
     def get_side_effects(self, deleted_objects):
         """
         Returns a tuple. The first part of the tuple is list of objects that
@@ -100,3 +2090,34 @@ class BaseDeletionSideEffects(object):
         readable message about the side effect.
         """
         raise NotImplementedError
+
+    def get_side_effect_count(self, side_effect_objects):
+        """
+        Given an unevaluated queryset of the objects that have this side effect associated with them, return
+        the number of objects. This is optional. Handlers that do not implement it have their side effect objects
+        evaluated and counted when summarizing.
+        """
+        raise NotImplementedError
+
+    def get_side_effects_by_obj(self, deleted_objects):
+        """
+        Given a list of deleted objects, return a dictionary keyed on deleted object whose values are tuples of
+        the side effect objects and the cascade deleted objects of that object. This is optional. Bulk gathers
+        call handlers that do not implement it once per group of deleted objects that were reached from the same
+        roots.
+        """
+        raise NotImplementedError
+
+
+class BaseAsyncDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    The async variant of BaseDeletionSideEffects. The `get_side_effects` method is a coroutine that can use the
+    async queryset interface of Django. Async handlers are awaited concurrently by `agather_deletion_side_effects`
+    and are run with async_to_sync by the sync gather functions.
+    """
+    async def get_side_effects(self, deleted_objects):
+        """
+        Returns a tuple of the side effect objects and the cascade deleted objects, the same way as
+        BaseDeletionSideEffects.get_side_effects.
+        """
+        raise NotImplementedError
@@ -0,0 +1,128 @@
+"""
+The static graph of the registered handlers. Its nodes are the classes of deleted objects and its edges lead from a
+class to the classes its handlers declare in cascades_to. Handlers that do not declare the classes they cascade to
+have an edge to None, which stands for any class. The graph shows which classes can lead to side effects and which
+cascades are cyclic, and can be rendered in the DOT language of Graphviz.
+"""
+from django.db.models import Model
+
+from deletion_side_effects.deletion_side_effects import _DELETION_SIDE_EFFECTS, get_cascade_classes
+
+
+def _get_class_label(obj_class):
+    if obj_class is None:
+        return '*'
+    elif issubclass(obj_class, Model):
+        return obj_class._meta.label
+    return '{0}.{1}'.format(obj_class.__module__, obj_class.__qualname__)
+
+
+class HandlerGraph(object):
+    """
+    The cascade graph of the registered handlers. The edges are keyed on class and then on the class that is
+    cascaded to. Their values are the handlers that cascade along the edge. Every class of the graph is a key of the
+    edges.
+    """
+    def __init__(self, edges, productive_classes):
+        self.edges = edges
+        self.productive_classes = productive_classes
+
+    def get_cycles(self):
+        """
+        Returns the cycles of the graph as a list of the strongly connected components that contain a cycle. The
+        classes of each component and the components are sorted by label. The components are found with an
+        iterative version of Tarjan's algorithm so that long cascade chains are not bound by the recursion limit.
+        """
+        indexes, low_links = {}, {}
+        stack, on_stack = [], set()
+        components = []
+
+        for root in sorted(self.edges, key=_get_class_label):
+            if root in indexes:
+                continue
+
+            work = [(root, iter(self._get_cascade_classes(root)))]
+            indexes[root] = low_links[root] = len(indexes)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                obj_class, cascade_classes = work[-1]
+                cascade_class = next(cascade_classes, None)
+                if cascade_class is None:
+                    work.pop()
+                    if work:
+                        low_links[work[-1][0]] = min(low_links[work[-1][0]], low_links[obj_class])
+                    if low_links[obj_class] == indexes[obj_class]:
+                        components.append(self._pop_component(obj_class, stack, on_stack))
+                elif cascade_class not in indexes:
+                    indexes[cascade_class] = low_links[cascade_class] = len(indexes)
+                    stack.append(cascade_class)
+                    on_stack.add(cascade_class)
+                    work.append((cascade_class, iter(self._get_cascade_classes(cascade_class))))
+                elif cascade_class in on_stack:
+                    low_links[obj_class] = min(low_links[obj_class], indexes[cascade_class])
+
+        cycles = [
+            sorted(component, key=_get_class_label)
+            for component in components
+            if len(component) > 1 or component[0] in self.edges.get(component[0], {})
+        ]
+        return sorted(cycles, key=lambda cycle: _get_class_label(cycle[0]))
+
+    def _get_cascade_classes(self, obj_class):
+        return [cascade_class for cascade_class in self.edges.get(obj_class, {}) if cascade_class is not None]
+
+    def _pop_component(self, obj_class, stack, on_stack):
+        component = []
+        while True:
+            component_class = stack.pop()
+            on_stack.discard(component_class)
+            component.append(component_class)
+            if component_class is obj_class:
+                return component
+
+    def to_dot(self):
+        """
+        Returns the graph in the DOT language. Classes that cannot lead to side effects are drawn dashed.
+        """
+        lines = ['digraph deletion_side_effects {']
+        for obj_class in sorted(self.edges, key=_get_class_label):
+            style = '' if obj_class in self.productive_classes else ' [style=dashed]'
+            lines.append('    "{0}"{1};'.format(_get_class_label(obj_class), style))
+
+        for obj_class in sorted(self.edges, key=_get_class_label):
+            for cascade_class, handlers in sorted(
+                self.edges[obj_class].items(), key=lambda edge: _get_class_label(edge[0])
+            ):
+                lines.append('    "{0}" -> "{1}" [label="{2}"];'.format(
+                    _get_class_label(obj_class), _get_class_label(cascade_class),
+                    ', '.join(sorted(handler.__name__ for handler in handlers))))
+
+        lines.append('}')
+        return '\n'.join(lines)
+
+
+def get_handler_graph():
+    """
+    Builds the HandlerGraph of the registered handlers. It contains every registered class and every class that can
+    be cascaded to from them.
+    """
+    edges = {}
+    obj_classes = list(_DELETION_SIDE_EFFECTS)
+    while obj_classes:
+        obj_class = obj_classes.pop()
+        if obj_class in edges:
+            continue
+
+        cascades = edges[obj_class] = {}
+        for side_effects_class in _DELETION_SIDE_EFFECTS.get_handlers(obj_class):
+            cascade_classes = [None]
+            if side_effects_class.cascades_to is not None:
+                cascade_classes = get_cascade_classes(side_effects_class)
+                obj_classes.extend(cascade_classes)
+
+            for cascade_class in cascade_classes:
+                cascades.setdefault(cascade_class, set()).add(side_effects_class)
+
+    productive_classes = {obj_class for obj_class in edges if _DELETION_SIDE_EFFECTS.can_have_side_effects(obj_class)}
+    return HandlerGraph(edges, productive_classes)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from deletion_side_effects.reports import make_report_executor, process_deletion_side_effect_reports
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued deletion side effect reports in a local process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='The number of worker processes. Defaults to the number of CPUs. 0 runs reports in this process')
+        parser.add_argument(
+            '--batch-size', type=int, default=100, help='The number of reports that are claimed at once')
+        parser.add_argument(
+            '--interval', type=float, default=1.0, help='The number of seconds between polls of an empty queue')
+        parser.add_argument(
+            '--timeout', type=float, default=None,
+            help='The number of seconds after which running reports are marked as failed. Defaults to the '
+                 'DELETION_SIDE_EFFECTS_REPORT_TIMEOUT setting')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        executor = make_report_executor(options['workers']) if options['workers'] != 0 else None
+        try:
+            while True:
+                report_ids = process_deletion_side_effect_reports(
+                    executor=executor, limit=options['batch_size'], timeout=options['timeout'])
+                if report_ids:
+                    self.stdout.write('Processed {0} deletion side effect reports'.format(len(report_ids)))
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['interval'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
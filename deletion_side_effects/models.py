@@ -0,0 +1,71 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+def get_report_object_ids(objs):
+    """
+    Returns the pks of the root objects of a report as a sorted list of strings, so that reports of the same roots
+    have equal object ids
+    """
+    return sorted(str(obj.pk) for obj in objs)
+
+
+class DeletionSideEffectReportQuerySet(models.QuerySet):
+    def for_objs(self, obj_class, objs):
+        """
+        Filters the reports of the given root objects
+        """
+        return self.filter(
+            content_type=ContentType.objects.get_for_model(obj_class, for_concrete_model=False),
+            object_ids=get_report_object_ids(objs))
+
+
+class DeletionSideEffectReport(models.Model):
+    """
+    The side effects of deleting a list of root objects, gathered in the background by the
+    process_deletion_side_effect_reports command. The side effects are stored as a list of dictionaries with the
+    rendered message, the number of side effect objects and their pks keyed on the label of their model.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    # The class of the root objects and their pks
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_ids = models.JSONField()
+
+    # The keyword arguments passed to gather_deletion_side_effects, such as its limits
+    gather_kwargs = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    side_effects = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    truncated_by = models.JSONField(default=list, blank=True)
+
+    # The traceback of a failed report
+    error = models.TextField(default='', blank=True)
+
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = DeletionSideEffectReportQuerySet.as_manager()
+
+    def __str__(self):
+        return '{0} {1} ({2})'.format(self.content_type, ', '.join(self.object_ids), self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    @property
+    def truncated(self):
+        return bool(self.truncated_by)
@@ -0,0 +1,117 @@
+from contextlib import ExitStack, contextmanager
+import threading
+
+from django.db import connections
+
+
+class QueryCounter(object):
+    """
+    A database execute wrapper that counts the queries it sees. It is installed with connection.execute_wrapper.
+    """
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    A context manager that counts the queries run on every database connection of the current thread. Yields the
+    QueryCounter.
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+class HandlerCallProfile(object):
+    """
+    The measurements of a single handler call of a gather. The sizes of deleted, side effect and cascade deleted
+    objects are None when they were passed or returned as unevaluated querysets. The number of queries is None for
+    async handlers since their queries run in other threads.
+
+    The batch class is the class of the deleted objects the handler was passed, which is a subclass of its
+    deleted_obj_class when the handler is registered for a base class. It defaults to the deleted_obj_class.
+
+    The children of a call are the calls of the next cascade level that were passed objects of a class the call
+    cascaded to. Since cascades are merged by class, a call can be the child of several calls.
+    """
+    def __init__(
+        self, side_effects_class, level, duration, num_queries, num_deleted_objs, num_side_effect_objs,
+        num_cascade_deleted_objs, cascade_classes, thread_ident=None, batch_class=None
+    ):
+        self.side_effects_class = side_effects_class
+        self.level = level
+        self.duration = duration
+        self.num_queries = num_queries
+        self.num_deleted_objs = num_deleted_objs
+        self.num_side_effect_objs = num_side_effect_objs
+        self.num_cascade_deleted_objs = num_cascade_deleted_objs
+        self.cascade_classes = cascade_classes
+        self.thread_ident = thread_ident
+        self.batch_class = batch_class if batch_class is not None else side_effects_class.deleted_obj_class
+        self.children = []
+
+    def __repr__(self):
+        return '<HandlerCallProfile {0} level={1} duration={2:.6f} queries={3}>'.format(
+            self.side_effects_class.__name__, self.level, self.duration, self.num_queries)
+
+    @property
+    def deleted_obj_class(self):
+        return self.side_effects_class.deleted_obj_class
+
+
+class GatherProfile(object):
+    """
+    The profile of a gather. It holds the measurements of every handler call, organized as a cascade tree whose
+    roots are the calls of the first level, along with the totals of the gather.
+    """
+    def __init__(self):
+        self.calls = []
+        self.duration = None
+        self.num_queries = None
+
+    def __repr__(self):
+        return '<GatherProfile calls={0} duration={1} queries={2}>'.format(
+            len(self.calls), self.duration, self.num_queries)
+
+    @property
+    def roots(self):
+        return [call for call in self.calls if call.level == 0]
+
+    def add_call(self, call):
+        """
+        Adds a handler call and links it to the calls of the previous level that cascaded to its class
+        """
+        for parent in self.calls:
+            if parent.level == call.level - 1 and call.batch_class in parent.cascade_classes:
+                parent.children.append(call)
+
+        self.calls.append(call)
+
+    def format(self):
+        """
+        Returns a human readable rendering of the cascade tree
+        """
+        lines = []
+
+        def add_lines(call, depth):
+            lines.append((
+                '{0}{1} level={2} duration={3:.6f}s queries={4} deleted={5} side_effects={6} cascades={7}'
+            ).format(
+                '  ' * depth, call.side_effects_class.__name__, call.level, call.duration, call.num_queries,
+                call.num_deleted_objs, call.num_side_effect_objs, call.num_cascade_deleted_objs))
+            for child in call.children:
+                add_lines(child, depth + 1)
+
+        for root in self.roots:
+            add_lines(root, 0)
+
+        return '\n'.join(lines)
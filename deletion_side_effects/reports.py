@@ -0,0 +1,184 @@
+"""
+Gathers side effects in the background and persists them as DeletionSideEffectReport rows. Views queue a report for
+the roots of a deletion with queue_deletion_side_effect_report and poll for it. The
+process_deletion_side_effect_reports management command, or a call to process_deletion_side_effect_reports, runs the
+queued reports in a local process pool. No broker is needed since the queue is the report table itself.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import traceback
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Model
+from django.utils import timezone
+
+from deletion_side_effects.deletion_side_effects import gather_deletion_side_effects
+from deletion_side_effects.models import DeletionSideEffectReport, get_report_object_ids
+
+
+# The keyword arguments of gather_deletion_side_effects that can be stored with a report
+REPORT_GATHER_KWARGS = (
+    'use_cache', 'deadline', 'max_objects', 'max_side_effect_objs_per_handler', 'using', 'max_replica_lag',
+    'max_memory_keys',
+)
+
+# The number of seconds after which running reports are considered abandoned by their worker, unless the
+# DELETION_SIDE_EFFECTS_REPORT_TIMEOUT setting overrides it
+DEFAULT_REPORT_TIMEOUT = 3600
+
+
+def _get_stale_cutoff(timeout=None):
+    """
+    Returns the time before which running reports were started by a worker that is considered dead
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'DELETION_SIDE_EFFECTS_REPORT_TIMEOUT', DEFAULT_REPORT_TIMEOUT)
+    return timezone.now() - timedelta(seconds=timeout)
+
+
+def queue_deletion_side_effect_report(obj_class, objs, **gather_kwargs):
+    """
+    Queues a report of the side effects of deleting the objects and returns it. A report of the same roots and
+    keyword arguments that is still pending or running is returned instead of queueing another one, unless it has
+    been running for longer than the report timeout.
+    """
+    invalid_kwargs = set(gather_kwargs) - set(REPORT_GATHER_KWARGS)
+    if invalid_kwargs:
+        raise ValueError('Invalid report gather arguments {0}'.format(', '.join(sorted(invalid_kwargs))))
+
+    report = DeletionSideEffectReport.objects.for_objs(obj_class, objs).filter(
+        gather_kwargs=gather_kwargs,
+        status__in=[DeletionSideEffectReport.STATUS_PENDING, DeletionSideEffectReport.STATUS_RUNNING],
+    ).exclude(
+        status=DeletionSideEffectReport.STATUS_RUNNING, started__lt=_get_stale_cutoff(),
+    ).first()
+    if report is None:
+        report = DeletionSideEffectReport.objects.create(
+            content_type=ContentType.objects.get_for_model(obj_class, for_concrete_model=False),
+            object_ids=get_report_object_ids(objs),
+            gather_kwargs=gather_kwargs,
+        )
+
+    return report
+
+
+def _get_report_side_effect(side_effect):
+    """
+    Returns the compact form of a side effect that is stored in a report. Side effect objects that are not model
+    instances are only counted.
+    """
+    side_effect_objs = side_effect['side_effect_objs']
+    objects = {}
+    for obj in side_effect_objs:
+        if isinstance(obj, Model):
+            objects.setdefault(obj._meta.label_lower, []).append(obj.pk)
+
+    return {
+        'msg': side_effect['msg'],
+        'count': len(side_effect_objs),
+        'objects': objects,
+    }
+
+
+def run_deletion_side_effect_report(report_id):
+    """
+    Gathers the side effects of a report and stores them. Errors of the gather are stored with the report, which is
+    marked as failed. Roots that no longer exist are skipped.
+    """
+    report = DeletionSideEffectReport.objects.select_related('content_type').get(id=report_id)
+    try:
+        obj_class = report.content_type.model_class()
+        objs = list(obj_class._base_manager.filter(pk__in=report.object_ids))
+        side_effects = gather_deletion_side_effects(obj_class, objs, **report.gather_kwargs)
+        report.side_effects = [_get_report_side_effect(side_effect) for side_effect in side_effects]
+        report.truncated_by = sorted(side_effects.truncated_by)
+        report.status = DeletionSideEffectReport.STATUS_DONE
+    except Exception:
+        report.error = traceback.format_exc()
+        report.status = DeletionSideEffectReport.STATUS_FAILED
+
+    report.finished = timezone.now()
+    report.save(update_fields=['side_effects', 'truncated_by', 'error', 'status', 'finished'])
+
+
+def _fail_report(report_id, error):
+    """
+    Marks a running report as failed with the error, for reports whose worker did not store a result
+    """
+    DeletionSideEffectReport.objects.filter(id=report_id, status=DeletionSideEffectReport.STATUS_RUNNING).update(
+        status=DeletionSideEffectReport.STATUS_FAILED, error=error, finished=timezone.now())
+
+
+def _fail_stale_reports(timeout=None):
+    """
+    Marks the reports that have been running for longer than the timeout as failed, since their worker was killed
+    or lost its connection before it could store a result. Returns the number of failed reports.
+    """
+    cutoff = _get_stale_cutoff(timeout)
+    return DeletionSideEffectReport.objects.filter(
+        status=DeletionSideEffectReport.STATUS_RUNNING, started__lt=cutoff,
+    ).update(
+        status=DeletionSideEffectReport.STATUS_FAILED, finished=timezone.now(),
+        error='The report was started before {0} and did not finish\n'.format(cutoff.isoformat()))
+
+
+def _claim_reports(limit=None):
+    """
+    Marks up to limit pending reports as running and returns their ids. Reports that are locked by other workers are
+    skipped on databases that support it, so several workers can share the queue.
+    """
+    with transaction.atomic():
+        report_ids = list(DeletionSideEffectReport.objects.select_for_update(skip_locked=True).filter(
+            status=DeletionSideEffectReport.STATUS_PENDING,
+        ).order_by('id').values_list('id', flat=True)[:limit])
+        DeletionSideEffectReport.objects.filter(id__in=report_ids).update(
+            status=DeletionSideEffectReport.STATUS_RUNNING, started=timezone.now())
+
+    return report_ids
+
+
+def _init_worker():
+    """
+    Sets up Django in worker processes that were spawned instead of forked
+    """
+    if not apps.ready:
+        django.setup()
+
+
+def make_report_executor(max_workers=None):
+    """
+    Returns the process pool that runs reports. Spawned workers set up Django from the DJANGO_SETTINGS_MODULE
+    environment variable.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+
+
+def process_deletion_side_effect_reports(executor=None, limit=None, timeout=None):
+    """
+    Runs up to limit pending reports and returns their ids. The reports are run on the executor, such as the process
+    pool of make_report_executor, or in this process if there is none. Reports whose run fails on the executor, for
+    example because a worker process died and broke the pool, are marked as failed.
+
+    Reports that have been running for longer than timeout seconds, which defaults to the
+    DELETION_SIDE_EFFECTS_REPORT_TIMEOUT setting, are marked as failed first.
+    """
+    _fail_stale_reports(timeout)
+    report_ids = _claim_reports(limit)
+    if executor is None:
+        for report_id in report_ids:
+            run_deletion_side_effect_report(report_id)
+    elif report_ids:
+        # Forked workers must not share the database connections of this process
+        connections.close_all()
+        futures = [executor.submit(run_deletion_side_effect_report, report_id) for report_id in report_ids]
+        for report_id, future in zip(report_ids, futures):
+            try:
+                future.result()
+            except Exception:
+                _fail_report(report_id, traceback.format_exc())
+
+    return report_ids
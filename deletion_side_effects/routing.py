@@ -0,0 +1,85 @@
+"""
+Routes the queries of gathers to a database alias, such as a read replica. Gathers that are passed an alias pin
+the querysets of the engine and of the handlers to it. Queries that handlers run without naming a database are routed
+to it by DeletionSideEffectsRouter, which reads the alias of the running gather from a context variable.
+"""
+from contextlib import contextmanager
+import contextvars
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils.module_loading import import_string
+
+
+# The database alias of the gather that is running in the current context
+_gather_database = contextvars.ContextVar('deletion_side_effects_gather_database', default=None)
+
+
+def get_gather_database():
+    """
+    Returns the database alias of the gather that is running in the current context, or None
+    """
+    return _gather_database.get()
+
+
+@contextmanager
+def use_gather_database(using):
+    """
+    Sets the database alias of the gather for the duration of the block. Nothing is set when the alias is None.
+    """
+    if using is None:
+        yield
+        return
+
+    token = _gather_database.set(using)
+    try:
+        yield
+    finally:
+        _gather_database.reset(token)
+
+
+class DeletionSideEffectsRouter(object):
+    """
+    A database router that sends the reads of handlers to the database alias of the running gather. Add it before
+    the other routers in the DATABASE_ROUTERS setting. Outside of gathers it defers to the next router.
+    """
+    def db_for_read(self, model, **hints):
+        return get_gather_database()
+
+
+def get_replica_lag(using):
+    """
+    Returns the replication lag of a database in seconds, or None if it is unknown. The
+    DELETION_SIDE_EFFECTS_REPLICA_LAG setting can name a function that is passed the alias and returns the lag. By
+    default the lag of PostgreSQL standbys is the time since the last replayed transaction, and other databases have
+    no lag.
+    """
+    lag_function_path = getattr(settings, 'DELETION_SIDE_EFFECTS_REPLICA_LAG', None)
+    if lag_function_path is not None:
+        return import_string(lag_function_path)(using)
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN pg_is_in_recovery() '
+            'THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END')
+        lag = cursor.fetchone()[0]
+
+    return float(lag) if lag is not None else None
+
+
+def resolve_gather_database(obj_class, using, max_replica_lag=None):
+    """
+    Returns the database alias a gather of the class runs on. When max_replica_lag is given and the lag of the alias
+    is over it, or unknown, the gather falls back to the database that writes to the class.
+    """
+    if using is None or max_replica_lag is None:
+        return using
+
+    lag = get_replica_lag(using)
+    if lag is None or lag > max_replica_lag:
+        return router.db_for_write(obj_class)
+    return using
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent after every handler call of an instrumented gather. The sender is the side effects class and the call keyword
+# argument is the deletion_side_effects.profiling.HandlerCallProfile of the call
+handler_called = Signal()
@@ -0,0 +1,118 @@
+"""
+Temporary on disk storage for the key sets of large gathers. Gathers that are given a memory cap move the keys of
+deleted objects to a temporary SQLite database once they hold more keys than the cap, along with the pks of lazy
+batches of the same classes. The cascade of an account purge can then be walked in bounded memory, at the cost of a
+local SQLite query for every lookup.
+"""
+from itertools import islice
+import sqlite3
+import threading
+
+
+# The number of keys that are bound to a single SQLite statement, which stays under the variable limit of old
+# SQLite versions
+MAX_SQLITE_VARIABLES = 500
+
+
+def _iter_key_chunks(keys, chunk_size=MAX_SQLITE_VARIABLES):
+    keys = iter(keys)
+    chunk = list(islice(keys, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(keys, chunk_size))
+
+
+def _to_sqlite(key):
+    """
+    Returns the value a key is stored as. Keys other than ints and strings, such as UUIDs, are stored as strings
+    """
+    return key if isinstance(key, (int, str)) else str(key)
+
+
+class SpillStore(object):
+    """
+    A private temporary SQLite database that holds sets of keys, one table per set. SQLite deletes the database
+    file once the store is closed or garbage collected. The store can be shared by the threads of a gather.
+    """
+    def __init__(self):
+        # An empty file name creates a private database on disk that only this connection can see
+        self._connection = sqlite3.connect('', check_same_thread=False)
+        self._lock = threading.Lock()
+        self._num_tables = 0
+
+    def create_key_set(self, model_class):
+        """
+        Returns a new empty SpilledKeySet of the pks of the model class
+        """
+        with self._lock:
+            table = 'keys_{0}'.format(self._num_tables)
+            self._num_tables += 1
+            self._connection.execute('CREATE TABLE {0} (key PRIMARY KEY) WITHOUT ROWID'.format(table))
+
+        return SpilledKeySet(self, table, model_class)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def executemany(self, sql, params):
+        with self._lock:
+            self._connection.executemany(sql, params)
+
+    def close(self):
+        self._connection.close()
+
+
+class SpilledKeySet(object):
+    """
+    A set of the pks of a model that is stored in a table of a SpillStore. It supports the set operations the
+    gatherer uses. Keys are converted back to the type of the pk of the model when they are read.
+    """
+    def __init__(self, store, table, model_class):
+        self.store = store
+        self.table = table
+        self.model_class = model_class
+
+    def add(self, key):
+        self.update([key])
+
+    def update(self, keys):
+        if isinstance(keys, SpilledKeySet):
+            self.store.execute('INSERT OR IGNORE INTO {0} SELECT key FROM {1}'.format(self.table, keys.table))
+            return
+
+        for chunk in _iter_key_chunks(keys):
+            self.store.executemany(
+                'INSERT OR IGNORE INTO {0} VALUES (?)'.format(self.table), [(_to_sqlite(key),) for key in chunk])
+
+    def get_new_keys(self, keys):
+        """
+        Returns the keys of a list that are not in the set, in order
+        """
+        existing = set()
+        for chunk in _iter_key_chunks(keys):
+            existing.update(row[0] for row in self.store.execute(
+                'SELECT key FROM {0} WHERE key IN ({1})'.format(self.table, ', '.join('?' * len(chunk))),
+                [_to_sqlite(key) for key in chunk]))
+
+        return [key for key in keys if _to_sqlite(key) not in existing]
+
+    def iter_chunks(self, chunk_size):
+        """
+        Yields the keys in sorted lists of at most chunk_size keys. The table is read one chunk at a time.
+        """
+        rows = self.store.execute('SELECT key FROM {0} ORDER BY key LIMIT ?'.format(self.table), [chunk_size])
+        while rows:
+            yield [self.model_class._meta.pk.to_python(row[0]) for row in rows]
+            rows = self.store.execute(
+                'SELECT key FROM {0} WHERE key > ? ORDER BY key LIMIT ?'.format(self.table), [rows[-1][0], chunk_size])
+
+    def __contains__(self, key):
+        return bool(self.store.execute('SELECT 1 FROM {0} WHERE key = ?'.format(self.table), [_to_sqlite(key)]))
+
+    def __iter__(self):
+        for chunk in self.iter_chunks(MAX_SQLITE_VARIABLES):
+            yield from chunk
+
+    def __len__(self):
+        return self.store.execute('SELECT COUNT(*) FROM {0}'.format(self.table))[0][0]
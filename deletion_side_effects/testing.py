@@ -0,0 +1,16 @@
+from deletion_side_effects.deletion_side_effects import gather_deletion_side_effects
+
+
+def assert_gather_query_budget(obj_class, objs, max_queries, **kwargs):
+    """
+    Gathers the side effects of deleting the objects and raises an AssertionError if the gather ran more than
+    max_queries queries. The error contains the profile of the gather so that the handler responsible for the extra
+    queries can be found. Keyword arguments are passed to gather_deletion_side_effects. Returns the result of the
+    gather.
+    """
+    result = gather_deletion_side_effects(obj_class, objs, profile=True, **kwargs)
+    if result.profile.num_queries > max_queries:
+        raise AssertionError('Gathering the side effects ran {0} queries, the budget is {1}\n{2}'.format(
+            result.profile.num_queries, max_queries, result.profile.format()))
+
+    return result
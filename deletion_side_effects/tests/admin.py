@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from deletion_side_effects.admin import DeletionSideEffectsAdminMixin
+from deletion_side_effects.tests.models import Child, Parent
+
+
+@admin.register(Parent)
+class ParentAdmin(DeletionSideEffectsAdminMixin, admin.ModelAdmin):
+    deletion_side_effects_per_page = 2
+
+
+admin.site.register(Child)
@@ -0,0 +1,5 @@
+from deletion_side_effects.deletion_side_effects import register_lazy_deletion_side_effects
+
+
+register_lazy_deletion_side_effects(
+    'tests.Child', 'deletion_side_effects.tests.lazy_handlers.LazyChildDeletionSideEffects')
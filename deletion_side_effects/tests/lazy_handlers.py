@@ -0,0 +1,23 @@
+from deletion_side_effects.deletion_side_effects import BaseDeletionSideEffects
+from deletion_side_effects.tests.models import Child, GrandChild, Parent
+
+
+class LazyChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Child
+
+    def get_side_effects(self, deleted_objs):
+        return deleted_objs, []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted lazily'.format(len(side_effect_objs))
+
+
+class LazyParentDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Parent
+
+    def get_side_effects(self, deleted_objs):
+        return None, list(Child.objects.filter(parent__in=deleted_objs))
+
+
+class LazyGrandChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = GrandChild
@@ -0,0 +1,41 @@
+from django.db import models
+
+
+class Parent(models.Model):
+    name = models.CharField(max_length=64, default='')
+
+
+class SpecialParent(Parent):
+    special = models.BooleanField(default=True)
+
+
+class ProxyParent(Parent):
+    class Meta:
+        proxy = True
+
+
+class Child(models.Model):
+    parent = models.ForeignKey(Parent, on_delete=models.CASCADE)
+    other_parent = models.ForeignKey(
+        Parent, related_name='other_children', null=True, blank=True, on_delete=models.CASCADE)
+
+
+class GrandChild(models.Model):
+    child = models.ForeignKey(Child, on_delete=models.CASCADE)
+
+
+class Reference(models.Model):
+    parent = models.ForeignKey(Parent, null=True, blank=True, on_delete=models.SET_NULL)
+
+
+class ProtectedReference(models.Model):
+    parent = models.ForeignKey(Parent, on_delete=models.PROTECT)
+
+
+class Team(models.Model):
+    captain = models.ForeignKey(
+        'Player', related_name='captained_teams', null=True, blank=True, on_delete=models.SET_NULL)
+
+
+class Player(models.Model):
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
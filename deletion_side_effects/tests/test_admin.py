@@ -0,0 +1,180 @@
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django_dynamic_fixture import G
+from unittest.mock import patch
+
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, register_deletion_side_effects
+)
+from deletion_side_effects.tests.models import Child, GrandChild, Parent, ProtectedReference
+
+
+class ChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Parent
+    uses_querysets = True
+
+    def get_side_effects(self, deleted_objs):
+        children = Child.objects.filter(parent__in=deleted_objs)
+        return children, children
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted'.format(len(side_effect_objs))
+
+    def get_side_effect_count(self, side_effect_objs):
+        return side_effect_objs.count()
+
+
+class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Child
+    cascades_to = []
+
+    def get_side_effects(self, deleted_objs):
+        return list(GrandChild.objects.filter(child__in=deleted_objs).order_by('id')), []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} grand children deleted'.format(len(side_effect_objs))
+
+
+HANDLER_PATH = 'deletion_side_effects.tests.test_admin.ChildDeletionSideEffects'
+
+
+@override_settings(
+    ROOT_URLCONF='deletion_side_effects.tests.urls',
+    MIDDLEWARE=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+    ],
+)
+class TestDeletionSideEffectsAdminMixin(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(ChildDeletionSideEffects, GrandChildDeletionSideEffects)
+
+        self.parent = G(Parent)
+        self.children = [G(Child, parent=self.parent) for _ in range(3)]
+        self.grand_children = [G(GrandChild, child=self.children[0]), G(GrandChild, child=self.children[0])]
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def get_side_effects_url(self, *parents, handler=HANDLER_PATH):
+        ids = '&'.join('id={0}'.format(parent.id) for parent in parents)
+        return '{0}?{1}&handler={2}'.format(reverse('admin:tests_parent_deletion_side_effects'), ids, handler)
+
+    def test_delete_view(self):
+        response = self.client.get(reverse('admin:tests_parent_delete', args=(self.parent.id,)))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['model_count']), [('parents', 1)])
+        self.assertEqual(response.context['deleted_objects'], [
+            'Parent: <a href="{0}">{1}</a>'.format(
+                reverse('admin:tests_parent_change', args=(self.parent.id,)), self.parent),
+            '3 children deleted (<a href="{0}">3 objects</a>)'.format(
+                self.get_side_effects_url(self.parent).replace('&', '&amp;')),
+            '2 grand children deleted (<a href="{0}">2 objects</a>)'.format(
+                self.get_side_effects_url(
+                    self.parent, handler='deletion_side_effects.tests.test_admin.GrandChildDeletionSideEffects',
+                ).replace('&', '&amp;')),
+        ])
+        self.assertContains(response, '3 children deleted')
+
+        # The deletion itself is done by the admin
+        response = self.client.post(reverse('admin:tests_parent_delete', args=(self.parent.id,)), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Parent.objects.exists())
+
+    def test_delete_selected(self):
+        other_parent = G(Parent)
+        response = self.client.post(reverse('admin:tests_parent_changelist'), {
+            'action': 'delete_selected', '_selected_action': [self.parent.id, other_parent.id],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['model_count']), [('parents', 2)])
+        self.assertEqual(len(response.context['deletable_objects'][0]), 4)
+        self.assertContains(response, '3 children deleted')
+
+    def test_perms_needed(self):
+        user = G(User, is_staff=True)
+        user.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='tests', codename__in=['view_parent', 'delete_parent']))
+        self.client.force_login(user)
+
+        # The children the parent cascades to are registered without delete permission
+        url = reverse('admin:tests_parent_delete', args=(self.parent.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.context['perms_lacking'], {'child'})
+
+        self.assertEqual(self.client.post(url, {'post': 'yes'}).status_code, 403)
+        self.assertTrue(Parent.objects.exists())
+
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='tests', codename='delete_child'))
+        self.assertEqual(self.client.get(url).context['perms_lacking'], set())
+
+    def test_perms_needed_of_cascades_without_side_effects(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(ChildDeletionSideEffects)
+        user = G(User, is_staff=True)
+        user.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='tests', codename__in=['view_parent', 'delete_parent']))
+        self.client.force_login(user)
+
+        # The children lead to no side effects, so they are only walked by complete gathers
+        url = reverse('admin:tests_parent_delete', args=(self.parent.id,))
+        self.assertEqual(self.client.get(url).context['perms_lacking'], set())
+
+        with patch.object(admin.site._registry[Parent], 'deletion_side_effects_complete', True):
+            self.assertEqual(self.client.get(url).context['perms_lacking'], {'child'})
+
+    def test_protected(self):
+        reference = G(ProtectedReference, parent=self.parent)
+        response = self.client.get(reverse('admin:tests_parent_delete', args=(self.parent.id,)))
+
+        self.assertEqual(response.context['protected'], ['Protected reference: {0}'.format(reference)])
+
+    def test_side_effect_objects_are_paginated(self):
+        response = self.client.get(self.get_side_effects_url(self.parent))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['title'], '3 children deleted')
+        self.assertEqual(response.context['side_effect_objs'], [
+            'Child: <a href="{0}">{1}</a>'.format(reverse('admin:tests_child_change', args=(child.id,)), child)
+            for child in self.children[:2]
+        ])
+        self.assertContains(response, 'Page 1 of 2, 3 objects')
+
+        response = self.client.get(self.get_side_effects_url(self.parent) + '&page=2')
+        self.assertEqual(len(response.context['side_effect_objs']), 1)
+        self.assertNotIn('page=', response.context['query'])
+
+    def test_side_effect_objects_of_other_handlers_not_rendered(self):
+        with patch.object(GrandChildDeletionSideEffects, 'get_side_effect_message', side_effect=AssertionError):
+            response = self.client.get(self.get_side_effects_url(self.parent))
+
+        self.assertEqual(response.context['title'], '3 children deleted')
+
+    def test_side_effect_objects_of_other_handlers_not_gathered(self):
+        with patch.object(GrandChildDeletionSideEffects, 'get_side_effects', side_effect=AssertionError):
+            response = self.client.get(self.get_side_effects_url(self.parent))
+
+        self.assertEqual(response.context['title'], '3 children deleted')
+
+    def test_uncounted_side_effect_objects(self):
+        response = self.client.get(self.get_side_effects_url(
+            self.parent, handler='deletion_side_effects.tests.test_admin.GrandChildDeletionSideEffects'))
+
+        self.assertEqual(response.context['side_effect_objs'], [
+            'Grand child: {0}'.format(grand_child) for grand_child in self.grand_children
+        ])
+
+    def test_side_effect_objects_not_found(self):
+        self.assertEqual(self.client.get(self.get_side_effects_url(self.parent, handler='missing')).status_code, 404)
+        self.assertEqual(self.client.get(self.get_side_effects_url(Parent(id='invalid'))).status_code, 404)
+
+    def test_side_effect_objects_permission(self):
+        self.client.force_login(G(User, is_staff=True))
+        self.assertEqual(self.client.get(self.get_side_effects_url(self.parent)).status_code, 403)
+
+    def test_format_non_model_objs(self):
+        self.assertEqual(admin.site._registry[Parent]._format_obj('name'), 'name')
@@ -0,0 +1,195 @@
+from django.apps import apps
+from django.db.models import CASCADE, SET_NULL
+from django.test import TransactionTestCase, override_settings
+from django_dynamic_fixture import G
+
+from deletion_side_effects.auto_cascade import get_relation_graph, register_auto_cascade_deletion_side_effects
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, gather_deletion_side_effects, gather_deletion_side_effects_bulk,
+    register_deletion_side_effects
+)
+from deletion_side_effects.tests.models import (
+    Child, GrandChild, Parent, ProtectedReference, Reference, SpecialParent
+)
+
+
+class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = GrandChild
+
+    def get_side_effects(self, deleted_objs):
+        return deleted_objs, []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} grand children deleted'.format(len(side_effect_objs))
+
+
+class TestGetRelationGraph(TransactionTestCase):
+    def test_relations(self):
+        graph = get_relation_graph([Parent, Child, GrandChild, ProtectedReference])
+
+        # Protected references are not followed
+        self.assertEqual(graph[Parent], {
+            CASCADE: {SpecialParent: ['parent_ptr'], Child: ['parent', 'other_parent']},
+            SET_NULL: {Reference: ['parent']},
+        })
+        self.assertEqual(graph[Child], {CASCADE: {GrandChild: ['child']}, SET_NULL: {}})
+        self.assertEqual(graph[GrandChild], {CASCADE: {}, SET_NULL: {}})
+        self.assertEqual(graph[ProtectedReference], {CASCADE: {}, SET_NULL: {}})
+
+    def test_installed_models(self):
+        graph = get_relation_graph()
+        self.assertEqual(set(graph), set(apps.get_models(include_auto_created=True)))
+
+
+class TestRegisterAutoCascadeDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_register(self):
+        handlers = register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+
+        self.assertEqual([handler.__name__ for handler in handlers], [
+            'ParentAutoCascadeDeletionSideEffects', 'ParentReferenceAutoSetNullDeletionSideEffects',
+            'ChildAutoCascadeDeletionSideEffects',
+        ])
+        self.assertEqual(set(_DELETION_SIDE_EFFECTS), {Parent, Child})
+
+        # Handlers are built once
+        self.assertEqual(register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild]), handlers)
+        self.assertEqual(len(_DELETION_SIDE_EFFECTS[Parent]), 2)
+
+    def test_registered_when_ready(self):
+        app_config = apps.get_app_config('deletion_side_effects')
+
+        app_config.ready()
+        self.assertEqual(dict(_DELETION_SIDE_EFFECTS), {})
+
+        with override_settings(DELETION_SIDE_EFFECTS_AUTO_CASCADE=True):
+            app_config.ready()
+        self.assertEqual(
+            set(handler.__name__ for handler in _DELETION_SIDE_EFFECTS[Parent]),
+            {'ParentAutoCascadeDeletionSideEffects', 'ParentReferenceAutoSetNullDeletionSideEffects'})
+
+    def test_gather(self):
+        parents = [G(Parent), G(Parent)]
+        children = [
+            G(Child, parent=parents[0], other_parent=None),
+            G(Child, parent=parents[1], other_parent=parents[0]),
+            G(Child, parent=G(Parent), other_parent=None),
+        ]
+        grand_children = [G(GrandChild, child=children[0]), G(GrandChild, child=children[1])]
+        G(GrandChild, child=children[2])
+        references = [G(Reference, parent=parents[0])]
+        G(Reference, parent=None)
+
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        register_deletion_side_effects(GrandChildDeletionSideEffects)
+
+        # A pk query for the multi-table children, which inherit the handlers of the parent, one for the children
+        # and one for the grand children, a check that each cascaded level has rows that were not deleted yet, the
+        # grand children themselves and a check for the references
+        with self.assertNumQueries(7):
+            side_effects = gather_deletion_side_effects(Parent, parents[:1])
+
+        self.assertEqual(sorted(side_effects, key=lambda side_effect: side_effect['msg']), [{
+            'msg': '1 reference will have parent cleared',
+            'side_effect_objs': references,
+        }, {
+            'msg': '2 grand children deleted',
+            'side_effect_objs': grand_children,
+        }])
+
+        # Nothing is cascaded from parents without children
+        self.assertEqual(gather_deletion_side_effects(Parent, [G(Parent)]), [])
+
+    def test_referencing_models_without_handlers_not_queried(self):
+        parent = G(Parent)
+        G(Child, parent=parent)
+
+        register_auto_cascade_deletion_side_effects([Parent])
+
+        # Only the pk query for the multi-table children and the check for references run
+        with self.assertNumQueries(2):
+            side_effects = gather_deletion_side_effects(Parent, [parent])
+        self.assertEqual(side_effects, [])
+
+        with self.assertNumQueries(2):
+            side_effects, = gather_deletion_side_effects_bulk(Parent, [parent])
+        self.assertEqual(side_effects, [])
+
+    def test_gather_bulk(self):
+        parents = [G(Parent), G(Parent), G(Parent)]
+        children = [
+            G(Child, parent=parents[0], other_parent=None),
+            G(Child, parent=parents[1], other_parent=parents[0]),
+        ]
+        grand_children = [G(GrandChild, child=children[0]), G(GrandChild, child=children[1])]
+        references = [G(Reference, parent=parents[1]), G(Reference, parent=parents[2])]
+
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        register_deletion_side_effects(GrandChildDeletionSideEffects)
+
+        # The multi-table children, the children, the references and the grand children are loaded once for every
+        # root
+        with self.assertNumQueries(4):
+            results = gather_deletion_side_effects_bulk(Parent, parents)
+
+        for parent, result in zip(parents, results):
+            self.assertEqual(
+                sorted(result, key=lambda side_effect: side_effect['msg']),
+                sorted(gather_deletion_side_effects(Parent, [parent]), key=lambda side_effect: side_effect['msg']))
+
+        self.assertEqual(results[0], [{
+            'msg': '2 grand children deleted',
+            'side_effect_objs': grand_children,
+        }])
+        self.assertEqual(sorted(results[1], key=lambda side_effect: side_effect['msg']), [{
+            'msg': '1 grand children deleted',
+            'side_effect_objs': grand_children[1:],
+        }, {
+            'msg': '1 reference will have parent cleared',
+            'side_effect_objs': references[:1],
+        }])
+        self.assertEqual(results[2], [{
+            'msg': '1 reference will have parent cleared',
+            'side_effect_objs': references[1:],
+        }])
+
+
+class TestAutoCascadeOnReplica(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        register_deletion_side_effects(GrandChildDeletionSideEffects)
+
+        self.parent = G(Parent)
+        child = G(Child, parent=self.parent, other_parent=None)
+        self.grand_children = [G(GrandChild, child=child)]
+        self.references = [G(Reference, parent=self.parent)]
+
+    def test_gather(self):
+        # The referencing rows are queried on the gather database without a router
+        with self.assertNumQueries(0):
+            side_effects = gather_deletion_side_effects(Parent, [self.parent], using='replica')
+
+        self.assertEqual(sorted(side_effects, key=lambda side_effect: side_effect['msg']), [{
+            'msg': '1 grand children deleted',
+            'side_effect_objs': self.grand_children,
+        }, {
+            'msg': '1 reference will have parent cleared',
+            'side_effect_objs': self.references,
+        }])
+
+    def test_gather_bulk(self):
+        with self.assertNumQueries(0):
+            side_effects, = gather_deletion_side_effects_bulk(Parent, [self.parent], using='replica')
+
+        self.assertEqual(sorted(side_effects, key=lambda side_effect: side_effect['msg']), [{
+            'msg': '1 grand children deleted',
+            'side_effect_objs': self.grand_children,
+        }, {
+            'msg': '1 reference will have parent cleared',
+            'side_effect_objs': self.references,
+        }])
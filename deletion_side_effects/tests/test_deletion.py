@@ -0,0 +1,194 @@
+from django.db import IntegrityError
+from django.test import TransactionTestCase
+from django_dynamic_fixture import G
+from unittest.mock import patch
+
+from deletion_side_effects.auto_cascade import register_auto_cascade_deletion_side_effects
+from deletion_side_effects.deletion import (
+    DeletionSideEffectsChanged, _get_delete_order, _verify, delete_with_side_effects
+)
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, _DeletionSideEffectsGatherer, gather_deletion_side_effects,
+    register_deletion_side_effects
+)
+from deletion_side_effects.tests.models import (
+    Child, GrandChild, Parent, Player, ProtectedReference, Reference, SpecialParent, Team
+)
+
+
+class ChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Child
+
+    def get_side_effects(self, deleted_objs):
+        return deleted_objs, []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted'.format(len(side_effect_objs))
+
+
+class TestDeleteWithSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+        self.parents = [G(Parent), G(Parent)]
+        self.children = [
+            G(Child, parent=self.parents[0], other_parent=None),
+            G(Child, parent=self.parents[1], other_parent=self.parents[0]),
+            G(Child, parent=self.parents[1], other_parent=None),
+        ]
+        self.grand_children = [G(GrandChild, child=child) for child in self.children]
+        self.references = [G(Reference, parent=self.parents[0]), G(Reference, parent=self.parents[1])]
+
+    def test_delete(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        register_deletion_side_effects(ChildDeletionSideEffects)
+
+        side_effects = delete_with_side_effects(Parent, self.parents[:1], verify=True)
+
+        # The side effects were loaded before the deletion
+        self.assertEqual(sorted(side_effect['msg'] for side_effect in side_effects), [
+            '1 reference will have parent cleared', '2 children deleted'
+        ])
+        self.assertEqual(side_effects.num_deleted, {
+            'tests.GrandChild': 2,
+            'tests.Child': 2,
+            'tests.Parent': 1,
+        })
+
+        self.assertEqual(list(Parent.objects.all()), self.parents[1:])
+        self.assertEqual(list(Child.objects.all()), self.children[2:])
+        self.assertEqual(list(GrandChild.objects.all()), self.grand_children[2:])
+        self.assertEqual(
+            list(Reference.objects.order_by('id').values_list('parent_id', flat=True)), [None, self.parents[1].id])
+
+    def test_delete_cascades_without_handlers(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child])
+
+        side_effects = delete_with_side_effects(Parent, self.parents)
+
+        self.assertEqual(side_effects.num_deleted, {'tests.GrandChild': 3, 'tests.Child': 3, 'tests.Parent': 2})
+        self.assertFalse(GrandChild.objects.exists())
+
+    def test_delete_multi_table_inheritance_parents(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child])
+        special_parent = G(SpecialParent)
+
+        side_effects = delete_with_side_effects(SpecialParent, [special_parent])
+
+        self.assertEqual(side_effects.num_deleted, {'tests.SpecialParent': 1, 'tests.Parent': 1})
+        self.assertEqual(set(Parent.objects.all()), set(self.parents))
+
+    def test_delete_models_that_reference_each_other(self):
+        register_auto_cascade_deletion_side_effects([Team, Player])
+        teams = [G(Team), G(Team)]
+        players = [G(Player, team=teams[0]), G(Player, team=teams[1])]
+        Team.objects.filter(id=teams[0].id).update(captain=players[0])
+        Team.objects.filter(id=teams[1].id).update(captain=players[0])
+
+        side_effects = delete_with_side_effects(Team, teams[:1], verify=True)
+
+        self.assertEqual(side_effects.num_deleted, {'tests.Player': 1, 'tests.Team': 1})
+        self.assertEqual(list(Team.objects.values_list('id', 'captain')), [(teams[1].id, None)])
+
+    def test_delete_previous_gather(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        register_deletion_side_effects(ChildDeletionSideEffects)
+        preview = gather_deletion_side_effects(Parent, self.parents[:1], complete=True, extendable=True)
+
+        with patch.object(_DeletionSideEffectsGatherer, 'gather', side_effect=AssertionError):
+            side_effects = delete_with_side_effects(Parent, self.parents[:1], verify=True, side_effects=preview)
+
+        self.assertIs(side_effects, preview)
+        self.assertIn({'msg': '2 children deleted', 'side_effect_objs': self.children[:2]}, side_effects)
+        self.assertEqual(side_effects.num_deleted, {'tests.GrandChild': 2, 'tests.Child': 2, 'tests.Parent': 1})
+        self.assertEqual(list(Child.objects.all()), self.children[2:])
+
+    def test_delete_previous_gather_extended_with_new_roots(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child])
+        preview = gather_deletion_side_effects(Parent, self.parents[:1], complete=True, extendable=True)
+
+        side_effects = delete_with_side_effects(Parent, self.parents, side_effects=preview)
+
+        self.assertEqual(side_effects.num_deleted, {'tests.GrandChild': 3, 'tests.Child': 3, 'tests.Parent': 2})
+        self.assertFalse(Parent.objects.exists())
+
+    def test_previous_gather_of_other_roots_not_deleted(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        preview = gather_deletion_side_effects(Parent, self.parents, complete=True, extendable=True)
+
+        with self.assertRaisesRegex(ValueError, 'gathered for 1 roots that are not deleted'):
+            delete_with_side_effects(Parent, self.parents[:1], side_effects=preview)
+
+        self.assertEqual(Parent.objects.count(), 2)
+        self.assertEqual(Child.objects.count(), 3)
+
+        # Roots passed as a queryset are read for their pks
+        side_effects = delete_with_side_effects(Parent, Parent.objects.all(), side_effects=preview)
+        self.assertEqual(side_effects.num_deleted['tests.Parent'], 2)
+
+    def test_verify_previous_gather_fails_for_changed_rows(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child, GrandChild])
+        preview = gather_deletion_side_effects(Parent, self.parents[:1], complete=True, extendable=True)
+        G(Child, parent=self.parents[0], other_parent=None)
+
+        with self.assertRaisesRegex(DeletionSideEffectsChanged, 'tests.Child rows that were not gathered'):
+            delete_with_side_effects(Parent, self.parents[:1], verify=True, side_effects=preview)
+
+        self.assertEqual(Parent.objects.count(), 2)
+
+    def test_previous_gather_must_be_complete_and_extendable(self):
+        register_auto_cascade_deletion_side_effects([Parent, Child])
+
+        for side_effects in [
+            gather_deletion_side_effects(Parent, self.parents, complete=True),
+            gather_deletion_side_effects(Parent, self.parents, extendable=True),
+        ]:
+            with self.assertRaisesRegex(ValueError, 'complete=True and extendable=True'):
+                delete_with_side_effects(Parent, self.parents, side_effects=side_effects)
+
+        side_effects = gather_deletion_side_effects(Parent, self.parents, complete=True, extendable=True, max_objects=1)
+        with self.assertRaisesRegex(ValueError, 'Truncated'):
+            delete_with_side_effects(Parent, self.parents, side_effects=side_effects)
+
+        side_effects = gather_deletion_side_effects(Parent, self.parents, complete=True, extendable=True)
+        with self.assertRaisesRegex(ValueError, 'gathered for tests.Parent, not tests.SpecialParent'):
+            delete_with_side_effects(SpecialParent, [], side_effects=side_effects)
+
+        self.assertEqual(Parent.objects.count(), 2)
+
+    def test_verify_fails_for_rows_that_were_not_gathered(self):
+        register_deletion_side_effects(ChildDeletionSideEffects)
+
+        with self.assertRaisesRegex(DeletionSideEffectsChanged, 'tests.Child rows that were not gathered'):
+            delete_with_side_effects(Parent, self.parents[:1], verify=True)
+
+        self.assertEqual(Parent.objects.count(), 2)
+
+    def test_protected_rows_roll_back(self):
+        G(ProtectedReference, parent=self.parents[0])
+        register_auto_cascade_deletion_side_effects([Parent, Child])
+
+        with self.assertRaisesRegex(DeletionSideEffectsChanged, 'tests.ProtectedReference rows'):
+            delete_with_side_effects(Parent, self.parents[:1], verify=True)
+
+        # Without verification the database rejects the deletion and the transaction is rolled back
+        with self.assertRaises(IntegrityError):
+            delete_with_side_effects(Parent, self.parents[:1])
+
+        self.assertEqual(Parent.objects.count(), 2)
+        self.assertEqual(Child.objects.count(), 3)
+        self.assertEqual(Reference.objects.filter(parent=self.parents[0]).count(), 1)
+
+    def test_verify_fails_for_rows_that_no_longer_exist(self):
+        with self.assertRaisesRegex(DeletionSideEffectsChanged, '1 of 2 gathered tests.Parent rows no longer exist'):
+            _verify({Parent: {self.parents[0].id, 0}}, 'default')
+
+
+class TestGetDeleteOrder(TransactionTestCase):
+    def test_referencing_rows_first(self):
+        self.assertEqual(
+            _get_delete_order([Parent, GrandChild, Reference, Child, SpecialParent]),
+            [GrandChild, Reference, SpecialParent, Child, Parent])
+
+    def test_models_that_reference_each_other(self):
+        self.assertEqual(_get_delete_order([Team, Parent, Player]), [Parent, Player, Team])
@@ -1,13 +1,48 @@
-from django.contrib.auth.models import User
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import copy
+import json
+import pickle
+import sys
+import threading
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.contrib.auth.models import Group, Permission, User
 from django.contrib.contenttypes.models import ContentType
-from django.test import TransactionTestCase
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Q, QuerySet
+from django.test import TransactionTestCase, override_settings
 from django_dynamic_fixture import G
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from deletion_side_effects.deletion_side_effects import (
     BaseDeletionSideEffects, register_deletion_side_effects,
-    _DELETION_SIDE_EFFECTS, gather_deletion_side_effects
+    _DELETION_SIDE_EFFECTS, gather_deletion_side_effects, summarize_deletion_side_effects, _get_identity,
+    iter_deletion_side_effects, DeletionSideEffectsRecord, agather_deletion_side_effects,
+    BaseAsyncDeletionSideEffects, DeletionSideEffectsContext, gather_deletion_side_effects_bulk,
+    _DeletionSideEffectsGatherer, register_lazy_deletion_side_effects, autodiscover_deletion_side_effects,
+    MAX_LAZY_LEVELS, DeletionSideEffect, _get_handler_path
 )
+from deletion_side_effects.signals import handler_called
+from deletion_side_effects.tests.models import Child, GrandChild, Parent, ProxyParent, SpecialParent
+from deletion_side_effects.testing import assert_gather_query_budget
+
+
+class ContentTypeIdDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    A handler defined at module level, so that its side effects can be pickled
+    """
+    deleted_obj_class = ContentType
+
+    def get_side_effects(self, deleted_objs):
+        return [deleted_obj.id for deleted_obj in deleted_objs], []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} ctypes deleted'.format(len(side_effect_objs))
 
 
 class TestGatherDeletionSideEffects(TransactionTestCase):
@@ -48,6 +83,105 @@ class TestGatherDeletionSideEffects(TransactionTestCase):
             'side_effect_objs': [side_effect_obj],
         }])
 
+    def test_side_effects_rendered_lazily(self):
+        messages = []
+
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                messages.append(side_effect_objs)
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+
+        ct = ContentType(id=1)
+        side_effect, = gather_deletion_side_effects(ContentType, [ct])
+        self.assertEqual(messages, [])
+        self.assertEqual(side_effect.side_effects_class, MyDeletionSideEffects)
+
+        # The message is rendered once on first access
+        self.assertEqual(side_effect['msg'], '1 ctypes deleted')
+        self.assertEqual(side_effect.msg, '1 ctypes deleted')
+        self.assertEqual(messages, [[ct]])
+
+        # Side effects behave like dictionaries
+        self.assertEqual(list(side_effect), ['msg', 'side_effect_objs'])
+        self.assertEqual(len(side_effect), 2)
+        self.assertEqual(side_effect.get('side_effect_objs'), [ct])
+        self.assertIsNone(side_effect.get('other'))
+        self.assertEqual(dict(side_effect), {'msg': '1 ctypes deleted', 'side_effect_objs': [ct]})
+        self.assertEqual(repr(side_effect), repr(dict(side_effect)))
+        with self.assertRaises(KeyError):
+            side_effect['other']
+
+    def test_side_effects_are_dictionaries(self):
+        register_deletion_side_effects(ContentTypeIdDeletionSideEffects)
+        rendered = {'msg': '1 ctypes deleted', 'side_effect_objs': [1]}
+
+        side_effect, = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertIsInstance(side_effect, dict)
+        self.assertEqual(json.dumps(side_effect), json.dumps(rendered))
+        self.assertEqual(gather_deletion_side_effects(ContentType, [ContentType(id=1)])[0], side_effect)
+        self.assertEqual({**gather_deletion_side_effects(ContentType, [ContentType(id=1)])[0]}, rendered)
+        self.assertFalse(side_effect != rendered)
+        self.assertTrue(side_effect != [rendered])
+
+        # Keys can be added and changed, and changes made before the first read are kept
+        side_effect['count'] = 1
+        side_effect.update(side_effect_objs=[2])
+        self.assertEqual(side_effect, {'msg': '1 ctypes deleted', 'side_effect_objs': [2], 'count': 1})
+        self.assertEqual(side_effect.side_effect_objs, [2])
+
+        side_effect, = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        side_effect['msg'] = 'Changed'
+        self.assertEqual(side_effect, {'msg': 'Changed', 'side_effect_objs': [1]})
+
+        # Copies are rendered dictionaries
+        side_effect, = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertEqual(side_effect.copy(), rendered)
+        self.assertIs(type(side_effect.copy()), dict)
+
+        for copied in [
+            pickle.loads(pickle.dumps(gather_deletion_side_effects(ContentType, [ContentType(id=1)])[0])),
+            copy.deepcopy(gather_deletion_side_effects(ContentType, [ContentType(id=1)])[0]),
+        ]:
+            self.assertIsInstance(copied, DeletionSideEffect)
+            self.assertEqual(copied, rendered)
+            self.assertEqual(copied.side_effects_class, ContentTypeIdDeletionSideEffects)
+            self.assertEqual(copied.msg, '1 ctypes deleted')
+
+    def test_queryset_side_effects_loaded_lazily(self):
+        ctype = G(ContentType)
+
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return ContentType.objects.filter(id=ctype.id), []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return 'ctypes deleted'
+
+        class EmptyDeletionSideEffects(MyDeletionSideEffects):
+            def get_side_effects(self, deleted_objs):
+                return ContentType.objects.none(), []
+
+        register_deletion_side_effects(MyDeletionSideEffects, EmptyDeletionSideEffects)
+
+        # Querysets are only checked for rows
+        with self.assertNumQueries(1):
+            side_effect, = gather_deletion_side_effects(ContentType, [ctype])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(side_effect['side_effect_objs'], [ctype])
+        with self.assertNumQueries(0):
+            self.assertEqual(side_effect['side_effect_objs'], [ctype])
+            self.assertEqual(side_effect['msg'], 'ctypes deleted')
+
     def test_cascaded_side_effects(self):
         ctype = G(ContentType)
         user = G(User)
@@ -119,50 +253,2104 @@ class TestGatherDeletionSideEffects(TransactionTestCase):
         self.assertEqual(side_effects[1]['msg'], '2 users deleted')
         self.assertEqual(set(side_effects[1]['side_effect_objs']), set(users))
 
+    def test_cascades_merged_by_class_per_level(self):
+        user = User(id=1)
+        group = Group(id=1)
+        permissions = [Permission(id=1), Permission(id=2)]
+        permission_batches = []
 
-class TestRegisterDeletionSideEffects(TransactionTestCase):
-    def setUp(self):
-        _DELETION_SIDE_EFFECTS.clear()
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
 
-    def test_register_deletion_side_effects_single(self):
-        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            def get_side_effects(self, deleted_objs):
+                return [], [user, group]
+
+        class UserDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = User
+
+            def get_side_effects(self, deleted_objs):
+                return [], [permissions[0]]
+
+        class GroupDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Group
+
+            def get_side_effects(self, deleted_objs):
+                return [], permissions
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+
+            def get_side_effects(self, deleted_objs):
+                permission_batches.append(list(deleted_objs))
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(
+            CTypeDeletionSideEffects, UserDeletionSideEffects, GroupDeletionSideEffects,
+            PermissionDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+
+        # Both paths to the permissions are merged into a single call with the combined batch
+        self.assertEqual(len(permission_batches), 1)
+        self.assertEqual(set(permission_batches[0]), set(permissions))
+        self.assertEqual(len(side_effects), 1)
+        self.assertEqual(side_effects[0]['msg'], '2 permissions deleted')
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(permissions))
+
+    def test_cascaded_objs_deduped_by_pk(self):
+        batches = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
             deleted_obj_class = ContentType
 
-        register_deletion_side_effects(MyDeletionSideEffects)
-        self.assertEqual(_DELETION_SIDE_EFFECTS, {
-            ContentType: set([MyDeletionSideEffects])
-        })
+            def get_side_effects(self, deleted_objs):
+                return [], [User(id=1), User(id=1), User(id=2)]
 
-    def test_register_deletion_side_effects_duplicates(self):
-        class MyDeletionSideEffects(BaseDeletionSideEffects):
+        class UserDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = User
+
+            def get_side_effects(self, deleted_objs):
+                batches.append(deleted_objs)
+                return [User(id=obj.id) for obj in deleted_objs], [User(id=2)]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} users deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects, UserDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertEqual(batches, [[User(id=1), User(id=2)]])
+        self.assertEqual(side_effects, [{
+            'msg': '2 users deleted',
+            'side_effect_objs': [User(id=1), User(id=2)],
+        }])
+
+    def test_prefetch_shared_across_handlers(self):
+        groups = [G(Group), G(Group)]
+        permission = G(Permission)
+        for group in groups:
+            group.permissions.add(permission)
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Group
+            prefetch = ['permissions']
+
+            def get_side_effects(self, deleted_objs):
+                return [p for group in deleted_objs for p in group.permissions.all()], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions'.format(len(side_effect_objs))
+
+        class PermissionCTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Group
+            prefetch = ['permissions__content_type', 'permissions']
+
+            def get_side_effects(self, deleted_objs):
+                return [p.content_type for group in deleted_objs for p in group.permissions.all()], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(PermissionDeletionSideEffects, PermissionCTypeDeletionSideEffects)
+
+        # One query for the permissions and one for their content types, no matter how many handlers use them
+        groups = list(Group.objects.filter(id__in=[group.id for group in groups]))
+        with self.assertNumQueries(2):
+            side_effects = gather_deletion_side_effects(Group, groups)
+
+        self.assertEqual(sorted(side_effect['msg'] for side_effect in side_effects), ['1 ctypes', '1 permissions'])
+
+    def test_cascade_cycle_terminates(self):
+        ctypes = [ContentType(id=1), ContentType(id=2)]
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
             deleted_obj_class = ContentType
 
-        register_deletion_side_effects(MyDeletionSideEffects)
-        register_deletion_side_effects(MyDeletionSideEffects)
-        self.assertEqual(_DELETION_SIDE_EFFECTS, {
-            ContentType: set([MyDeletionSideEffects])
-        })
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, ctypes
 
-    def test_register_deletion_side_effects_multiple(self):
-        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, ctypes[:1])
+        self.assertEqual(side_effects[0]['msg'], '2 ctypes deleted')
+
+    def test_deep_cascade_exceeding_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 2
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
             deleted_obj_class = ContentType
 
-        class MyOtherDeletionSideEffects(BaseDeletionSideEffects):
+            def get_side_effects(self, deleted_objs):
+                next_id = deleted_objs[0].id + 1
+                return deleted_objs, [ContentType(id=next_id)] if next_id <= depth else []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertEqual(side_effects[0]['msg'], '{0} ctypes deleted'.format(depth))
+
+    def test_queryset_handlers_chain_lazily(self):
+        ctype = G(ContentType)
+        permissions = [G(Permission, content_type=ctype), G(Permission, content_type=ctype)]
+        group = G(Group)
+        group.permissions.add(*permissions)
+        received = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
             deleted_obj_class = ContentType
+            uses_querysets = True
 
-        register_deletion_side_effects(MyDeletionSideEffects)
-        register_deletion_side_effects(MyOtherDeletionSideEffects)
-        self.assertEqual(_DELETION_SIDE_EFFECTS, {
-            ContentType: set([MyDeletionSideEffects, MyOtherDeletionSideEffects])
-        })
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return None, Permission.objects.filter(content_type__in=deleted_objs)
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return deleted_objs, [
+                    Group.objects.filter(permissions__in=deleted_objs),
+                    User.objects.filter(user_permissions__in=deleted_objs),
+                ]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        class GroupDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Group
+
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return deleted_objs, None
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} groups deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(
+            CTypeDeletionSideEffects, PermissionDeletionSideEffects, GroupDeletionSideEffects)
+
+        # Only the existence checks of each level, the list based group handler and the final rendering of the
+        # permission side effects evaluate querysets
+        with self.assertNumQueries(4):
+            side_effects = gather_deletion_side_effects(ContentType, ContentType.objects.filter(id=ctype.id))
+        side_effects = sorted(side_effects, key=lambda k: k['msg'])
+
+        self.assertIsInstance(received[0], QuerySet)
+        self.assertIsInstance(received[1], QuerySet)
+        self.assertEqual(received[2], [group])
+        self.assertEqual(side_effects, [{
+            'msg': '1 groups deleted',
+            'side_effect_objs': [group],
+        }, {
+            'msg': '2 permissions deleted',
+            'side_effect_objs': side_effects[1]['side_effect_objs'],
+        }])
+        self.assertEqual(set(side_effects[1]['side_effect_objs']), set(permissions))
+
+    def test_queryset_shared_by_handlers(self):
+        ctype = G(ContentType)
+        received = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return None, []
+
+        class OtherCTypeDeletionSideEffects(CTypeDeletionSideEffects):
+            pass
+
+        register_deletion_side_effects(CTypeDeletionSideEffects, OtherCTypeDeletionSideEffects)
+
+        gather_deletion_side_effects(ContentType, ContentType.objects.filter(id=ctype.id))
+        self.assertEqual(len(received), 2)
+        self.assertIs(received[0], received[1])
+
+    def test_queryset_handler_cycle_terminates(self):
+        ctypes = [G(ContentType), G(ContentType)]
+        calls = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(deleted_objs)
+                return deleted_objs, ContentType.objects.filter(id__in=[ctype.id for ctype in ctypes])
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, ctypes[:1])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(side_effects[0]['msg'], '2 ctypes deleted')
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(ctypes))
+
+    def test_deep_queryset_handler_chain(self):
+        ctypes = [G(ContentType) for _ in range(MAX_LAZY_LEVELS * 4)]
+        calls = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                # Every ctype cascades to the one with the next id and back to the first one
+                calls.append(deleted_objs)
+                next_ids = deleted_objs.annotate(next_id=F('id') + 1).values('next_id')
+                return deleted_objs, ContentType.objects.filter(Q(id__in=next_ids) | Q(id=ctypes[0].id))
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        # The subqueries of the levels would nest too deep for the database if they were chained all the way down
+        side_effects = gather_deletion_side_effects(ContentType, ContentType.objects.filter(id=ctypes[0].id))
+        self.assertEqual(len(calls), len(ctypes))
+        self.assertEqual(side_effects[0]['msg'], '{0} ctypes deleted'.format(len(ctypes)))
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(ctypes))
+
+        side_effects = gather_deletion_side_effects(ContentType, [ctypes[0]], max_objects=len(ctypes) - 1)
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(ctypes[:-1]))
+
+        gatherer = _DeletionSideEffectsGatherer()
+        gatherer.gather(ContentType, [ctypes[0]])
+        self.assertEqual(gatherer.get_deleted_pks(), {ContentType: {ctype.id for ctype in ctypes}})
+
+    def test_deep_queryset_handler_chain_binds_bounded_params(self):
+        ctypes = [G(ContentType) for _ in range(40)]
+        params = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                next_ids = deleted_objs.annotate(next_id=F('id') + 1).values('next_id')
+                # The first ctype is also returned as an object, so it is left out when the querysets are read
+                return [ctypes[0], deleted_objs], ContentType.objects.filter(id__in=next_ids, id__lte=ctypes[-1].id)
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        def record_params(execute, sql, sql_params, many, context):
+            params.append(len(sql_params or ()))
+            return execute(sql, sql_params, many, context)
+
+        # Neither the excluded pks nor the side effect querysets of the levels grow with the depth of the cascade
+        with patch('deletion_side_effects.deletion_side_effects.MAX_EXCLUDED_PKS', 5):
+            with connection.execute_wrapper(record_params):
+                side_effects = gather_deletion_side_effects(ContentType, ContentType.objects.filter(id=ctypes[0].id))
+        self.assertEqual(side_effects[0]['msg'], '{0} ctypes deleted'.format(len(ctypes)))
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(ctypes))
+        self.assertLess(max(params), len(ctypes))
+
+    def test_list_and_queryset_handlers_for_the_same_class(self):
+        ctype = G(ContentType)
+        received = []
+
+        class ListDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return 'list {0}'.format(len(side_effect_objs))
+
+        class QuerySetDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                received.append(deleted_objs)
+                return [deleted_objs], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return 'queryset {0}'.format(len(side_effect_objs))
+
+        class OtherQuerySetDeletionSideEffects(QuerySetDeletionSideEffects):
+            def get_side_effect_message(self, side_effect_objs):
+                return 'other queryset {0}'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(
+            ListDeletionSideEffects, QuerySetDeletionSideEffects, OtherQuerySetDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(ContentType, ContentType.objects.filter(id=ctype.id))
+        side_effects = sorted(side_effects, key=lambda k: k['msg'])
+
+        self.assertEqual(side_effects, [{
+            'msg': 'list 1',
+            'side_effect_objs': [ctype],
+        }, {
+            'msg': 'other queryset 1',
+            'side_effect_objs': [ctype],
+        }, {
+            'msg': 'queryset 1',
+            'side_effect_objs': [ctype],
+        }])
+        self.assertEqual(set(type(objs) for objs in received), set([list, QuerySet]))
+
+
+class InlineExecutor(object):
+    """
+    An executor that runs submitted functions in the calling thread
+    """
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+class TestGatherDeletionSideEffectsWithExecutor(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_handlers_of_a_level_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
 
-    def test_register_deletion_invalid_side_effects_no_obj_class(self):
         class MyDeletionSideEffects(BaseDeletionSideEffects):
-            deleted_obj_class = None
+            deleted_obj_class = ContentType
 
-        with self.assertRaises(ValueError):
-            register_deletion_side_effects(MyDeletionSideEffects)
+            def get_side_effects(self, deleted_objs):
+                # Only returns if both handlers run at the same time
+                barrier.wait()
+                return deleted_objs, []
 
-    def test_register_deletion_invalid_side_effects_wrong_inheritance(self):
-        with self.assertRaises(ValueError):
-            register_deletion_side_effects(object)
+            def get_side_effect_message(self, side_effect_objs):
+                return self.__class__.__name__
+
+        class MyOtherDeletionSideEffects(MyDeletionSideEffects):
+            pass
+
+        register_deletion_side_effects(MyDeletionSideEffects, MyOtherDeletionSideEffects)
+
+        with ThreadPoolExecutor(2) as executor:
+            side_effects = gather_deletion_side_effects(ContentType, [ContentType(id=1)], executor=executor)
+
+        self.assertEqual(sorted(side_effect['msg'] for side_effect in side_effects), [
+            'MyDeletionSideEffects', 'MyOtherDeletionSideEffects'
+        ])
+
+    def test_matches_serial_gather(self):
+        ctypes = [G(ContentType), G(ContentType)]
+        for ctype in ctypes:
+            G(Permission, content_type=ctype)
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                permissions = list(Permission.objects.filter(content_type__in=deleted_objs))
+                return permissions, permissions
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        class PermissionCTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+
+            def get_side_effects(self, deleted_objs):
+                return [], ContentType.objects.filter(permission__in=deleted_objs)
+
+        register_deletion_side_effects(
+            PermissionDeletionSideEffects, CTypeDeletionSideEffects, PermissionCTypeDeletionSideEffects)
+
+        serial_side_effects = gather_deletion_side_effects(ContentType, ctypes[:1])
+        with ThreadPoolExecutor(4) as executor:
+            side_effects = gather_deletion_side_effects(ContentType, ctypes[:1], executor=executor)
+
+        self.assertEqual(side_effects, serial_side_effects)
+        self.assertEqual(sorted(side_effect['msg'] for side_effect in side_effects), [
+            '1 ctypes deleted', '1 permissions deleted'
+        ])
+
+    @patch('deletion_side_effects.deletion_side_effects.connections')
+    def test_closes_connections_of_worker_threads(self, mock_connections):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return [], []
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+
+        with ThreadPoolExecutor(1) as executor:
+            gather_deletion_side_effects(ContentType, [ContentType(id=1)], executor=executor)
+        self.assertEqual(mock_connections.close_all.call_count, 1)
+
+        # Connections of the calling thread are left open
+        gather_deletion_side_effects(ContentType, [ContentType(id=1)], executor=InlineExecutor())
+        self.assertEqual(mock_connections.close_all.call_count, 1)
+
+
+class TestAGatherDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    async def test_async_handlers_of_a_level_are_awaited_concurrently(self):
+        started = [asyncio.Event(), asyncio.Event()]
+
+        class MyDeletionSideEffects(BaseAsyncDeletionSideEffects):
+            deleted_obj_class = ContentType
+            index = 0
+
+            async def get_side_effects(self, deleted_objs):
+                # Only returns if the other handler runs at the same time
+                started[self.index].set()
+                await asyncio.wait_for(started[1 - self.index].wait(), 5)
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return self.__class__.__name__
+
+        class MyOtherDeletionSideEffects(MyDeletionSideEffects):
+            index = 1
+
+        register_deletion_side_effects(MyDeletionSideEffects, MyOtherDeletionSideEffects)
+
+        side_effects = await agather_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertEqual(sorted(side_effect['msg'] for side_effect in side_effects), [
+            'MyDeletionSideEffects', 'MyOtherDeletionSideEffects'
+        ])
+
+    def test_async_and_sync_handlers_match_sync_gather(self):
+        ctype = G(ContentType)
+        permissions = [G(Permission, content_type=ctype), G(Permission, content_type=ctype)]
+        group = G(Group)
+        group.permissions.add(*permissions)
+
+        class PermissionDeletionSideEffects(BaseAsyncDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            async def get_side_effects(self, deleted_objs):
+                permissions = await sync_to_async(list)(Permission.objects.filter(content_type__in=deleted_objs))
+                return permissions, permissions
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        class GroupDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+
+            def get_side_effects(self, deleted_objs):
+                groups = Group.objects.filter(permissions__in=deleted_objs).distinct()
+                return groups, groups
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} groups deleted'.format(len(side_effect_objs))
+
+        class GroupCTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Group
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                return None, ContentType.objects.filter(permission__group__in=deleted_objs)
+
+        register_deletion_side_effects(
+            PermissionDeletionSideEffects, GroupDeletionSideEffects, GroupCTypeDeletionSideEffects)
+
+        side_effects = async_to_sync(agather_deletion_side_effects)(ContentType, [ctype], max_sync_workers=1)
+        side_effects = sorted(side_effects, key=lambda k: k['msg'])
+
+        sync_side_effects = gather_deletion_side_effects(ContentType, [ctype])
+        self.assertEqual(side_effects, sorted(sync_side_effects, key=lambda k: k['msg']))
+        self.assertEqual(side_effects, [{
+            'msg': '1 groups deleted',
+            'side_effect_objs': [group],
+        }, {
+            'msg': '2 permissions deleted',
+            'side_effect_objs': side_effects[1]['side_effect_objs'],
+        }])
+        self.assertEqual(set(side_effects[1]['side_effect_objs']), set(permissions))
+
+
+class TestGatherDeletionSideEffectsWithCache(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        caches['default'].clear()
+        self.calls = []
+        calls = self.calls
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+            depends_on = [Permission]
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(deleted_objs)
+                permissions = Permission.objects.filter(content_type__in=deleted_objs)
+                return permissions, [permissions]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions'.format(len(side_effect_objs))
+
+        self.handler = PermissionDeletionSideEffects
+        self.ctype = G(ContentType)
+        self.permission = G(Permission, content_type=self.ctype)
+
+    def test_cached_across_gathers(self):
+        register_deletion_side_effects(self.handler)
+
+        for i in range(2):
+            side_effects = gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+            self.assertEqual(side_effects, [{
+                'msg': '1 permissions',
+                'side_effect_objs': [self.permission],
+            }])
+
+        self.assertEqual(len(self.calls), 1)
+
+    def test_cached_per_database(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        side_effects = gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True, using='replica')
+        self.assertEqual(side_effects[0]['side_effect_objs'], [self.permission])
+        self.assertEqual(len(self.calls), 2)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True, using='replica')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_not_cached_without_use_cache(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [self.ctype])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_not_cached_without_dependencies(self):
+        self.handler.depends_on = None
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidated_by_dependency(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        other_permission = G(Permission, content_type=self.ctype)
+        side_effects = gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set([self.permission, other_permission]))
+
+        other_permission.delete()
+        side_effects = gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(side_effects[0]['side_effect_objs'], [self.permission])
+
+    def test_invalidated_by_deleted_obj_class(self):
+        self.handler.depends_on = ['auth.Permission']
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.ctype.save()
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_unrelated_model_does_not_invalidate(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        G(User)
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_keyed_on_deleted_objs(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [G(ContentType)], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_keyed_on_class(self):
+        class ParentSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+            depends_on = []
+
+            def get_side_effects(self, deleted_objs):
+                return [deleted_obj.__class__ for deleted_obj in deleted_objs], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return ', '.join(obj_class.__name__ for obj_class in side_effect_objs)
+
+        register_deletion_side_effects(ParentSideEffects)
+
+        # The parent row of the special parent shares its pk
+        special_parent = G(SpecialParent)
+        parent = Parent.objects.get(id=special_parent.id)
+        self.assertEqual(gather_deletion_side_effects(Parent, [parent], use_cache=True)[0]['msg'], 'Parent')
+        self.assertEqual(
+            gather_deletion_side_effects(SpecialParent, [special_parent], use_cache=True)[0]['msg'], 'SpecialParent')
+
+    def test_invalidated_by_subclass(self):
+        calls = self.calls
+
+        class UserSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = AbstractBaseUser
+            depends_on = [Parent]
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(deleted_objs)
+                return deleted_objs, []
+
+        register_deletion_side_effects(UserSideEffects)
+        user = G(User)
+
+        # Saves of the concrete model of the abstract class, and of the children and proxies of the dependencies,
+        # invalidate the cached results
+        for save in [user.save, G(SpecialParent).save, lambda: ProxyParent.objects.create()]:
+            gather_deletion_side_effects(User, [user], use_cache=True)
+            gather_deletion_side_effects(User, [user], use_cache=True)
+            save()
+
+        self.assertEqual(len(self.calls), 3)
+
+    @override_settings(DELETION_SIDE_EFFECTS_CACHE={'MAX_OBJECTS': 2})
+    def test_max_objects(self):
+        register_deletion_side_effects(self.handler)
+
+        # The deleted content type, the side effect permission and the cascaded permission exceed the limit
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+    @override_settings(DELETION_SIDE_EFFECTS_CACHE={'MAX_OBJECTS': 0})
+    def test_deleted_objs_over_max_objects(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+    @override_settings(DELETION_SIDE_EFFECTS_CACHE={'TIMEOUT': 0})
+    def test_timeout(self):
+        register_deletion_side_effects(self.handler)
+
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        gather_deletion_side_effects(ContentType, [self.ctype], use_cache=True)
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestProfileDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+        self.ctypes = [G(ContentType), G(ContentType)]
+        self.permissions = [G(Permission, content_type=self.ctypes[0]), G(Permission, content_type=self.ctypes[1])]
+        G(Group).permissions.add(self.permissions[0])
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                permissions = list(Permission.objects.filter(content_type__in=deleted_objs))
+                return permissions, permissions
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        class GroupDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                return Group.objects.filter(permissions__in=deleted_objs), []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} groups affected'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(PermissionDeletionSideEffects, GroupDeletionSideEffects)
+        self.handlers = (PermissionDeletionSideEffects, GroupDeletionSideEffects)
+
+    def test_not_profiled_by_default(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes)
+        self.assertIsNone(side_effects.profile)
+
+    def test_profile_cascade_tree(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, profile=True)
+        self.assertEqual([side_effect['msg'] for side_effect in side_effects], [
+            '2 permissions deleted', '1 groups affected'
+        ])
+
+        profile = side_effects.profile
+        self.assertEqual(repr(profile), '<GatherProfile calls=2 duration={0} queries=2>'.format(profile.duration))
+        self.assertEqual([call.side_effects_class for call in profile.calls], list(self.handlers))
+
+        root, = profile.roots
+        self.assertEqual(root.side_effects_class, self.handlers[0])
+        self.assertEqual(root.deleted_obj_class, ContentType)
+        self.assertEqual(
+            (root.level, root.num_queries, root.num_deleted_objs, root.num_side_effect_objs),
+            (0, 1, 2, 2))
+        self.assertEqual((root.num_cascade_deleted_objs, root.cascade_classes), (2, {Permission}))
+        self.assertGreaterEqual(root.duration, 0)
+        self.assertEqual(repr(root), '<HandlerCallProfile {0} level=0 duration={1:.6f} queries=1>'.format(
+            self.handlers[0].__name__, root.duration))
+
+        # The queryset handler is passed a lazy batch and returns a lazy result
+        child, = root.children
+        self.assertEqual(child.side_effects_class, self.handlers[1])
+        self.assertEqual(
+            (child.level, child.num_queries, child.num_deleted_objs, child.num_side_effect_objs),
+            (1, 0, None, None))
+        self.assertEqual(child.children, [])
+
+        # The queries of the engine, such as the one rendering the groups, are included in the total
+        self.assertEqual(profile.num_queries, 2)
+        self.assertGreaterEqual(profile.duration, root.duration)
+        self.assertEqual(profile.format().splitlines(), [
+            '{0} level=0 duration={1:.6f}s queries=1 deleted=2 side_effects=2 cascades=2'.format(
+                self.handlers[0].__name__, root.duration),
+            '  {0} level=1 duration={1:.6f}s queries=0 deleted=None side_effects=None cascades=0'.format(
+                self.handlers[1].__name__, child.duration),
+        ])
+
+    def test_profile_links_calls_of_handlers_of_base_classes(self):
+        class ChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                return None, list(SpecialParent.objects.filter(id__in=[obj.parent_id for obj in deleted_objs]))
+
+        class ParentDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, []
+
+        register_deletion_side_effects(ChildDeletionSideEffects, ParentDeletionSideEffects)
+        child = G(Child, parent=G(SpecialParent))
+
+        # The handler of the parents is called for the cascaded special parent
+        profile = gather_deletion_side_effects(Child, [Child.objects.get(id=child.id)], profile=True).profile
+        root, = profile.roots
+        self.assertEqual(root.batch_class, Child)
+        self.assertEqual(root.cascade_classes, {SpecialParent})
+
+        call, = root.children
+        self.assertEqual(call.side_effects_class, ParentDeletionSideEffects)
+        self.assertEqual((call.deleted_obj_class, call.batch_class), (Parent, SpecialParent))
+
+    def test_profile_with_executor(self):
+        with ThreadPoolExecutor(2) as executor:
+            side_effects = gather_deletion_side_effects(ContentType, self.ctypes, executor=executor, profile=True)
+
+        # Queries of handlers that ran on worker threads are added to the total
+        self.assertEqual([call.num_queries for call in side_effects.profile.calls], [1, 0])
+        self.assertEqual(side_effects.profile.num_queries, 2)
+
+    def test_agather_profile(self):
+        class AsyncDeletionSideEffects(BaseAsyncDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            async def get_side_effects(self, deleted_objs):
+                return [], []
+
+        register_deletion_side_effects(AsyncDeletionSideEffects)
+
+        side_effects = async_to_sync(agather_deletion_side_effects)(ContentType, self.ctypes, profile=True)
+
+        calls = {call.side_effects_class: call for call in side_effects.profile.calls}
+        self.assertEqual(set(calls), set(self.handlers) | {AsyncDeletionSideEffects})
+        self.assertEqual(calls[self.handlers[0]].num_queries, 1)
+        self.assertIsNone(calls[AsyncDeletionSideEffects].num_queries)
+        self.assertIsNone(side_effects.profile.num_queries)
+        self.assertGreaterEqual(side_effects.profile.duration, 0)
+
+    def test_handler_called_signal(self):
+        receiver = Mock()
+        handler_called.connect(receiver)
+        try:
+            side_effects = gather_deletion_side_effects(ContentType, self.ctypes)
+        finally:
+            handler_called.disconnect(receiver)
+
+        # Handler calls are measured for the receivers even though the gather is not profiled
+        self.assertIsNone(side_effects.profile)
+        self.assertEqual([c[1]['sender'] for c in receiver.call_args_list], list(self.handlers))
+        self.assertEqual(receiver.call_args_list[0][1]['call'].num_side_effect_objs, 2)
+
+    def test_assert_gather_query_budget(self):
+        side_effects = assert_gather_query_budget(ContentType, self.ctypes, 2)
+        self.assertEqual(side_effects.profile.num_queries, 2)
+
+        with self.assertRaisesRegex(AssertionError, 'ran 2 queries, the budget is 1\n.*PermissionDeletionSideEffects'):
+            assert_gather_query_budget(ContentType, self.ctypes, 1)
+
+
+class TestGatherDeletionSideEffectsLimits(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+        self.ctypes = [G(ContentType), G(ContentType), G(ContentType)]
+        self.permissions = [G(Permission, content_type=ctype) for ctype in self.ctypes]
+        self.received = []
+
+        test = self
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                test.received.append(list(deleted_objs))
+                permissions = Permission.objects.filter(content_type__in=deleted_objs).order_by('id')
+                return permissions, permissions
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+        class PermissionCascadeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                test.received.append(deleted_objs)
+                return [], []
+
+        register_deletion_side_effects(PermissionDeletionSideEffects, PermissionCascadeDeletionSideEffects)
+        self.handlers = (PermissionDeletionSideEffects, PermissionCascadeDeletionSideEffects)
+
+    def test_not_truncated_without_limits(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes)
+
+        self.assertFalse(side_effects.truncated)
+        self.assertEqual(side_effects.truncated_by, set())
+        self.assertEqual(side_effects[0]['side_effect_objs'], self.permissions)
+
+    def test_max_objects_limits_lazy_batch(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, max_objects=5)
+
+        self.assertTrue(side_effects.truncated)
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertEqual(self.received[0], self.ctypes)
+        self.assertEqual(set(self.received[1]), set(self.permissions[:2]))
+
+    def test_max_objects_limits_objs(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, max_objects=2)
+
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertEqual(self.received, [self.ctypes[:2]])
+        self.assertEqual(side_effects[0]['side_effect_objs'], self.permissions[:2])
+
+    def test_max_objects_not_reached(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, max_objects=6)
+
+        self.assertFalse(side_effects.truncated)
+        self.assertEqual(set(self.received[1]), set(self.permissions))
+
+    def test_max_side_effect_objs_per_handler(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, max_side_effect_objs_per_handler=2)
+
+        self.assertEqual(side_effects.truncated_by, {'max_side_effect_objs_per_handler'})
+        self.assertEqual(side_effects, [{
+            'msg': '2 permissions deleted',
+            'side_effect_objs': self.permissions[:2],
+        }])
+
+        # The walk itself is not limited
+        self.assertEqual(set(self.received[1]), set(self.permissions))
+
+    def test_max_side_effect_objs_per_handler_limits_objs(self):
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} ctypes deleted'.format(len(side_effect_objs))
+
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        side_effects = gather_deletion_side_effects(
+            ContentType, self.ctypes + self.ctypes, max_side_effect_objs_per_handler=3)
+        self.assertFalse(side_effects.truncated)
+
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, max_side_effect_objs_per_handler=1)
+        self.assertEqual(side_effects.truncated_by, {'max_side_effect_objs_per_handler'})
+        self.assertEqual(side_effects[0]['side_effect_objs'], self.ctypes[:1])
+
+    def test_limits_mixed_objs_and_querysets(self):
+        permissions = self.permissions
+
+        class MixedDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return [permissions[0], Permission.objects.order_by('id')], [permissions[0]]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return 'mixed'
+
+        register_deletion_side_effects(MixedDeletionSideEffects)
+
+        context = DeletionSideEffectsContext()
+        side_effects = gather_deletion_side_effects(
+            ContentType, self.ctypes, context=context, max_objects=5, max_side_effect_objs_per_handler=2)
+
+        self.assertTrue(context.budget.truncated)
+        self.assertEqual(side_effects.truncated_by, {'max_objects', 'max_side_effect_objs_per_handler'})
+        self.assertEqual(
+            [side_effect['side_effect_objs'] for side_effect in side_effects if side_effect['msg'] == 'mixed'],
+            [permissions[:2]])
+
+        # The cascaded permission is kept and one more is read from the queryset
+        self.assertEqual(len(self.received[1]), 2)
+        self.assertIn(permissions[0], self.received[1])
+
+    def test_deadline_passed(self):
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, deadline=0)
+
+        self.assertEqual(side_effects.truncated_by, {'deadline'})
+        self.assertEqual(side_effects, [])
+        self.assertEqual(self.received, [])
+
+    def test_deadline_stops_walk(self):
+        permissions = self.permissions
+
+        class SlowDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                time.sleep(0.2)
+                return [], permissions
+
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(SlowDeletionSideEffects, self.handlers[1])
+
+        side_effects = gather_deletion_side_effects(ContentType, self.ctypes, deadline=0.1)
+
+        # The cascaded permissions are not walked
+        self.assertEqual(side_effects.truncated_by, {'deadline'})
+        self.assertEqual(self.received, [])
+
+    def test_agather_limits(self):
+        side_effects = async_to_sync(agather_deletion_side_effects)(ContentType, self.ctypes, max_objects=5)
+
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertEqual(set(self.received[1]), set(self.permissions[:2]))
+
+    def test_budget_available_to_handlers(self):
+        budgets = []
+
+        class BudgetDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                budget = self.context.budget
+                budgets.append(
+                    (budget.remaining_objects, budget.remaining_time, budget.max_side_effect_objs_per_handler))
+                return [], []
+
+        register_deletion_side_effects(BudgetDeletionSideEffects)
+
+        gather_deletion_side_effects(ContentType, self.ctypes)
+        gather_deletion_side_effects(
+            ContentType, self.ctypes, deadline=60, max_objects=10, max_side_effect_objs_per_handler=5)
+
+        self.assertEqual(budgets[0], (None, None, None))
+        self.assertEqual(budgets[1][0], 7)
+        self.assertTrue(0 < budgets[1][1] <= 60)
+        self.assertEqual(budgets[1][2], 5)
+
+
+class TestGatherDeletionSideEffectsBulk(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        self.calls = []
+        calls = self.calls
+
+        class ParentDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+
+            def get_side_effects(self, deleted_objs):
+                calls.append((Parent, deleted_objs))
+                return None, list(Child.objects.filter(Q(parent__in=deleted_objs) | Q(other_parent__in=deleted_objs)))
+
+        class ChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                calls.append((Child, deleted_objs))
+                return deleted_objs, GrandChild.objects.filter(child__in=deleted_objs)
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} children deleted'.format(len(side_effect_objs))
+
+        class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = GrandChild
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                calls.append((GrandChild, deleted_objs))
+                return deleted_objs, None
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} grand children deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(
+            ParentDeletionSideEffects, ChildDeletionSideEffects, GrandChildDeletionSideEffects)
+
+        self.parents = [G(Parent), G(Parent), G(Parent)]
+
+        # The second child is shared by the first two parents
+        self.children = [
+            G(Child, parent=self.parents[0], other_parent=None),
+            G(Child, parent=self.parents[0], other_parent=self.parents[1]),
+            G(Child, parent=self.parents[1], other_parent=None),
+        ]
+        self.grand_children = [G(GrandChild, child=self.children[1]), G(GrandChild, child=self.children[2])]
+
+    def get_side_effects(self, result):
+        return {side_effect['msg']: set(side_effect['side_effect_objs']) for side_effect in result}
+
+    def test_matches_gather_per_root(self):
+        results = gather_deletion_side_effects_bulk(Parent, self.parents)
+        self.assertEqual(len(results), 3)
+        for parent, result in zip(self.parents, results):
+            self.assertEqual(
+                self.get_side_effects(result), self.get_side_effects(gather_deletion_side_effects(Parent, [parent])))
+
+        self.assertEqual(self.get_side_effects(results[0]), {
+            '2 children deleted': {self.children[0], self.children[1]},
+            '1 grand children deleted': {self.grand_children[0]},
+        })
+        self.assertEqual(self.get_side_effects(results[1]), {
+            '2 children deleted': {self.children[1], self.children[2]},
+            '2 grand children deleted': set(self.grand_children),
+        })
+        self.assertEqual(results[2], [])
+
+    def test_handlers_called_per_group_of_roots(self):
+        gather_deletion_side_effects_bulk(Parent, self.parents)
+
+        # Handlers are called once for the objects of every group of roots
+        self.assertEqual(self.calls[:3], [(Parent, [parent]) for parent in self.parents])
+        child_calls = sorted(
+            [sorted(child.id for child in deleted_objs) for cls, deleted_objs in self.calls if cls is Child])
+        self.assertEqual(child_calls, sorted([
+            [self.children[0].id], [self.children[1].id], [self.children[2].id]]))
+
+        # Queryset based handlers are passed querysets
+        grand_child_calls = [deleted_objs for cls, deleted_objs in self.calls if cls is GrandChild]
+        self.assertEqual(len(grand_child_calls), 2)
+        self.assertTrue(all(isinstance(deleted_objs, QuerySet) for deleted_objs in grand_child_calls))
+
+    def test_get_side_effects_by_obj(self):
+        calls = self.calls
+
+        class ByObjChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects_by_obj(self, deleted_objs):
+                calls.append(('by_obj', deleted_objs))
+                return {deleted_obj: ([deleted_obj], []) for deleted_obj in deleted_objs}
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} children by obj'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(ByObjChildDeletionSideEffects)
+
+        results = gather_deletion_side_effects_bulk(Parent, self.parents)
+
+        # The handler is called once for the children of every root
+        by_obj_calls = [deleted_objs for cls, deleted_objs in self.calls if cls == 'by_obj']
+        self.assertEqual(len(by_obj_calls), 1)
+        self.assertEqual(set(by_obj_calls[0]), set(self.children))
+        self.assertEqual(self.get_side_effects(results[0])['2 children by obj'], {self.children[0], self.children[1]})
+        self.assertEqual(self.get_side_effects(results[1])['2 children by obj'], {self.children[1], self.children[2]})
+
+    def test_cycle_terminates(self):
+        shared_parent = self.parents[2]
+
+        class CycleDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                return [shared_parent], [deleted_obj.parent for deleted_obj in deleted_objs]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} shared parents'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(CycleDeletionSideEffects)
+
+        # Parents reached again from their own children are not walked again. The first parent is reached from
+        # the second one, so it is walked again for the second root only
+        results = gather_deletion_side_effects_bulk(Parent, self.parents[:2])
+        self.assertEqual(self.get_side_effects(results[0])['1 shared parents'], {shared_parent})
+        self.assertEqual(self.get_side_effects(results[1])['1 shared parents'], {shared_parent})
+        self.assertEqual(self.get_side_effects(results[1])['3 children deleted'], set(self.children))
+        for parent, result in zip(self.parents, results):
+            self.assertEqual(
+                self.get_side_effects(result), self.get_side_effects(gather_deletion_side_effects(Parent, [parent])))
+
+    def test_shared_roots(self):
+        # A root that is passed twice gets the same side effects twice
+        results = gather_deletion_side_effects_bulk(Parent, [self.parents[1], self.parents[1]])
+        self.assertEqual(self.get_side_effects(results[0]), self.get_side_effects(results[1]))
+
+    def test_profiled_with_handler_called_signal(self):
+        receiver = Mock()
+        handler_called.connect(receiver)
+        self.addCleanup(handler_called.disconnect, receiver)
+
+        gather_deletion_side_effects_bulk(Parent, self.parents)
+        self.assertEqual(receiver.call_count, len(self.calls))
+
+    def test_no_roots(self):
+        self.assertEqual(gather_deletion_side_effects_bulk(Parent, []), [])
+
+
+class TestSummarizeDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_no_side_effects(self):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return [], []
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+
+        self.assertEqual(summarize_deletion_side_effects(ContentType, [ContentType(id=1)]), [])
+
+    def test_count_hook_does_not_load_objects(self):
+        ctype = G(ContentType)
+        G(Permission, content_type=ctype)
+        G(Permission, content_type=ctype)
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return Permission.objects.filter(content_type__in=deleted_objs), []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} permissions deleted'.format(len(side_effect_objs))
+
+            def get_side_effect_count(self, side_effect_objs):
+                return side_effect_objs.count()
+
+        register_deletion_side_effects(PermissionDeletionSideEffects)
+
+        # The only query is the count of the side effect objects
+        with self.assertNumQueries(1):
+            summary = summarize_deletion_side_effects(ContentType, [ctype])
+
+        self.assertEqual(summary, [{
+            'msg': '2 permissions deleted',
+            'count': 2,
+        }])
+
+    def test_count_hook_objects_are_loaded_on_access(self):
+        ctype = G(ContentType)
+        permission = G(Permission, content_type=ctype)
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return Permission.objects.filter(content_type__in=deleted_objs), []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} {1}'.format(side_effect_objs[0].codename, [p.id for p in side_effect_objs])
+
+            def get_side_effect_count(self, side_effect_objs):
+                return side_effect_objs.count()
+
+        register_deletion_side_effects(PermissionDeletionSideEffects)
+
+        summary = summarize_deletion_side_effects(ContentType, [ctype])
+        self.assertEqual(summary, [{
+            'msg': '{0} [{1}]'.format(permission.codename, permission.id),
+            'count': 1,
+        }])
+
+    def test_fall_back_without_count_hook(self):
+        side_effect_objs = [Mock(value='hi'), Mock(value='there')]
+
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return side_effect_objs + [Permission.objects.none()], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} objs deleted'.format(len(side_effect_objs))
+
+            # Only called for queryset side effects
+            get_side_effect_count = Mock()
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+
+        self.assertEqual(summarize_deletion_side_effects(ContentType, [ContentType(id=1)]), [{
+            'msg': '2 objs deleted',
+            'count': 2,
+        }])
+        self.assertFalse(MyDeletionSideEffects.get_side_effect_count.called)
+
+    def test_fall_back_for_querysets_of_several_models(self):
+        ctype = G(ContentType)
+        permission = G(Permission, content_type=ctype)
+
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return [ContentType.objects.filter(id=ctype.id), Permission.objects.filter(id=permission.id)], []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} objs deleted'.format(len(side_effect_objs))
+
+            # Only called for the querysets of a single model
+            get_side_effect_count = Mock()
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+
+        self.assertEqual(summarize_deletion_side_effects(ContentType, [ctype]), [{
+            'msg': '2 objs deleted',
+            'count': 2,
+        }])
+        self.assertFalse(MyDeletionSideEffects.get_side_effect_count.called)
+
+
+class TestIterDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_yields_new_side_effects_per_level(self):
+        ctypes = [ContentType(id=1), ContentType(id=2)]
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return ctypes[:deleted_objs[0].id], ctypes[1:]
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        records = list(iter_deletion_side_effects(ContentType, ctypes[:1]))
+        self.assertEqual(records, [
+            DeletionSideEffectsRecord(CTypeDeletionSideEffects, [ctypes[0]], 0),
+            DeletionSideEffectsRecord(CTypeDeletionSideEffects, [ctypes[1]], 1),
+        ])
+
+    def test_skips_levels_without_new_side_effects(self):
+        ctypes = [ContentType(id=1), ContentType(id=2)]
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                return ctypes[:1], ctypes[1:]
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        records = list(iter_deletion_side_effects(ContentType, ctypes[:1]))
+        self.assertEqual(records, [DeletionSideEffectsRecord(CTypeDeletionSideEffects, [ctypes[0]], 0)])
+
+    def test_yields_while_walking(self):
+        calls = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(ContentType)
+                return deleted_objs, [User(id=1)]
+
+        class UserDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = User
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(User)
+                return deleted_objs, []
+
+        register_deletion_side_effects(CTypeDeletionSideEffects, UserDeletionSideEffects)
+
+        records = iter_deletion_side_effects(ContentType, [ContentType(id=1)])
+        self.assertEqual(next(records).level, 0)
+        self.assertEqual(calls, [ContentType])
+        self.assertEqual(next(records).level, 1)
+        self.assertEqual(calls, [ContentType, User])
+
+    def test_chunk_size(self):
+        ctypes = [ContentType(id=i) for i in range(1, 6)]
+        batches = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                batches.append(deleted_objs)
+                return deleted_objs, []
+
+        register_deletion_side_effects(CTypeDeletionSideEffects)
+
+        records = list(iter_deletion_side_effects(ContentType, ctypes, chunk_size=2))
+        self.assertEqual(batches, [ctypes[:2], ctypes[2:4], ctypes[4:]])
+        self.assertEqual([record.side_effect_objs for record in records], [ctypes[:2], ctypes[2:4], ctypes[4:]])
+
+    def test_chunk_size_evaluates_querysets_in_chunks(self):
+        ctype = G(ContentType)
+        permissions = [G(Permission, content_type=ctype) for i in range(3)]
+        batches = []
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                permissions = Permission.objects.filter(content_type__in=deleted_objs).order_by('id')
+                return permissions, permissions
+
+        class PermissionDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Permission
+
+            def get_side_effects(self, deleted_objs):
+                batches.append(deleted_objs)
+                return [], []
+
+        register_deletion_side_effects(CTypeDeletionSideEffects, PermissionDeletionSideEffects)
+
+        records = list(iter_deletion_side_effects(ContentType, [ctype], chunk_size=2))
+        self.assertEqual(sorted(len(batch) for batch in batches), [1, 2])
+        self.assertEqual(set(obj for batch in batches for obj in batch), set(permissions))
+        self.assertEqual([record.side_effect_objs for record in records], [permissions[:2], permissions[2:]])
+
+
+class TestDeletionSideEffectsContext(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_memoize(self):
+        context = DeletionSideEffectsContext()
+        func = Mock(return_value=5)
+
+        self.assertEqual(context.memoize('key', func, 1, b=2), 5)
+        self.assertEqual(context.memoize('key', func, 1, b=2), 5)
+        func.assert_called_once_with(1, b=2)
+        self.assertEqual((context.hits, context.misses), (1, 1))
+
+    def test_get_and_set(self):
+        context = DeletionSideEffectsContext()
+
+        self.assertEqual(context.get('key', 'default'), 'default')
+        context.set('key', 'value')
+        self.assertEqual(context.get('key'), 'value')
+        self.assertIn('key', context)
+        self.assertEqual((context.hits, context.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        context = DeletionSideEffectsContext(max_size=2)
+        context.set('a', 1)
+        context.set('b', 2)
+        context.get('a')
+        context.set('c', 3)
+
+        self.assertEqual(len(context), 2)
+        self.assertIn('a', context)
+        self.assertNotIn('b', context)
+        self.assertIn('c', context)
+
+    def test_shared_by_handlers_and_levels(self):
+        lookups = []
+
+        def get_owned_users(ctype_ids):
+            lookups.append(ctype_ids)
+            return [User(id=1)]
+
+        class CTypeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+            def get_side_effects(self, deleted_objs):
+                users = self.context.memoize(('owned_users', 1), get_owned_users, [1])
+                return users, [ContentType(id=2)] if self.context.level == 0 else []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} users'.format(len(side_effect_objs))
+
+        class OtherCTypeDeletionSideEffects(CTypeDeletionSideEffects):
+            pass
+
+        register_deletion_side_effects(CTypeDeletionSideEffects, OtherCTypeDeletionSideEffects)
+
+        context = DeletionSideEffectsContext()
+        side_effects = gather_deletion_side_effects(ContentType, [ContentType(id=1)], context=context)
+
+        self.assertEqual([side_effect['msg'] for side_effect in side_effects], ['1 users', '1 users'])
+        self.assertEqual(lookups, [[1]])
+        self.assertEqual((context.hits, context.misses), (3, 1))
+
+
+class TestGetIdentity(TransactionTestCase):
+    def test_model_instance(self):
+        self.assertEqual(_get_identity(User(id=3)), (User, 3))
+
+    def test_proxy_model_instance_uses_concrete_model(self):
+        class ProxyUser(User):
+            class Meta:
+                app_label = 'tests'
+                proxy = True
+
+        self.assertEqual(_get_identity(ProxyUser(id=3)), (User, 3))
+
+    def test_other_object(self):
+        obj = Mock()
+        self.assertEqual(_get_identity(obj), (None, obj))
+
+
+class TestRegisterDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_register_deletion_side_effects_single(self):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+        self.assertEqual(_DELETION_SIDE_EFFECTS, {
+            ContentType: set([MyDeletionSideEffects])
+        })
+
+    def test_register_deletion_side_effects_duplicates(self):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+        register_deletion_side_effects(MyDeletionSideEffects)
+        self.assertEqual(_DELETION_SIDE_EFFECTS, {
+            ContentType: set([MyDeletionSideEffects])
+        })
+
+    def test_register_deletion_side_effects_multiple(self):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+        class MyOtherDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ContentType
+
+        register_deletion_side_effects(MyDeletionSideEffects)
+        register_deletion_side_effects(MyOtherDeletionSideEffects)
+        self.assertEqual(_DELETION_SIDE_EFFECTS, {
+            ContentType: set([MyDeletionSideEffects, MyOtherDeletionSideEffects])
+        })
+
+    def test_register_deletion_invalid_side_effects_no_obj_class(self):
+        class MyDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = None
+
+        with self.assertRaises(ValueError):
+            register_deletion_side_effects(MyDeletionSideEffects)
+
+    def test_register_deletion_invalid_side_effects_wrong_inheritance(self):
+        with self.assertRaises(ValueError):
+            register_deletion_side_effects(object)
+
+
+class TestRegisterLazyDeletionSideEffects(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        sys.modules.pop('deletion_side_effects.tests.lazy_handlers', None)
+        sys.modules.pop('deletion_side_effects.tests.deletion_side_effects', None)
+
+    def test_imported_when_reached(self):
+        register_lazy_deletion_side_effects(
+            'tests.Parent', 'deletion_side_effects.tests.lazy_handlers.LazyParentDeletionSideEffects')
+        register_lazy_deletion_side_effects(
+            'tests.child', 'deletion_side_effects.tests.lazy_handlers.LazyChildDeletionSideEffects')
+        self.assertNotIn('deletion_side_effects.tests.lazy_handlers', sys.modules)
+
+        # Gathers of other models do not import the handlers
+        self.assertEqual(gather_deletion_side_effects(ContentType, [ContentType(id=1)]), [])
+        self.assertNotIn('deletion_side_effects.tests.lazy_handlers', sys.modules)
+
+        child = G(Child)
+        side_effects = gather_deletion_side_effects(Parent, [child.parent])
+        self.assertEqual(side_effects, [{'msg': '1 children deleted lazily', 'side_effect_objs': [child]}])
+        self.assertEqual(_DELETION_SIDE_EFFECTS.lazy_paths, {})
+        self.assertEqual(set(_DELETION_SIDE_EFFECTS), {Parent, Child})
+
+    def test_imported_for_subclasses(self):
+        register_lazy_deletion_side_effects(
+            'tests.Parent', 'deletion_side_effects.tests.lazy_handlers.LazyParentDeletionSideEffects')
+
+        self.assertEqual(len(_DELETION_SIDE_EFFECTS.get_handlers(SpecialParent)), 1)
+        self.assertEqual(len(_DELETION_SIDE_EFFECTS.get_handlers(ProxyParent)), 1)
+
+    def test_wrong_deleted_obj_class(self):
+        register_lazy_deletion_side_effects(
+            'tests.Parent', 'deletion_side_effects.tests.lazy_handlers.LazyChildDeletionSideEffects')
+
+        with self.assertRaises(ValueError):
+            gather_deletion_side_effects(Parent, [G(Parent)])
+
+    def test_failed_import_raised_again(self):
+        register_lazy_deletion_side_effects(
+            'tests.Parent', 'deletion_side_effects.tests.lazy_handlers.LazyParentDeletionSideEffects')
+        register_lazy_deletion_side_effects('tests.Parent', 'deletion_side_effects.tests.lazy_handlers.Missing')
+        parent = G(Parent)
+
+        for _ in range(2):
+            with self.assertRaises(ImportError):
+                gather_deletion_side_effects(Parent, [parent])
+
+        # The handlers that were imported stay registered and only the failed path is retried
+        self.assertEqual(_DELETION_SIDE_EFFECTS.lazy_paths, {
+            'tests.parent': {'deletion_side_effects.tests.lazy_handlers.Missing'},
+        })
+        self.assertEqual(len(_DELETION_SIDE_EFFECTS[Parent]), 1)
+
+    def test_autodiscover(self):
+        autodiscover_deletion_side_effects()
+        self.assertEqual(_DELETION_SIDE_EFFECTS.lazy_paths, {
+            'tests.child': {'deletion_side_effects.tests.lazy_handlers.LazyChildDeletionSideEffects'},
+        })
+        self.assertNotIn('deletion_side_effects.tests.lazy_handlers', sys.modules)
+
+    def test_autodiscovered_when_ready(self):
+        app_config = apps.get_app_config('deletion_side_effects')
+
+        app_config.ready()
+        self.assertEqual(_DELETION_SIDE_EFFECTS.lazy_paths, {})
+
+        with override_settings(DELETION_SIDE_EFFECTS_AUTODISCOVER=True):
+            app_config.ready()
+        self.assertEqual(set(_DELETION_SIDE_EFFECTS.lazy_paths), {'tests.child'})
+
+
+class TestHandlerDispatch(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        self.received = []
+        received = self.received
+
+        class ParentDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+
+            def get_side_effects(self, deleted_objs):
+                received.append(('parent', deleted_objs))
+                return None, []
+
+        class ProxyParentDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = ProxyParent
+
+            def get_side_effects(self, deleted_objs):
+                received.append(('proxy', deleted_objs))
+                return None, []
+
+        self.ParentDeletionSideEffects = ParentDeletionSideEffects
+        self.ProxyParentDeletionSideEffects = ProxyParentDeletionSideEffects
+
+    def test_handlers_of_base_classes(self):
+        register_deletion_side_effects(self.ParentDeletionSideEffects)
+
+        special_parent = G(SpecialParent)
+        gather_deletion_side_effects(SpecialParent, [special_parent])
+        self.assertEqual(self.received, [('parent', [special_parent])])
+
+    def test_handlers_of_proxies(self):
+        register_deletion_side_effects(self.ProxyParentDeletionSideEffects)
+
+        parent = G(Parent)
+        proxy_parent = ProxyParent.objects.get(id=parent.id)
+        gather_deletion_side_effects(ProxyParent, [proxy_parent])
+        self.assertEqual(self.received, [('proxy', [proxy_parent])])
+
+        # Handlers of proxies are not called for deleted objects of the concrete model or of its children
+        self.received.clear()
+        gather_deletion_side_effects(Parent, [parent])
+        gather_deletion_side_effects(SpecialParent, [G(SpecialParent)])
+        self.assertEqual(self.received, [])
+
+        # Proxies resolve the handlers of their concrete model
+        register_deletion_side_effects(self.ParentDeletionSideEffects)
+        dispatch_table = _DELETION_SIDE_EFFECTS.dispatch_table
+        self.assertEqual(
+            set(dispatch_table.get_handlers(ProxyParent)),
+            {self.ParentDeletionSideEffects, self.ProxyParentDeletionSideEffects})
+        self.assertEqual(dispatch_table.get_handlers(Parent), (self.ParentDeletionSideEffects,))
+        self.assertEqual(dispatch_table.get_handlers(SpecialParent), (self.ParentDeletionSideEffects,))
+
+    def test_dispatch_table_rebuilt_on_change(self):
+        dispatch_table = _DELETION_SIDE_EFFECTS.dispatch_table
+        self.assertIs(_DELETION_SIDE_EFFECTS.dispatch_table, dispatch_table)
+        self.assertFalse(dispatch_table.has_handlers(Parent))
+
+        register_deletion_side_effects(self.ParentDeletionSideEffects)
+        self.assertTrue(_DELETION_SIDE_EFFECTS.dispatch_table.has_handlers(Parent))
+
+        _DELETION_SIDE_EFFECTS.clear()
+        self.assertFalse(_DELETION_SIDE_EFFECTS.dispatch_table.has_handlers(Parent))
+
+    def test_lookups_do_not_change_registry(self):
+        register_deletion_side_effects(self.ParentDeletionSideEffects)
+
+        gather_deletion_side_effects(Child, [G(Child)])
+        self.assertEqual(_DELETION_SIDE_EFFECTS, {Parent: {self.ParentDeletionSideEffects}})
+
+        # Classes that are not models are resolved on lookup
+        self.assertEqual(_DELETION_SIDE_EFFECTS.dispatch_table.get_handlers(str), ())
+
+    def test_objs_without_handlers_not_tracked(self):
+        child = G(Child)
+
+        class CascadeDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+
+            def get_side_effects(self, deleted_objs):
+                return None, [child]
+
+        register_deletion_side_effects(CascadeDeletionSideEffects)
+
+        gatherer = _DeletionSideEffectsGatherer()
+        gatherer.gather(Parent, [child.parent])
+        self.assertNotIn(Child, gatherer.all_deleted_keys)
+
+        # Complete gathers track every deleted object
+        gatherer = _DeletionSideEffectsGatherer(complete=True)
+        gatherer.gather(Parent, [child.parent])
+        self.assertEqual(gatherer.all_deleted_keys[Child], {child.pk})
+
+        self.assertEqual(gather_deletion_side_effects_bulk(Parent, [child.parent]), [[]])
+
+
+class TestCascadePruning(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        self.calls = []
+        calls = self.calls
+
+        class ParentDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+            cascades_to = ['tests.Child']
+            has_side_effects = False
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(Parent)
+                return None, list(Child.objects.filter(parent__in=deleted_objs))
+
+        class ChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+            cascades_to = [GrandChild]
+            has_side_effects = False
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(Child)
+                return None, list(GrandChild.objects.filter(child__in=deleted_objs))
+
+        class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = GrandChild
+            cascades_to = []
+
+            def get_side_effects(self, deleted_objs):
+                calls.append(GrandChild)
+                return deleted_objs, []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} grand children deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(ParentDeletionSideEffects, ChildDeletionSideEffects)
+        self.GrandChildDeletionSideEffects = GrandChildDeletionSideEffects
+
+        self.grand_child = G(GrandChild)
+
+    def test_cascades_without_side_effects_dropped(self):
+        self.assertFalse(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+        self.assertFalse(_DELETION_SIDE_EFFECTS.can_have_side_effects(Child))
+
+        # The root is always walked, but the children cannot lead to side effects
+        self.assertEqual(gather_deletion_side_effects(Parent, [self.grand_child.child.parent]), [])
+        self.assertEqual(self.calls, [Parent])
+
+    def test_cascades_with_side_effects_walked(self):
+        register_deletion_side_effects(self.GrandChildDeletionSideEffects)
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(SpecialParent))
+
+        side_effects = gather_deletion_side_effects(Parent, [self.grand_child.child.parent])
+        self.assertEqual(side_effects, [{'msg': '1 grand children deleted', 'side_effect_objs': [self.grand_child]}])
+        self.assertEqual(self.calls, [Parent, Child, GrandChild])
+
+    def test_undeclared_cascades_walked(self):
+        class UndeclaredChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+            has_side_effects = False
+
+        register_deletion_side_effects(UndeclaredChildDeletionSideEffects)
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+
+    def test_lazy_handlers_walked(self):
+        register_lazy_deletion_side_effects(
+            'tests.GrandChild', 'deletion_side_effects.tests.lazy_handlers.LazyGrandChildDeletionSideEffects')
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(GrandChild))
+
+    def test_cyclic_cascades_without_side_effects(self):
+        class CyclicChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+            cascades_to = [Parent]
+            has_side_effects = False
+
+        register_deletion_side_effects(CyclicChildDeletionSideEffects)
+        self.assertFalse(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+
+        register_deletion_side_effects(self.GrandChildDeletionSideEffects)
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(Parent))
+
+    def test_only_handlers_reaching_the_handler_called(self):
+        calls = self.calls
+
+        class ParentNameDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+            cascades_to = []
+
+            def get_side_effects(self, deleted_objs):
+                calls.append('name')
+                return deleted_objs, []
+
+        register_deletion_side_effects(self.GrandChildDeletionSideEffects, ParentNameDeletionSideEffects)
+        grand_child_path = _get_handler_path(self.GrandChildDeletionSideEffects)
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_reach(Parent, grand_child_path))
+        self.assertFalse(_DELETION_SIDE_EFFECTS.can_reach(Child, _get_handler_path(ParentNameDeletionSideEffects)))
+
+        gatherer = _DeletionSideEffectsGatherer(handler_path=grand_child_path)
+        gathered_side_effects = gatherer.gather(Parent, [self.grand_child.child.parent])
+        self.assertEqual(list(gathered_side_effects), [self.GrandChildDeletionSideEffects])
+        self.assertEqual(self.calls, [Parent, Child, GrandChild])
+        self.calls.clear()
+
+        # The children cannot reach the handler of the parents, so they are not walked
+        gatherer = _DeletionSideEffectsGatherer(handler_path=_get_handler_path(ParentNameDeletionSideEffects))
+        gathered_side_effects = gatherer.gather(Parent, [self.grand_child.child.parent])
+        self.assertEqual(list(gathered_side_effects), [ParentNameDeletionSideEffects])
+        self.assertEqual(self.calls, ['name'])
+
+    def test_side_effects_of_other_handlers_reaching_the_handler_not_kept(self):
+        class ChildNameDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                return deleted_objs, []
+
+        register_deletion_side_effects(self.GrandChildDeletionSideEffects, ChildNameDeletionSideEffects)
+
+        # The handler of the children does not declare its cascades, so it is called but its side effects are dropped
+        gatherer = _DeletionSideEffectsGatherer(handler_path=_get_handler_path(self.GrandChildDeletionSideEffects))
+        gathered_side_effects = gatherer.gather(Parent, [self.grand_child.child.parent])
+        self.assertEqual(list(gathered_side_effects), [self.GrandChildDeletionSideEffects])
+
+
+class TestGatherDeletionSideEffectsMemoryCap(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        self.received = []
+        received = self.received
+
+        class ChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                children = Child.objects.filter(parent__in=deleted_objs)
+                return children, children
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} children deleted'.format(len(side_effect_objs))
+
+        class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                received.append(sorted(deleted_obj.id for deleted_obj in deleted_objs))
+                grand_children = list(GrandChild.objects.filter(child__in=deleted_objs))
+                return grand_children, [deleted_obj.other_parent for deleted_obj in deleted_objs]
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} grand children deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(ChildDeletionSideEffects, GrandChildDeletionSideEffects)
+
+        # The children cascade back to the parents, so the walk ends only if deleted objects are excluded
+        self.parents = [G(Parent), G(Parent)]
+        self.children = [G(Child, parent=self.parents[i % 2], other_parent=self.parents[0]) for i in range(5)]
+        self.grand_children = [G(GrandChild, child=child) for child in self.children[:3]]
+
+    def gather(self, **kwargs):
+        side_effects = gather_deletion_side_effects(Parent, self.parents, **kwargs)
+        return {side_effect['msg']: set(side_effect['side_effect_objs']) for side_effect in side_effects}
+
+    def test_spilled_gather_matches_gather(self):
+        expected = self.gather()
+        self.assertEqual(expected, {
+            '5 children deleted': set(self.children),
+            '3 grand children deleted': set(self.grand_children),
+        })
+        self.received.clear()
+
+        self.assertEqual(self.gather(max_memory_keys=1), expected)
+        self.assertEqual(self.received, [[child.id for child in self.children]])
+
+    def test_keys_spill(self):
+        gatherer = _DeletionSideEffectsGatherer(max_memory_keys=3)
+        gatherer.gather(Parent, self.parents)
+        self.assertIsNotNone(gatherer.all_deleted_keys.store)
+        self.assertEqual(len(gatherer.all_deleted_keys[Child]), 5)
+        self.assertEqual(gatherer.get_deleted_pks(), {
+            Parent: {parent.id for parent in self.parents},
+            Child: {child.id for child in self.children},
+        })
+
+    def test_keys_of_other_objects_not_spilled(self):
+        gatherer = _DeletionSideEffectsGatherer(max_memory_keys=3)
+        gatherer.all_deleted_keys.add(None, ['key'])
+        gatherer.gather(Parent, self.parents)
+        self.assertIsNotNone(gatherer.all_deleted_keys.store)
+        self.assertEqual(gatherer.all_deleted_keys[None], {'key'})
+        self.assertEqual(set(gatherer.get_deleted_pks()), {Parent, Child})
+
+    def test_keys_within_cap(self):
+        gatherer = _DeletionSideEffectsGatherer(max_memory_keys=10)
+        gatherer.gather(Parent, self.parents)
+        self.assertIsNone(gatherer.all_deleted_keys.store)
+        self.assertEqual(gatherer.all_deleted_keys[Child], {child.id for child in self.children})
+
+    @patch('deletion_side_effects.deletion_side_effects.GET_ITERATOR_CHUNK_SIZE', 2)
+    def test_spilled_batches_are_chunked(self):
+        querysets = []
+
+        class ChildQuerysetDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+            uses_querysets = True
+
+            def get_side_effects(self, deleted_objs):
+                querysets.append(sorted(deleted_objs.values_list('id', flat=True)))
+                return None, []
+
+        register_deletion_side_effects(ChildQuerysetDeletionSideEffects)
+        gather_deletion_side_effects(Parent, self.parents, max_memory_keys=0)
+
+        child_ids = [child.id for child in self.children]
+        self.assertEqual(querysets, [child_ids[:2], child_ids[2:4], child_ids[4:]])
+        self.assertEqual(self.received, [child_ids[:2], child_ids[2:4], child_ids[4:]])
+
+    def test_spilled_batch_with_objs(self):
+        gatherer = _DeletionSideEffectsGatherer(max_memory_keys=0)
+        gatherer.all_deleted_keys.add(Child, [self.children[0].id])
+
+        batch = gatherer._get_root_batch(Child, [self.children[1], Child.objects.all()])
+        self.assertTrue(gatherer._is_pending(batch))
+        self.assertEqual(list(batch.spilled_keys), [child.id for child in self.children[2:]])
+        self.assertEqual(
+            [list(queryset) for queryset in batch.iter_querysets()], [[self.children[1]], self.children[2:]])
+
+    def test_spilled_keys_read_lazily(self):
+        gatherer = _DeletionSideEffectsGatherer(max_memory_keys=0)
+        gatherer.all_deleted_keys.add(Parent, [parent.id for parent in self.parents])
+        batch = gatherer._get_root_batch(Child, [Child.objects.all()])
+        self.assertTrue(gatherer._is_pending(batch))
+
+        read_chunks = []
+        iter_chunks = batch.spilled_keys.iter_chunks
+
+        def iter_read_chunks(chunk_size):
+            for pks in iter_chunks(chunk_size):
+                read_chunks.append(pks)
+                yield pks
+
+        with patch.object(batch.spilled_keys, 'iter_chunks', iter_read_chunks):
+            obj_chunks = batch.iter_obj_chunks(2)
+            self.assertEqual(next(obj_chunks), self.children[:2])
+            self.assertEqual(len(read_chunks), 1)
+            self.assertEqual(list(obj_chunks), [self.children[2:4], self.children[4:]])
+            self.assertEqual(len(read_chunks), 3)
+
+    def test_max_objects_limits_spilled_batch(self):
+        side_effects = gather_deletion_side_effects(Parent, self.parents, max_memory_keys=0, max_objects=4)
+
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertEqual(self.received, [[self.children[0].id, self.children[1].id]])
+
+
+class PicklableChildDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    A handler defined at module level, so that its side effects can be pickled
+    """
+    deleted_obj_class = Parent
+
+    def get_side_effects(self, deleted_objs):
+        children = list(Child.objects.filter(parent__in=deleted_objs))
+        return children, children
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted'.format(len(side_effect_objs))
+
+
+class TestExtendRoots(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        self.received = []
+        received = self.received
+
+        class ChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Parent
+
+            def get_side_effects(self, deleted_objs):
+                received.append((Parent, sorted(deleted_obj.id for deleted_obj in deleted_objs)))
+                children = Child.objects.filter(Q(parent__in=deleted_objs) | Q(other_parent__in=deleted_objs))
+                return children, children
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} children deleted'.format(len(side_effect_objs))
+
+        class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Child
+
+            def get_side_effects(self, deleted_objs):
+                received.append((Child, sorted(deleted_obj.id for deleted_obj in deleted_objs)))
+                return list(GrandChild.objects.filter(child__in=deleted_objs)), []
+
+            def get_side_effect_message(self, side_effect_objs):
+                return '{0} grand children deleted'.format(len(side_effect_objs))
+
+        register_deletion_side_effects(ChildDeletionSideEffects, GrandChildDeletionSideEffects)
+
+        self.parents = [G(Parent), G(Parent), G(Parent)]
+        self.children = [
+            G(Child, parent=self.parents[0], other_parent=self.parents[1]),
+            G(Child, parent=self.parents[1], other_parent=self.parents[1]),
+            G(Child, parent=self.parents[2], other_parent=self.parents[2]),
+        ]
+        self.grand_children = [G(GrandChild, child=child) for child in self.children]
+
+    def get_side_effects(self, side_effects):
+        return {side_effect['msg']: set(side_effect['side_effect_objs']) for side_effect in side_effects}
+
+    def test_extend_roots(self):
+        side_effects = gather_deletion_side_effects(Parent, self.parents[:1], extendable=True)
+        self.assertEqual(self.get_side_effects(side_effects), {
+            '1 children deleted': {self.children[0]},
+            '1 grand children deleted': {self.grand_children[0]},
+        })
+        self.received.clear()
+
+        # The child shared with the first parent is not walked again
+        self.assertIs(side_effects.extend_roots([self.parents[0], self.parents[1]]), side_effects)
+        self.assertEqual(self.received, [(Parent, [self.parents[1].id]), (Child, [self.children[1].id])])
+        self.assertEqual(self.get_side_effects(side_effects), {
+            '2 children deleted': set(self.children[:2]),
+            '2 grand children deleted': set(self.grand_children[:2]),
+        })
+        self.assertEqual(
+            self.get_side_effects(side_effects),
+            self.get_side_effects(gather_deletion_side_effects(Parent, self.parents[:2])))
+
+    def test_extend_roots_with_deleted_roots(self):
+        side_effects = gather_deletion_side_effects(Parent, self.parents[:2], extendable=True)
+        self.received.clear()
+
+        # The children are only checked for rows again when the side effects are rendered
+        with self.assertNumQueries(1):
+            side_effects.extend_roots(self.parents[:2])
+        self.assertEqual(self.received, [])
+        self.assertEqual(len(side_effects), 2)
+
+    def test_extend_roots_with_queryset(self):
+        side_effects = gather_deletion_side_effects(
+            Parent, Parent.objects.filter(id=self.parents[0].id), extendable=True)
+        self.received.clear()
+
+        side_effects.extend_roots(Parent.objects.filter(id__in=[self.parents[0].id, self.parents[2].id]))
+        self.assertEqual(self.received, [(Parent, [self.parents[2].id]), (Child, [self.children[2].id])])
+        self.assertEqual(self.get_side_effects(side_effects), {
+            '2 children deleted': {self.children[0], self.children[2]},
+            '2 grand children deleted': {self.grand_children[0], self.grand_children[2]},
+        })
+
+        self.received.clear()
+        side_effects.extend_roots(Parent.objects.filter(id=self.parents[2].id))
+        self.assertEqual(self.received, [])
+
+    def test_extend_roots_limits(self):
+        side_effects = gather_deletion_side_effects(
+            Parent, self.parents[:1], profile=True, max_objects=3, extendable=True)
+        profile = side_effects.profile
+        self.assertFalse(side_effects.truncated)
+
+        side_effects.extend_roots(self.parents[1:])
+        self.assertEqual(side_effects.truncated_by, {'max_objects'})
+        self.assertIsNot(side_effects.profile, profile)
+        self.assertEqual([call.side_effects_class.__name__ for call in side_effects.profile.calls], [
+            'ChildDeletionSideEffects',
+        ])
+
+    def test_extend_roots_with_executor(self):
+        side_effects = gather_deletion_side_effects(Parent, self.parents[:1], extendable=True)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            side_effects.extend_roots(self.parents[2:], executor=executor)
+
+        self.assertEqual(self.get_side_effects(side_effects), {
+            '2 children deleted': {self.children[0], self.children[2]},
+            '2 grand children deleted': {self.grand_children[0], self.grand_children[2]},
+        })
+
+    def test_extend_roots_without_gather(self):
+        with self.assertRaises(ValueError):
+            gather_deletion_side_effects_bulk(Parent, self.parents[:1])[0].extend_roots(self.parents[1:])
+
+    def test_extend_roots_not_extendable(self):
+        side_effects = gather_deletion_side_effects(Parent, self.parents[:1])
+        self.assertIsNone(side_effects._gatherer)
+        with self.assertRaises(ValueError):
+            side_effects.extend_roots(self.parents[1:])
+
+    def test_extendable_result_pickled_without_state(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(PicklableChildDeletionSideEffects)
+        side_effects = gather_deletion_side_effects(Parent, self.parents[:1], extendable=True)
+
+        for copied in [pickle.loads(pickle.dumps(side_effects)), copy.deepcopy(side_effects)]:
+            self.assertEqual(copied, side_effects)
+            self.assertEqual(copied.truncated_by, side_effects.truncated_by)
+            with self.assertRaises(ValueError):
+                copied.extend_roots(self.parents[1:])
+
+        caches['default'].set('side_effects', side_effects)
+        self.assertEqual(caches['default'].get('side_effects'), side_effects)
+        self.assertIsNotNone(side_effects._gatherer)
@@ -0,0 +1,92 @@
+from django.test import TransactionTestCase
+
+from deletion_side_effects.auto_cascade import register_auto_cascade_deletion_side_effects
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, register_deletion_side_effects
+)
+from deletion_side_effects.graph import get_handler_graph
+from deletion_side_effects.tests.models import Child, GrandChild, Parent, Player, SpecialParent, Team
+
+
+class UndeclaredGrandChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = GrandChild
+
+
+class TestGetHandlerGraph(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+
+    def test_edges(self):
+        handlers = register_auto_cascade_deletion_side_effects([Parent, Child])
+        register_deletion_side_effects(UndeclaredGrandChildDeletionSideEffects)
+        parent_cascade, parent_set_null, child_cascade = handlers
+
+        graph = get_handler_graph()
+        self.assertEqual(graph.edges, {
+            Parent: {SpecialParent: {parent_cascade}, Child: {parent_cascade}},
+            SpecialParent: {SpecialParent: {parent_cascade}, Child: {parent_cascade}},
+            Child: {GrandChild: {child_cascade}},
+            GrandChild: {None: {UndeclaredGrandChildDeletionSideEffects}},
+        })
+        self.assertEqual(graph.productive_classes, {Parent, SpecialParent, Child, GrandChild})
+
+        # The multi-table child cascades to itself through the handlers of its parent
+        self.assertEqual(graph.get_cycles(), [[SpecialParent]])
+
+    def test_cycles(self):
+        register_auto_cascade_deletion_side_effects([Team, Player])
+
+        graph = get_handler_graph()
+        self.assertEqual(graph.edges, {
+            Team: {Player: {_DELETION_SIDE_EFFECTS.get_handlers(Team)[0]}},
+            Player: {},
+        })
+        self.assertEqual(graph.get_cycles(), [])
+
+    def test_cyclic_cascades(self):
+        class TeamDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Team
+            cascades_to = [Player]
+            has_side_effects = False
+
+        class PlayerDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = Player
+            cascades_to = [Team]
+            has_side_effects = False
+
+        register_deletion_side_effects(TeamDeletionSideEffects, PlayerDeletionSideEffects)
+
+        graph = get_handler_graph()
+        self.assertEqual(graph.get_cycles(), [[Player, Team]])
+        self.assertEqual(graph.productive_classes, set())
+        self.assertEqual(graph.to_dot(), '\n'.join([
+            'digraph deletion_side_effects {',
+            '    "tests.Player" [style=dashed];',
+            '    "tests.Team" [style=dashed];',
+            '    "tests.Player" -> "tests.Team" [label="PlayerDeletionSideEffects"];',
+            '    "tests.Team" -> "tests.Player" [label="TeamDeletionSideEffects"];',
+            '}',
+        ]))
+
+    def test_to_dot(self):
+        register_deletion_side_effects(UndeclaredGrandChildDeletionSideEffects)
+
+        self.assertEqual(get_handler_graph().to_dot(), '\n'.join([
+            'digraph deletion_side_effects {',
+            '    "tests.GrandChild";',
+            '    "tests.GrandChild" -> "*" [label="UndeclaredGrandChildDeletionSideEffects"];',
+            '}',
+        ]))
+
+    def test_classes_that_are_not_models(self):
+        class StrDeletionSideEffects(BaseDeletionSideEffects):
+            deleted_obj_class = str
+            cascades_to = [str]
+
+        register_deletion_side_effects(StrDeletionSideEffects)
+
+        graph = get_handler_graph()
+        self.assertEqual(graph.get_cycles(), [[str]])
+        self.assertTrue(_DELETION_SIDE_EFFECTS.can_have_side_effects(str))
+        self.assertFalse(_DELETION_SIDE_EFFECTS.can_have_side_effects(int))
+        self.assertIn('"builtins.str" -> "builtins.str" [label="StrDeletionSideEffects"];', graph.to_dot())
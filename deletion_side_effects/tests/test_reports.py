@@ -0,0 +1,248 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from django_dynamic_fixture import G
+from unittest.mock import Mock, patch
+
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, _DELETION_SIDE_EFFECTS, register_deletion_side_effects
+)
+from deletion_side_effects.models import DeletionSideEffectReport
+from deletion_side_effects.reports import (
+    _init_worker, make_report_executor, process_deletion_side_effect_reports, queue_deletion_side_effect_report
+)
+from deletion_side_effects.tests.models import Child, Parent
+
+
+class ChildDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Parent
+
+    def get_side_effects(self, deleted_objs):
+        return list(Child.objects.filter(parent__in=deleted_objs).order_by('id')), []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted'.format(len(side_effect_objs))
+
+
+class NameDeletionSideEffects(BaseDeletionSideEffects):
+    deleted_obj_class = Parent
+
+    def get_side_effects(self, deleted_objs):
+        return [deleted_obj.name for deleted_obj in deleted_objs], []
+
+    def get_side_effect_message(self, side_effect_objs):
+        if 'fail' in side_effect_objs:
+            raise ValueError('Cannot render')
+        return 'Names {0}'.format(', '.join(sorted(side_effect_objs)))
+
+
+class MapExecutor(object):
+    """
+    An executor that runs functions in the calling process
+    """
+    def __init__(self):
+        self.shutdown = Mock()
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+class BrokenExecutor(MapExecutor):
+    """
+    An executor whose pool broke after it ran its first function
+    """
+    def submit(self, func, *args):
+        if self.shutdown.called:
+            future = Future()
+            future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+            return future
+
+        self.shutdown()
+        return super().submit(func, *args)
+
+
+class TestQueueDeletionSideEffectReport(TransactionTestCase):
+    def test_queue(self):
+        parents = [G(Parent), G(Parent)]
+
+        report = queue_deletion_side_effect_report(Parent, parents, max_objects=10)
+        self.assertEqual(report.content_type, ContentType.objects.get_for_model(Parent))
+        self.assertEqual(report.object_ids, sorted([str(parents[0].id), str(parents[1].id)]))
+        self.assertEqual(report.gather_kwargs, {'max_objects': 10})
+        self.assertEqual(report.status, DeletionSideEffectReport.STATUS_PENDING)
+        self.assertFalse(report.is_finished)
+        self.assertEqual(str(report), 'tests | parent {0} (pending)'.format(', '.join(report.object_ids)))
+
+        # Pending reports of the same roots are reused
+        self.assertEqual(queue_deletion_side_effect_report(Parent, parents[::-1], max_objects=10), report)
+        self.assertNotEqual(queue_deletion_side_effect_report(Parent, parents), report)
+        self.assertNotEqual(queue_deletion_side_effect_report(Parent, parents[:1], max_objects=10), report)
+        self.assertEqual(DeletionSideEffectReport.objects.for_objs(Parent, parents).count(), 2)
+
+    @override_settings(DELETION_SIDE_EFFECTS_REPORT_TIMEOUT=60)
+    def test_stale_running_report_not_reused(self):
+        parent = G(Parent)
+        report = queue_deletion_side_effect_report(Parent, [parent])
+        DeletionSideEffectReport.objects.filter(id=report.id).update(
+            status=DeletionSideEffectReport.STATUS_RUNNING, started=timezone.now() - timedelta(seconds=30))
+        self.assertEqual(queue_deletion_side_effect_report(Parent, [parent]), report)
+
+        DeletionSideEffectReport.objects.filter(id=report.id).update(started=timezone.now() - timedelta(seconds=90))
+        self.assertNotEqual(queue_deletion_side_effect_report(Parent, [parent]), report)
+
+    def test_invalid_gather_kwargs(self):
+        with self.assertRaises(ValueError):
+            queue_deletion_side_effect_report(Parent, [G(Parent)], executor=None)
+
+
+class TestProcessDeletionSideEffectReports(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(ChildDeletionSideEffects, NameDeletionSideEffects)
+
+        self.parent = G(Parent, name='a')
+        self.children = [G(Child, parent=self.parent), G(Child, parent=self.parent)]
+
+    def test_process_inline(self):
+        report = queue_deletion_side_effect_report(Parent, [self.parent])
+
+        self.assertEqual(process_deletion_side_effect_reports(), [report.id])
+        report.refresh_from_db()
+        self.assertEqual(report.status, DeletionSideEffectReport.STATUS_DONE)
+        self.assertTrue(report.is_finished)
+        self.assertIsNotNone(report.started)
+        self.assertIsNotNone(report.finished)
+        self.assertEqual(sorted(report.side_effects, key=lambda side_effect: side_effect['msg']), [{
+            'msg': '2 children deleted',
+            'count': 2,
+            'objects': {'tests.child': [self.children[0].id, self.children[1].id]},
+        }, {
+            'msg': 'Names a',
+            'count': 1,
+            'objects': {},
+        }])
+        self.assertFalse(report.truncated)
+
+        # Finished reports are not run again
+        self.assertEqual(process_deletion_side_effect_reports(), [])
+
+    def test_limits(self):
+        report = queue_deletion_side_effect_report(Parent, [self.parent], max_side_effect_objs_per_handler=1)
+
+        process_deletion_side_effect_reports()
+        report.refresh_from_db()
+        self.assertEqual(report.truncated_by, ['max_side_effect_objs_per_handler'])
+        self.assertTrue(report.truncated)
+
+    def test_failed(self):
+        report = queue_deletion_side_effect_report(Parent, [G(Parent, name='fail')])
+
+        process_deletion_side_effect_reports()
+        report.refresh_from_db()
+        self.assertEqual(report.status, DeletionSideEffectReport.STATUS_FAILED)
+        self.assertIn('Cannot render', report.error)
+        self.assertTrue(report.is_finished)
+
+    def test_process_on_executor(self):
+        reports = [
+            queue_deletion_side_effect_report(Parent, [self.parent]),
+            queue_deletion_side_effect_report(Parent, [G(Parent, name='b')]),
+        ]
+
+        report_ids = process_deletion_side_effect_reports(executor=MapExecutor(), limit=1)
+        self.assertEqual(report_ids, [reports[0].id])
+        self.assertEqual(
+            list(DeletionSideEffectReport.objects.order_by('id').values_list('status', flat=True)),
+            [DeletionSideEffectReport.STATUS_DONE, DeletionSideEffectReport.STATUS_PENDING])
+
+        self.assertEqual(process_deletion_side_effect_reports(executor=MapExecutor()), [reports[1].id])
+        self.assertEqual(process_deletion_side_effect_reports(executor=MapExecutor()), [])
+
+    def test_stale_running_reports_failed(self):
+        reports = [
+            queue_deletion_side_effect_report(Parent, [self.parent]),
+            queue_deletion_side_effect_report(Parent, [G(Parent, name='b')]),
+        ]
+        DeletionSideEffectReport.objects.filter(id=reports[0].id).update(
+            status=DeletionSideEffectReport.STATUS_RUNNING, started=timezone.now() - timedelta(hours=2))
+        DeletionSideEffectReport.objects.filter(id=reports[1].id).update(
+            status=DeletionSideEffectReport.STATUS_RUNNING, started=timezone.now() - timedelta(minutes=30))
+
+        self.assertEqual(process_deletion_side_effect_reports(), [])
+        reports[0].refresh_from_db()
+        self.assertEqual(reports[0].status, DeletionSideEffectReport.STATUS_FAILED)
+        self.assertIn('did not finish', reports[0].error)
+        self.assertTrue(reports[0].is_finished)
+
+        self.assertEqual(process_deletion_side_effect_reports(timeout=60), [])
+        reports[1].refresh_from_db()
+        self.assertEqual(reports[1].status, DeletionSideEffectReport.STATUS_FAILED)
+
+    def test_broken_executor(self):
+        reports = [
+            queue_deletion_side_effect_report(Parent, [self.parent]),
+            queue_deletion_side_effect_report(Parent, [G(Parent, name='b')]),
+            queue_deletion_side_effect_report(Parent, [G(Parent, name='c')]),
+        ]
+
+        self.assertEqual(
+            process_deletion_side_effect_reports(executor=BrokenExecutor()), [report.id for report in reports])
+        self.assertEqual(
+            list(DeletionSideEffectReport.objects.order_by('id').values_list('status', flat=True)),
+            [DeletionSideEffectReport.STATUS_DONE] + [DeletionSideEffectReport.STATUS_FAILED] * 2)
+        reports[2].refresh_from_db()
+        self.assertIn('BrokenProcessPool: A child process terminated abruptly', reports[2].error)
+        self.assertIsNotNone(reports[2].finished)
+
+    def test_make_report_executor(self):
+        executor = make_report_executor(2)
+        self.assertIsInstance(executor, ProcessPoolExecutor)
+        executor.shutdown()
+
+    @patch('deletion_side_effects.reports.django.setup')
+    def test_init_worker(self, mock_setup):
+        _init_worker()
+        self.assertFalse(mock_setup.called)
+
+        with patch('deletion_side_effects.reports.apps', Mock(ready=False)):
+            _init_worker()
+        mock_setup.assert_called_once_with()
+
+
+class TestProcessDeletionSideEffectReportsCommand(TransactionTestCase):
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(NameDeletionSideEffects)
+
+    def test_once_inline(self):
+        report = queue_deletion_side_effect_report(Parent, [G(Parent, name='a')])
+
+        stdout = StringIO()
+        call_command('process_deletion_side_effect_reports', workers=0, once=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Processed 1 deletion side effect reports\n')
+        report.refresh_from_db()
+        self.assertEqual(report.side_effects, [{'msg': 'Names a', 'count': 1, 'objects': {}}])
+
+    @patch('deletion_side_effects.management.commands.process_deletion_side_effect_reports.make_report_executor')
+    @patch('deletion_side_effects.management.commands.process_deletion_side_effect_reports.time.sleep')
+    def test_polls_queue(self, mock_sleep, mock_make_report_executor):
+        executor = mock_make_report_executor.return_value = MapExecutor()
+        mock_sleep.side_effect = KeyboardInterrupt
+        report = queue_deletion_side_effect_report(Parent, [G(Parent, name='a')])
+
+        with self.assertRaises(KeyboardInterrupt):
+            call_command('process_deletion_side_effect_reports', workers=2, interval=5, stdout=StringIO())
+
+        mock_make_report_executor.assert_called_once_with(2)
+        mock_sleep.assert_called_once_with(5)
+        executor.shutdown.assert_called_once_with()
+        report.refresh_from_db()
+        self.assertEqual(report.status, DeletionSideEffectReport.STATUS_DONE)
@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import MagicMock, Mock, patch
+
+from deletion_side_effects.deletion import delete_with_side_effects
+from deletion_side_effects.deletion_side_effects import (
+    BaseDeletionSideEffects, DeletionSideEffectsContext, _DELETION_SIDE_EFFECTS, agather_deletion_side_effects,
+    gather_deletion_side_effects, gather_deletion_side_effects_bulk, iter_deletion_side_effects,
+    register_deletion_side_effects, summarize_deletion_side_effects
+)
+from deletion_side_effects.routing import (
+    get_gather_database, get_replica_lag, resolve_gather_database, use_gather_database
+)
+from deletion_side_effects.tests.models import Child, GrandChild, Parent
+
+
+# The replica lag that is returned by the DELETION_SIDE_EFFECTS_REPLICA_LAG function of the tests
+replica_lag = Mock(return_value=0)
+
+
+class ChildDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    Returns the children of the deleted parents as a queryset that does not name a database
+    """
+    deleted_obj_class = Parent
+    uses_querysets = True
+
+    def get_side_effects(self, deleted_objs):
+        self.context.memoize('using', lambda: self.context.using)
+        children = Child.objects.filter(parent__in=deleted_objs)
+        return children, children
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} children deleted'.format(len(side_effect_objs))
+
+    def get_side_effect_count(self, side_effect_objs):
+        return side_effect_objs.count()
+
+
+class GrandChildDeletionSideEffects(BaseDeletionSideEffects):
+    """
+    Evaluates the grand children of the deleted children in the handler
+    """
+    deleted_obj_class = Child
+
+    def get_side_effects(self, deleted_objs):
+        return list(GrandChild.objects.filter(child__in=deleted_objs)), []
+
+    def get_side_effect_message(self, side_effect_objs):
+        return '{0} grand children deleted, {1} total'.format(len(side_effect_objs), GrandChild.objects.count())
+
+
+@override_settings(DATABASE_ROUTERS=['deletion_side_effects.routing.DeletionSideEffectsRouter'])
+class TestGatherOnReplica(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(ChildDeletionSideEffects, GrandChildDeletionSideEffects)
+
+        self.parent = G(Parent)
+        self.children = [G(Child, parent=self.parent), G(Child, parent=self.parent)]
+        self.grand_children = [G(GrandChild, child=self.children[0])]
+
+    def assert_side_effects(self, side_effects):
+        self.assertEqual([side_effect['msg'] for side_effect in side_effects], [
+            '2 children deleted', '1 grand children deleted, 1 total',
+        ])
+        self.assertEqual(set(side_effects[0]['side_effect_objs']), set(self.children))
+
+    def test_gather(self):
+        with self.assertNumQueries(0):
+            with self.assertNumQueries(6, using='replica'):
+                side_effects = gather_deletion_side_effects(Parent, [self.parent], using='replica')
+                self.assert_side_effects(side_effects)
+
+        self.assertIsNone(get_gather_database())
+
+    def test_gather_without_alias(self):
+        with self.assertNumQueries(0, using='replica'):
+            self.assert_side_effects(gather_deletion_side_effects(Parent, [self.parent]))
+
+    def test_context(self):
+        context = DeletionSideEffectsContext()
+        gather_deletion_side_effects(Parent, [self.parent], using='replica', context=context)
+        self.assertEqual(context.using, 'replica')
+        self.assertEqual(context.get('using'), 'replica')
+
+    def test_executor(self):
+        with self.assertNumQueries(0), ThreadPoolExecutor(max_workers=2) as executor:
+            side_effects = gather_deletion_side_effects(Parent, [self.parent], executor=executor, using='replica')
+            self.assert_side_effects(side_effects)
+
+    def test_agather(self):
+        with self.assertNumQueries(0):
+            side_effects = async_to_sync(agather_deletion_side_effects)(Parent, [self.parent], using='replica')
+            self.assert_side_effects(side_effects)
+
+    def test_summarize(self):
+        with self.assertNumQueries(0):
+            summary = summarize_deletion_side_effects(Parent, [self.parent], using='replica')
+
+        self.assertEqual(summary, [
+            {'msg': '2 children deleted', 'count': 2},
+            {'msg': '1 grand children deleted, 1 total', 'count': 1},
+        ])
+
+    def test_iter(self):
+        with self.assertNumQueries(0):
+            records = list(iter_deletion_side_effects(Parent, [self.parent], using='replica'))
+
+        self.assertEqual([record.side_effects_class for record in records], [
+            ChildDeletionSideEffects, GrandChildDeletionSideEffects,
+        ])
+        self.assertEqual(set(records[0].side_effect_objs), set(self.children))
+
+    def test_bulk(self):
+        other_parent = G(Parent)
+        with self.assertNumQueries(0):
+            results = gather_deletion_side_effects_bulk(Parent, [self.parent, other_parent], using='replica')
+            self.assert_side_effects(results[0])
+            self.assertEqual(results[1], [])
+
+    def test_delete_uses_write_database(self):
+        parent = G(Parent)
+        with self.assertNumQueries(0, using='replica'):
+            side_effects = delete_with_side_effects(Parent, [parent])
+
+        self.assertEqual(side_effects.num_deleted['tests.Parent'], 1)
+
+
+@override_settings(DELETION_SIDE_EFFECTS_REPLICA_LAG='deletion_side_effects.tests.test_routing.replica_lag')
+class TestReplicaLag(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        _DELETION_SIDE_EFFECTS.clear()
+        register_deletion_side_effects(ChildDeletionSideEffects)
+        self.parent = G(Parent)
+        G(Child, parent=self.parent)
+
+    def tearDown(self):
+        replica_lag.return_value = 0
+
+    def test_resolve_gather_database(self):
+        self.assertIsNone(resolve_gather_database(Parent, None, max_replica_lag=1))
+        self.assertEqual(resolve_gather_database(Parent, 'replica'), 'replica')
+        self.assertEqual(resolve_gather_database(Parent, 'replica', max_replica_lag=1), 'replica')
+
+        replica_lag.return_value = 5
+        self.assertEqual(resolve_gather_database(Parent, 'replica', max_replica_lag=1), 'default')
+        self.assertEqual(resolve_gather_database(Parent, 'replica', max_replica_lag=10), 'replica')
+
+        replica_lag.return_value = None
+        self.assertEqual(resolve_gather_database(Parent, 'replica', max_replica_lag=10), 'default')
+        replica_lag.assert_called_with('replica')
+
+    def test_lagging_replica_falls_back(self):
+        replica_lag.return_value = 5
+        with self.assertNumQueries(0, using='replica'):
+            side_effects = gather_deletion_side_effects(Parent, [self.parent], using='replica', max_replica_lag=1)
+        self.assertEqual(side_effects[0]['msg'], '1 children deleted')
+
+        replica_lag.return_value = 0
+        with self.assertNumQueries(0):
+            gather_deletion_side_effects(Parent, [self.parent], using='replica', max_replica_lag=1)
+
+    def test_agather_lagging_replica_falls_back(self):
+        replica_lag.return_value = 5
+        with self.assertNumQueries(0, using='replica'):
+            side_effects = async_to_sync(agather_deletion_side_effects)(
+                Parent, [self.parent], using='replica', max_replica_lag=1)
+        self.assertEqual(side_effects[0]['msg'], '1 children deleted')
+
+
+class TestGetReplicaLag(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_no_lag(self):
+        self.assertEqual(get_replica_lag('replica'), 0)
+
+    def make_connections(self, lag):
+        connection = MagicMock(vendor='postgresql')
+        connection.cursor.return_value.__enter__.return_value.fetchone.return_value = (lag,)
+        return {'replica': connection}
+
+    def test_postgresql(self):
+        with patch('deletion_side_effects.routing.connections', self.make_connections(2.5)):
+            self.assertEqual(get_replica_lag('replica'), 2.5)
+        with patch('deletion_side_effects.routing.connections', self.make_connections(None)):
+            self.assertIsNone(get_replica_lag('replica'))
+
+
+class TestUseGatherDatabase(TransactionTestCase):
+    def test_use_gather_database(self):
+        with use_gather_database('replica'):
+            self.assertEqual(get_gather_database(), 'replica')
+            with use_gather_database(None):
+                self.assertEqual(get_gather_database(), 'replica')
+        self.assertIsNone(get_gather_database())
@@ -0,0 +1,50 @@
+import uuid
+
+from django.db import models
+from django.test import SimpleTestCase
+from unittest.mock import Mock
+
+from deletion_side_effects.spill import SpillStore
+from deletion_side_effects.tests.models import Parent
+
+
+class TestSpilledKeySet(SimpleTestCase):
+    def setUp(self):
+        self.store = SpillStore()
+        self.addCleanup(self.store.close)
+
+    def test_int_keys(self):
+        keys = self.store.create_key_set(Parent)
+        self.assertEqual(len(keys), 0)
+
+        keys.add(3)
+        keys.update(range(1000))
+        self.assertEqual(len(keys), 1000)
+        self.assertIn(999, keys)
+        self.assertNotIn(1000, keys)
+        self.assertEqual(list(keys), list(range(1000)))
+        self.assertEqual(keys.get_new_keys([1001, 5, 1000]), [1001, 1000])
+        self.assertEqual(list(keys.iter_chunks(400)), [
+            list(range(400)), list(range(400, 800)), list(range(800, 1000)),
+        ])
+
+    def test_update_from_key_set(self):
+        keys = self.store.create_key_set(Parent)
+        other_keys = self.store.create_key_set(Parent)
+        keys.update([1, 2])
+        other_keys.update([2, 3])
+
+        keys.update(other_keys)
+        self.assertEqual(list(keys), [1, 2, 3])
+        self.assertEqual(list(other_keys), [2, 3])
+
+    def test_uuid_keys(self):
+        model_class = Mock(_meta=Mock(pk=models.UUIDField()))
+        keys = self.store.create_key_set(model_class)
+        uuids = sorted(uuid.uuid4() for _ in range(3))
+
+        keys.update(uuids[:2])
+        self.assertIn(uuids[0], keys)
+        self.assertNotIn(uuids[2], keys)
+        self.assertEqual(keys.get_new_keys(uuids), uuids[2:])
+        self.assertEqual(sorted(keys), uuids[:2])
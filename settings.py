@@ -40,6 +40,8 @@ def configure_settings():
             NOSE_ARGS=['--nocapture', '--nologcapture', '--verbosity=1'],
             DATABASES={
                 'default': db_config,
+                # A read replica of the default database for the routing tests
+                'replica': dict(db_config, TEST={'MIRROR': 'default'}),
             },
             INSTALLED_APPS=(
                 'django.contrib.auth',
@@ -51,6 +53,7 @@ def configure_settings():
                 'deletion_side_effects.tests',
             ),
             DEBUG=False,
+            DEFAULT_AUTO_FIELD='django.db.models.AutoField',
             MIDDLEWARE=(
                 'django.contrib.auth.middleware.AuthenticationMiddleware',
                 'django.contrib.messages.middleware.MessageMiddleware',
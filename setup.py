@@ -34,7 +34,7 @@ setup(
     author='Wes Kendall',
     author_email='opensource@ambition.com',
     keywords='',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 3.7',